@@ -1,8 +1,50 @@
-from .model import ChoiceModel, MultinomialLogit
-from .utility import Utility
-from .interface import Interface, PylogitInterface, AlogitInterface
-from .synthetic import synthetic_model, synthetic_data, synthetic_data_uniform
-
-__all__ = ['ChoiceModel', 'MultinomialLogit', 'Utility', 'Interface',
-           'PylogitInterface', 'AlogitInterface', 'synthetic_model',
-           'synthetic_data', 'synthetic_data_uniform']
+"""
+Discrete choice models and interfaces to the back ends that estimate them.
+
+Public names are resolved lazily on first access so that importing the package
+does not import pandas, yaml, scipy or any of the estimation back ends.
+"""
+
+from ._lazy import lazy_attributes
+
+# Map of public names to the submodule which defines them
+_LAZY_ATTRIBUTES = {
+    'ChoiceModel': '.model',
+    'MultinomialLogit': '.model',
+    'MixedLogit': '.model',
+    'NestedLogit': '.model',
+    'LatentClassLogit': '.model',
+    'Utility': '.utility',
+    'UtilityKernel': '.kernel',
+    'Design': '.design',
+    'RaggedDesign': '.design',
+    'SampledDesign': '.design',
+    'Interface': '.interface',
+    'PylogitInterface': '.interface',
+    'AlogitInterface': '.interface',
+    'NativeInterface': '.interface',
+    'get_interface': '.interface',
+    'best_interface': '.interface',
+    'register_interface': '.interface',
+    'available_interfaces': '.interface',
+    'Preprocessor': '.preprocess',
+    'elasticities': '.analysis',
+    'marginal_effects': '.analysis',
+    'Scenarios': '.analysis',
+    'logsums': '.analysis',
+    'accessibility': '.analysis',
+    'Scorer': '.scoring',
+    'synthetic_model': '.synthetic',
+    'synthetic_data': '.synthetic',
+    'synthetic_data_uniform': '.synthetic',
+    }
+
+# Submodules which may be accessed as attributes of the package
+_SUBMODULES = ('model', 'utility', 'kernel', 'design', 'engine', 'draws',
+               'optimize', 'interface', 'preprocess', 'analysis',
+               'scoring', 'synthetic')
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+__getattr__, __dir__ = lazy_attributes(__name__, _LAZY_ATTRIBUTES,
+                                       _SUBMODULES)
@@ -0,0 +1,49 @@
+"""
+Lazy resolution of the public names of packages
+
+A package lists its public names and the submodules defining them, and the
+submodules are imported only when a name is first accessed, by the module
+__getattr__ and __dir__ functions of PEP 562.
+"""
+
+from importlib import import_module
+import sys
+
+
+def lazy_attributes(package, attributes, submodules=()):
+    """
+    Create the module __getattr__ and __dir__ functions of a package whose
+    public names are imported on first access.
+
+    Args:
+        package (str): The name of the package.
+        attributes (dict): Map of public names to the relative name of the
+            submodule which defines them, for example {'Design': '.design'}.
+        submodules (iterable of str, optional): The submodules which may be
+            accessed as attributes of the package.
+
+    Returns:
+        (tuple): The __getattr__ and __dir__ functions of the package.
+    """
+    submodules = tuple(submodules)
+
+    def __getattr__(name):
+        """
+        Import the submodule defining a public name on first access.
+        """
+        if name in attributes:
+            value = getattr(import_module(attributes[name], package), name)
+        elif name in submodules:
+            value = import_module('.' + name, package)
+        else:
+            raise AttributeError(
+                'module {!r} has no attribute {!r}'.format(package, name))
+
+        # Cache the value so that __getattr__ is only called once per name
+        setattr(sys.modules[package], name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(vars(sys.modules[package])) | set(attributes))
+
+    return __getattr__, __dir__
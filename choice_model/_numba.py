@@ -0,0 +1,135 @@
+"""
+Numba compiled multinomial logit kernels
+
+This module imports numba and so is only imported by the numba engine.
+
+The kernels take the non-intercept utility terms grouped by alternative, so
+that the terms of alternative j are those from term_pointer[j] to
+term_pointer[j+1], with the coefficient and data field of each term. The
+gradient is accumulated for each term and intercept and mapped onto the
+parameters by the caller, which keeps the inner loops free of scattered
+writes.
+
+Observations are divided into chunks which are processed in parallel, each
+chunk accumulating into its own row of the reduction arrays. Utilities are
+evaluated in the precision of the data, while the log likelihood and gradient
+are always accumulated in double precision.
+"""
+
+import numba
+import numpy as np
+
+# Allow reordering of floating point sums so that loops can be vectorised
+_FASTMATH = {'reassoc', 'contract', 'nsz', 'arcp'}
+
+
+@numba.njit(cache=True, fastmath=_FASTMATH)
+def _utilities(data, availability, coefficients, intercepts, term_pointer,
+               term_field, observation, utilities):
+    """
+    Evaluate the utilities of one observation, with unavailable alternatives
+    set to -inf, returning the maximum utility of the available alternatives.
+
+    availability holds the availability of each alternative packed into the
+    bits of each byte, most significant bit first, as by numpy.packbits.
+    """
+    maximum = -np.inf
+    for alternative in range(intercepts.shape[0]):
+        if not (availability[observation, alternative >> 3]
+                >> (7 - (alternative & 7))) & 1:
+            utilities[alternative] = -np.inf
+            continue
+        utility = intercepts[alternative]
+        for term in range(term_pointer[alternative],
+                          term_pointer[alternative+1]):
+            utility += coefficients[term] * data[observation, term_field[term]]
+        utilities[alternative] = utility
+        if utility > maximum:
+            maximum = utility
+    return maximum
+
+
+@numba.njit(parallel=True, cache=True, fastmath=_FASTMATH)
+def log_likelihood_and_gradient(data, availability, choices, weights,
+                                coefficients, intercepts, term_pointer,
+                                term_field, number_of_chunks):
+    """
+    Calculate the log likelihood and its gradient with respect to the
+    coefficient of each term and each alternative's intercept.
+
+    weights holds the weight of each observation, or is empty if observations
+    are not weighted.
+    """
+    weighted = weights.shape[0] > 0
+    number_of_observations = data.shape[0]
+    number_of_alternatives = intercepts.shape[0]
+    chunk_size = ((number_of_observations + number_of_chunks - 1)
+                  // number_of_chunks)
+
+    log_likelihood = np.zeros(number_of_chunks)
+    term_gradient = np.zeros((number_of_chunks, coefficients.shape[0]))
+    intercept_gradient = np.zeros((number_of_chunks, number_of_alternatives))
+
+    for chunk in numba.prange(number_of_chunks):
+        utilities = np.empty(number_of_alternatives, dtype=data.dtype)
+        start = chunk * chunk_size
+        stop = min(start + chunk_size, number_of_observations)
+        for observation in range(start, stop):
+            maximum = _utilities(data, availability, coefficients, intercepts,
+                                 term_pointer, term_field, observation,
+                                 utilities)
+
+            choice = choices[observation]
+            chosen_utility = utilities[choice]
+            weight = weights[observation] if weighted else 1.
+
+            # Exponentiate, shifted by the maximum to avoid overflow.
+            # Unavailable alternatives become zero.
+            total = 0.
+            for alternative in range(number_of_alternatives):
+                utilities[alternative] = np.exp(utilities[alternative]
+                                                - maximum)
+                total += utilities[alternative]
+
+            log_likelihood[chunk] += weight * (chosen_utility - maximum
+                                               - np.log(total))
+
+            # Gradient contribution is (chosen - probability) * variable. Zero
+            # residuals, including those of unavailable alternatives whose
+            # data may not be finite, are skipped.
+            for alternative in range(number_of_alternatives):
+                residual = -utilities[alternative] / total
+                if alternative == choice:
+                    residual += 1.
+                if residual == 0.:
+                    continue
+                residual *= weight
+                intercept_gradient[chunk, alternative] += residual
+                for term in range(term_pointer[alternative],
+                                  term_pointer[alternative+1]):
+                    term_gradient[chunk, term] += (
+                        residual * data[observation, term_field[term]])
+
+    return (log_likelihood.sum(), term_gradient.sum(axis=0),
+            intercept_gradient.sum(axis=0))
+
+
+@numba.njit(parallel=True, cache=True, fastmath=_FASTMATH)
+def probabilities(data, availability, coefficients, intercepts, term_pointer,
+                  term_field, out):
+    """
+    Calculate the choice probabilities of all alternatives, writing them to
+    out.
+    """
+    number_of_alternatives = intercepts.shape[0]
+    for observation in numba.prange(data.shape[0]):
+        utilities = np.empty(number_of_alternatives, dtype=data.dtype)
+        maximum = _utilities(data, availability, coefficients, intercepts,
+                             term_pointer, term_field, observation, utilities)
+        total = 0.
+        for alternative in range(number_of_alternatives):
+            utilities[alternative] = np.exp(utilities[alternative] - maximum)
+            total += utilities[alternative]
+        for alternative in range(number_of_alternatives):
+            out[observation, alternative] = utilities[alternative] / total
+    return out
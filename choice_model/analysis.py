@@ -0,0 +1,692 @@
+"""
+Elasticities, marginal effects and scenarios of estimated multinomial logit
+models
+
+The elasticity of the probability of alternative j with respect to an
+attribute, a variable of the utility of alternative k, is
+
+    E_njk = b_k x_nk (d_jk - P_nk)
+
+and the marginal effect, the derivative of the probability, is
+
+    M_njk = b_k P_nj (d_jk - P_nk)
+
+where b_k is the coefficient of the variable in the utility of alternative k,
+x_nk its value in observation n and d_jk is one if j is k and zero otherwise.
+Direct elasticities are those with j equal to k and cross elasticities the
+others.
+
+Results are evaluated for every attribute at once from the estimated
+parameters and the model's specification, a chunk of observations at a time,
+and aggregated by sample enumeration: elasticities are averaged weighted by
+the probability of the alternative, the elasticity of the expected demand,
+and marginal effects are averaged over the observations.
+
+Scenarios simulates changes of variables, recomputing the probabilities and
+market shares from cached baseline utilities and updating only the utilities
+of the alternatives and observations whose variables change.
+
+The logsum, log sum_j exp(V_nj), is the expected maximum utility of an
+observation, and divided by minus the cost coefficient its consumer surplus.
+Accessibility aggregates logsums by segments of large populations or zone
+pair tables read in chunks.
+"""
+
+from collections import namedtuple
+from .design import Design
+from .engine import _CHUNK_ELEMENTS
+from .model import LatentClassLogit, MixedLogit, NestedLogit
+import numpy as np
+
+# The market shares of the alternatives and, if requested, the probabilities
+# of each observation of a scenario
+ScenarioResult = namedtuple('ScenarioResult', ['shares', 'probabilities'])
+
+
+def elasticities(interface, data=None, weights=None, chunk_size=None):
+    """
+    Calculate the sample enumeration elasticities of every alternative's
+    probability with respect to every attribute.
+
+    Args:
+        interface (Interface): An estimated interface of a multinomial logit
+            model.
+        data (DataFrame, optional): The data to evaluate. If not supplied the
+            model's data is used.
+        weights (array_like or str, optional): The weight of each
+            observation, or the label of the data column holding them.
+        chunk_size (int, optional): The number of observations evaluated at
+            a time. If not supplied it is chosen to limit the size of
+            temporary arrays.
+
+    Returns:
+        (DataFrame): The aggregate elasticities. The index is the variable
+            and alternative of each attribute and the columns are the
+            alternatives whose probabilities change.
+    """
+    analysis = _Analysis(interface, data, chunk_size)
+    weights = analysis.weights(weights)
+
+    alternative = analysis.attribute_alternative
+    numerator = np.zeros((analysis.number_of_attributes,
+                          analysis.number_of_alternatives))
+    demand = np.zeros(analysis.number_of_alternatives)
+    for rows, probabilities in analysis.probabilities():
+        values = analysis.values(rows, probabilities)
+        attribute_probabilities = probabilities[:, alternative]
+        if weights is not None:
+            probabilities = probabilities * weights[rows, np.newaxis]
+
+        # Sum of P_nj E_njk over the observations, as matrix products
+        # rather than a three dimensional array of elasticities
+        direct = np.einsum('na,na->a', values, probabilities[:, alternative])
+        numerator -= (values * attribute_probabilities).T @ probabilities
+        numerator[np.arange(len(alternative)), alternative] += direct
+        demand += probabilities.sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = (analysis.coefficients[:, np.newaxis] * numerator
+                  / demand)
+    return analysis.frame(result)
+
+
+def marginal_effects(interface, data=None, weights=None, chunk_size=None):
+    """
+    Calculate the average marginal effects on every alternative's
+    probability of every attribute.
+
+    Args:
+        interface (Interface): An estimated interface of a multinomial logit
+            model.
+        data (DataFrame, optional): The data to evaluate. If not supplied the
+            model's data is used.
+        weights (array_like or str, optional): The weight of each
+            observation, or the label of the data column holding them.
+        chunk_size (int, optional): The number of observations evaluated at
+            a time, as for elasticities.
+
+    Returns:
+        (DataFrame): The average marginal effects, indexed as the result of
+            elasticities.
+    """
+    analysis = _Analysis(interface, data, chunk_size)
+    weights = analysis.weights(weights)
+
+    # Marginal effects do not depend on the attribute values, only on the
+    # sums of P_nk and P_nj P_nk
+    number_of_alternatives = analysis.number_of_alternatives
+    shares = np.zeros(number_of_alternatives)
+    products = np.zeros((number_of_alternatives, number_of_alternatives))
+    total = 0.
+    for rows, probabilities in analysis.probabilities():
+        weighted = probabilities
+        if weights is not None:
+            weighted = probabilities * weights[rows, np.newaxis]
+            total += weights[rows].sum()
+        else:
+            total += len(probabilities)
+        shares += weighted.sum(axis=0)
+        products += weighted.T @ probabilities
+
+    alternative = analysis.attribute_alternative
+    result = -products[alternative]
+    result[np.arange(len(alternative)), alternative] += shares[alternative]
+    return analysis.frame(analysis.coefficients[:, np.newaxis] * result
+                          / total)
+
+
+def observation_elasticities(interface, variable, alternative, data=None,
+                             chunk_size=None):
+    """
+    Calculate the elasticity of every alternative's probability with respect
+    to an attribute in each observation.
+
+    Args:
+        interface (Interface): An estimated interface of a multinomial logit
+            model.
+        variable (str): The variable of the attribute.
+        alternative (str): The alternative whose utility the variable is in.
+        data (DataFrame, optional): The data to evaluate. If not supplied the
+            model's data is used.
+        chunk_size (int, optional): The number of observations evaluated at
+            a time, as for elasticities.
+
+    Returns:
+        (DataFrame): The elasticities, with the index of the data and a
+            column for each alternative. Elasticities of unavailable
+            alternatives are NaN.
+    """
+    return _observation_effects(interface, variable, alternative, data,
+                                chunk_size, elasticity=True)
+
+
+def observation_marginal_effects(interface, variable, alternative, data=None,
+                                 chunk_size=None):
+    """
+    Calculate the marginal effect on every alternative's probability of an
+    attribute in each observation.
+
+    Args:
+        interface (Interface): An estimated interface of a multinomial logit
+            model.
+        variable (str): The variable of the attribute.
+        alternative (str): The alternative whose utility the variable is in.
+        data (DataFrame, optional): The data to evaluate. If not supplied the
+            model's data is used.
+        chunk_size (int, optional): The number of observations evaluated at
+            a time, as for elasticities.
+
+    Returns:
+        (DataFrame): The marginal effects, with the index of the data and a
+            column for each alternative.
+    """
+    return _observation_effects(interface, variable, alternative, data,
+                                chunk_size, elasticity=False)
+
+
+def _observation_effects(interface, variable, alternative, data, chunk_size,
+                         elasticity):
+    """
+    Calculate the elasticities or marginal effects of an attribute in each
+    observation.
+    """
+    import pandas as pd
+
+    analysis = _Analysis(interface, data, chunk_size)
+    attribute = analysis.attribute(variable, alternative)
+    k = analysis.attribute_alternative[attribute]
+    coefficient = analysis.coefficients[attribute]
+
+    result = np.empty((analysis.number_of_observations,
+                       analysis.number_of_alternatives))
+    for rows, probabilities in analysis.probabilities():
+        effects = np.empty_like(probabilities)
+        effects[:] = -coefficient * probabilities[:, [k]]
+        effects[:, k] += coefficient
+        if elasticity:
+            effects *= analysis.values(rows, probabilities)[:, [attribute]]
+            effects[probabilities == 0.] = np.nan
+        else:
+            effects *= probabilities
+        result[rows] = effects
+
+    return pd.DataFrame(result, index=analysis.index,
+                        columns=analysis.model.alternatives)
+
+
+def logsums(interface, data=None, chunk_size=None):
+    """
+    Calculate the logsum, the expected maximum utility, of each observation.
+
+    Args:
+        interface (Interface): An estimated interface of a multinomial logit
+            model.
+        data (DataFrame, optional): The data to evaluate, which need not have
+            a choice column. If not supplied the model's data is used.
+        chunk_size (int, optional): The number of observations evaluated at
+            a time, as for elasticities.
+
+    Returns:
+        (Series): The logsum of each observation, with the index of the data.
+            The logsum is -inf if no alternative is available.
+    """
+    import pandas as pd
+
+    analysis = _Analysis(interface, data, chunk_size)
+    return pd.Series(analysis.logsums(), index=analysis.index, name='logsum')
+
+
+def accessibility(interface, segments, data=None, weights=None,
+                  cost_parameter=None, chunk_size=None):
+    """
+    Calculate the mean logsum of each segment of a population.
+
+    The data may be a dataframe or an iterable of dataframes, such as
+    pandas.read_csv with chunksize, so that populations or zone pair tables
+    larger than memory are streamed. Only the sums of each segment are held
+    between dataframes.
+
+    Args:
+        interface (Interface): An estimated interface of a multinomial logit
+            model.
+        segments (list[str]): The fields defining the segments, for example
+            the origin zone and a car ownership field. These may be derived
+            fields.
+        data (DataFrame or iterable, optional): The data to evaluate, which
+            need not have a choice column. If not supplied the model's data is
+            used.
+        weights (array_like or str, optional): The weight of each
+            observation, such as the number of people a row represents, or
+            the label of the data column holding them. An array may only be
+            given for a single dataframe.
+        cost_parameter (str, optional): The cost coefficient. If given, the
+            mean consumer surplus, the logsum divided by minus the cost
+            coefficient, of each segment is included.
+        chunk_size (int, optional): The number of observations evaluated at
+            a time, as for elasticities.
+
+    Returns:
+        (DataFrame): For each segment, indexed by the segment fields, the
+            weighted mean logsum 'logsum', the total weight (or number of
+            observations) 'weight' and, if cost_parameter is given, the mean
+            consumer surplus 'consumer_surplus'.
+    """
+    import pandas as pd
+
+    segments = list(segments)
+    if data is None:
+        data = interface.model.data
+    if isinstance(data, pd.DataFrame):
+        data = [data]
+
+    sums = []
+    for piece in data:
+        analysis = _Analysis(interface, piece, chunk_size)
+        piece_weights = analysis.weights(weights)
+        if piece_weights is None:
+            piece_weights = np.ones(analysis.number_of_observations)
+        frame = pd.DataFrame(
+            {segment: analysis.column(segment) for segment in segments})
+        frame['logsum'] = piece_weights * analysis.logsums()
+        frame['weight'] = piece_weights
+        sums.append(frame.groupby(segments).sum())
+    sums = pd.concat(sums).groupby(level=segments).sum()
+
+    result = pd.DataFrame({'logsum': sums['logsum'] / sums['weight'],
+                           'weight': sums['weight']})
+    if cost_parameter is not None:
+        result['consumer_surplus'] = (
+            -result['logsum'] / interface.parameters()[cost_parameter])
+    return result
+
+
+class _Analysis(object):
+    """
+    The compiled data, parameters and attributes of an estimated multinomial
+    logit model.
+    """
+
+    def __init__(self, interface, data, chunk_size):
+        model = interface.model
+        if isinstance(model, (MixedLogit, NestedLogit, LatentClassLogit)):
+            raise TypeError(
+                'Analysis is only available for multinomial logit models,'
+                ' not {}'.format(type(model).__name__))
+        if data is None:
+            data = model.data
+        self.model = model
+        self.data = data
+        self.index = data.index
+        self.design = Design(model, data)
+
+        parameters = interface.parameters()
+        kernel = self.design.kernel
+        self.parameters = kernel.parameter_vector(parameters)
+
+        # The (variable, alternative) attributes, with the coefficient of
+        # the variable summed over the alternative's terms
+        self.attributes = []
+        alternatives = []
+        fields = []
+        coefficients = []
+        for k, alternative in enumerate(model.alternatives):
+            coefficient = {}
+            for term in model.specification[alternative].terms:
+                coefficient[term.variable] = (
+                    coefficient.get(term.variable, 0.)
+                    + parameters[term.parameter])
+            for variable, value in coefficient.items():
+                self.attributes.append((variable, alternative))
+                alternatives.append(k)
+                fields.append(kernel.fields.index(
+                    model.variable_field(variable, alternative)))
+                coefficients.append(value)
+        self.attribute_alternative = np.array(alternatives, dtype=np.intp)
+        self.attribute_field = np.array(fields, dtype=np.intp)
+        self.coefficients = np.array(coefficients, dtype=np.float64)
+
+        if chunk_size is None:
+            chunk_size = max(1, _CHUNK_ELEMENTS // (
+                self.number_of_alternatives + self.number_of_attributes))
+        self.chunk_size = chunk_size
+
+    @property
+    def number_of_observations(self):
+        return self.design.number_of_observations
+
+    @property
+    def number_of_alternatives(self):
+        return self.design.number_of_alternatives
+
+    @property
+    def number_of_attributes(self):
+        return len(self.attributes)
+
+    def attribute(self, variable, alternative):
+        """
+        Find the index of an attribute.
+        """
+        try:
+            return self.attributes.index((variable, alternative))
+        except ValueError:
+            raise ValueError(
+                'Variable "{}" is not in the utility of alternative "{}"'
+                .format(variable, alternative)) from None
+
+    def weights(self, weights):
+        """
+        Produce the observation weights as an array, or None.
+        """
+        if isinstance(weights, str):
+            weights = self.data[weights].to_numpy()
+        if weights is None:
+            return None
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.shape != (self.number_of_observations,):
+            raise ValueError(
+                'Expected {} observation weights, received shape {}'.format(
+                    self.number_of_observations, weights.shape))
+        return weights
+
+    def probabilities(self):
+        """
+        Produce the slice and the choice probabilities of each chunk of
+        observations.
+        """
+        for rows in self.chunks():
+            yield rows, _softmax(self.utilities(rows))
+
+    def chunks(self):
+        """
+        Produce slices dividing the observations into chunks.
+        """
+        for start in range(0, self.number_of_observations, self.chunk_size):
+            yield slice(start, start + self.chunk_size)
+
+    def logsums(self):
+        """
+        Calculate the logsum of each observation.
+        """
+        result = np.empty(self.number_of_observations)
+        for rows in self.chunks():
+            utilities = self.utilities(rows)
+            maximum = utilities.max(axis=1)
+            finite = np.isfinite(maximum)
+            utilities[finite] -= maximum[finite, np.newaxis]
+            np.exp(utilities, out=utilities)
+            result[rows] = maximum + np.log(utilities.sum(axis=1))
+        return result
+
+    def column(self, label):
+        """
+        Produce the values of a field of the data, which may be a derived
+        field.
+        """
+        if label in self.data.columns:
+            return self.data[label].to_numpy()
+        return self.model.materialise(self.data)[label].to_numpy()
+
+    def utilities(self, rows):
+        """
+        Evaluate the utilities of a chunk of observations in double
+        precision, with unavailable alternatives set to -inf. Missing values
+        of unavailable alternatives are masked before the matrix product so
+        that they do not reach the utilities of available alternatives.
+        """
+        design = self.design
+        utilities = design.kernel.utilities(
+            design.masked_data(rows).astype(np.float64, copy=False),
+            self.parameters)
+        if not design.all_available:
+            utilities[~design.availability(rows)] = -np.inf
+        return utilities
+
+    def values(self, rows, probabilities):
+        """
+        Produce the value of each attribute in a chunk of observations, zero
+        where the attribute's alternative is unavailable.
+        """
+        values = self.design.data[rows][:, self.attribute_field].astype(
+            np.float64)
+        values[probabilities[:, self.attribute_alternative] == 0.] = 0.
+        return values
+
+    def frame(self, result):
+        """
+        Arrange an array of a result for each attribute and alternative as a
+        dataframe.
+        """
+        import pandas as pd
+
+        index = pd.MultiIndex.from_tuples(self.attributes,
+                                          names=['variable', 'alternative'])
+        return pd.DataFrame(result, index=index,
+                            columns=self.model.alternatives)
+
+
+class Scenarios(object):
+    """
+    Simulation of policy scenarios from an estimated multinomial logit model
+
+    The utilities and probabilities of the baseline are evaluated once. A
+    scenario gives new values of variable fields, for example
+
+        scenarios.simulate({
+            'car_cost': 'car_cost * 1.1',
+            'public_transport_time': 'where(central_zone == 1,'
+                                     ' public_transport_time - 300,'
+                                     ' public_transport_time)'
+            })
+
+    Derived fields evaluated from changed fields are re-evaluated, and only
+    the utilities of the alternatives whose utilities contain the changed
+    fields, in the observations where the values change, are updated from the
+    baseline before the probabilities of those observations are recomputed.
+
+    Args:
+        interface (Interface): An estimated interface of a multinomial logit
+            model.
+        data (DataFrame, optional): The data of the baseline. If not
+            supplied the model's data is used.
+        weights (array_like or str, optional): The weight of each
+            observation in the market shares, or the label of the data column
+            holding them.
+
+    Attributes:
+        baseline (ScenarioResult): The market shares and probabilities of the
+            baseline.
+    """
+
+    def __init__(self, interface, data=None, weights=None):
+        import pandas as pd
+
+        analysis = _Analysis(interface, data, chunk_size=None)
+        self._analysis = analysis
+        self._data = analysis.model.materialise(analysis.data)
+        self._weights = analysis.weights(weights)
+        design = analysis.design
+        self._coefficients = design.kernel.coefficients(analysis.parameters)
+        self._availability = (None if design.all_available
+                              else design.availability())
+
+        # Baseline utilities, probabilities and weighted sums of the
+        # probabilities
+        shape = (analysis.number_of_observations,
+                 analysis.number_of_alternatives)
+        self._utilities = np.empty(shape)
+        self._probabilities = np.empty(shape)
+        for rows in analysis.chunks():
+            self._utilities[rows] = analysis.utilities(rows)
+            self._probabilities[rows] = _softmax(self._utilities[rows].copy())
+        self._totals = self._sum(self._probabilities, slice(None))
+        self._total_weight = (analysis.number_of_observations
+                              if self._weights is None
+                              else self._weights.sum())
+
+        self.baseline = ScenarioResult(
+            self._shares(self._totals),
+            pd.DataFrame(self._probabilities, index=analysis.index,
+                         columns=analysis.model.alternatives))
+
+    def simulate(self, changes, probabilities=False):
+        """
+        Simulate a scenario.
+
+        Args:
+            changes (dict): The new values of the changed fields, keyed by
+                field label. Each value is an expression of the fields of the
+                data, as for preprocess.Preprocessor, a number or an array of
+                the value in each observation. The changed fields may be
+                variable fields, derived fields, or fields which derived
+                variable fields are evaluated from, in which case the derived
+                fields are re-evaluated.
+            probabilities (bool, optional): If True the probabilities of
+                every observation are also produced.
+
+        Returns:
+            (ScenarioResult): The market shares and, if requested, the
+                probabilities of the scenario.
+
+        Raises:
+            ValueError: Raised if a changed field does not affect the
+                utilities, changes availability, or an array of values has
+                the wrong shape.
+        """
+        import pandas as pd
+
+        analysis = self._analysis
+        kernel = analysis.design.kernel
+        values = self._changed_values(changes)
+
+        # The change of each variable field, and the observations in which
+        # any field changes
+        differences = {}
+        changed = np.zeros(analysis.number_of_observations, dtype=bool)
+        for field, field_values in values.items():
+            if field not in kernel.fields:
+                continue
+            index = kernel.fields.index(field)
+            difference = field_values - analysis.design.data[:, index]
+            if self._availability is not None:
+                # Values of fields used only by unavailable alternatives,
+                # which may be missing, do not change the utilities
+                alternatives = kernel.term_alternative[
+                    kernel.term_field == index]
+                difference[
+                    ~self._availability[:, alternatives].any(axis=1)] = 0.
+            changed |= difference != 0.
+            differences[index] = difference
+        rows = np.nonzero(changed)[0]
+
+        utilities = self._utilities[rows]
+        for index, difference in differences.items():
+            alternatives = np.nonzero(self._coefficients[index])[0]
+            utilities[:, alternatives] += np.outer(
+                difference[rows], self._coefficients[index, alternatives])
+        changed_probabilities = _softmax(utilities)
+
+        totals = (self._totals - self._sum(self._probabilities[rows], rows)
+                  + self._sum(changed_probabilities, rows))
+        if not probabilities:
+            return ScenarioResult(self._shares(totals), None)
+
+        scenario_probabilities = self._probabilities.copy()
+        scenario_probabilities[rows] = changed_probabilities
+        return ScenarioResult(
+            self._shares(totals),
+            pd.DataFrame(scenario_probabilities, index=analysis.index,
+                         columns=analysis.model.alternatives))
+
+    def _changed_values(self, changes):
+        """
+        Evaluate the new values of the changed fields and of the derived
+        fields which depend on them.
+        """
+        model = self._analysis.model
+        kernel = self._analysis.design.kernel
+        for field in changes:
+            if field not in self._data.columns:
+                raise ValueError('Field "{}" is not in the data'.format(field))
+        values = {field: self._values(field_values)
+                  for field, field_values in changes.items()}
+
+        # Derived fields are listed in order of evaluation, so those
+        # depending on changed fields, directly or through other derived
+        # fields, are re-evaluated after their dependencies. A derived field
+        # which is itself changed keeps its new values.
+        sources = {field: {field} for field in values}
+        for label in model.derived_fields():
+            dependencies = model._derived_dependencies(label)
+            changed = set().union(*(sources[name] for name in dependencies
+                                    if name in sources))
+            if not changed:
+                continue
+            sources[label] = sources.get(label, set()) | changed
+            if label not in changes:
+                values[label] = model.evaluate_derived(label, {
+                    name: (values[name] if name in values
+                           else self._data[name].to_numpy())
+                    for name in dependencies}, self._data).astype(np.float64)
+
+        availability = set(model.availability_fields())
+        for field in changes:
+            affected = [label for label, fields in sources.items()
+                        if field in fields]
+            if availability.intersection(affected):
+                raise ValueError(
+                    'Field "{}" changes the availability of alternatives'
+                    .format(field))
+            if not set(kernel.fields).intersection(affected):
+                raise ValueError(
+                    'Field "{}" is not a variable of the utilities'.format(
+                        field))
+        return values
+
+    def _values(self, values):
+        """
+        Evaluate the new values of a field.
+        """
+        from .preprocess import evaluate, expression_columns, _as_column
+
+        number_of_observations = self._analysis.number_of_observations
+        if isinstance(values, str):
+            values = evaluate(values, {
+                name: self._data[name].to_numpy()
+                for name in expression_columns(values)
+                if name in self._data.columns})
+        values = _as_column(values, number_of_observations).astype(
+            np.float64)
+        if values.shape != (number_of_observations,):
+            raise ValueError(
+                'Expected {} values, received shape {}'.format(
+                    number_of_observations, values.shape))
+        return values
+
+    def _sum(self, probabilities, rows):
+        """
+        Sum the probabilities of observations, weighted if observations are
+        weighted.
+        """
+        if self._weights is None:
+            return probabilities.sum(axis=0)
+        return self._weights[rows] @ probabilities
+
+    def _shares(self, totals):
+        """
+        Produce the market shares of the alternatives from the weighted sums
+        of their probabilities.
+        """
+        import pandas as pd
+
+        return pd.Series(totals / self._total_weight,
+                         index=self._analysis.model.alternatives)
+
+
+def _softmax(utilities):
+    """
+    Calculate probabilities from utilities, in place.
+    """
+    utilities -= utilities.max(axis=1, keepdims=True)
+    np.exp(utilities, out=utilities)
+    utilities /= utilities.sum(axis=1, keepdims=True)
+    return utilities
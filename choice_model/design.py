@@ -0,0 +1,642 @@
+"""
+Compiled numerical representation of a model and its data
+"""
+
+from .kernel import UtilityKernel
+import numpy as np
+
+
+class Design(object):
+    """
+    Compiled design of a multinomial logit model
+
+    The design holds the model's data as numerical arrays in the layout used
+    by the native estimation engines. The variables are held in a single
+    contiguous floating point block, availability is packed into bitmaps with
+    one bit per alternative and choices are held as the smallest integer codes
+    able to index the alternatives.
+
+    Args:
+        model (MultinomialLogit): The model to compile.
+        data (DataFrame, optional): The data to compile. If not supplied the
+            data loaded into model is used. The model's derived fields are
+            evaluated from it.
+        dtype (numpy.dtype, optional): The floating point type of the data
+            matrix, and so of utilities and probabilities evaluated from it.
+            If not supplied, single precision is used if every field is
+            stored in single precision and double precision otherwise.
+
+    Attributes:
+        kernel (UtilityKernel): The utility kernel of the model.
+        dtype (numpy.dtype): The floating point type of the data matrix.
+        data (numpy.ndarray): The data matrix of shape (number of
+            observations, number of fields).
+        packed_availability (numpy.ndarray): Array of shape (number of
+            observations, number of alternatives / 8 rounded up) of the
+            availability of each alternative packed into bits, most
+            significant bit first, as by numpy.packbits.
+        all_available (bool): True if every alternative is available in
+            every observation.
+        choices (numpy.ndarray or None): The index of the chosen alternative
+            of each observation, or None if data has no choice column.
+    """
+
+    def __init__(self, model, data=None, dtype=None):
+        data = model.materialise(data)
+
+        self.kernel = UtilityKernel(model)
+        if dtype is None:
+            dtype = self._infer_dtype(data[self.kernel.fields])
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError(
+                'The design dtype must be float32 or float64, not {}'.format(
+                    self.dtype)
+                )
+
+        availability = data[
+            [model.availability[alternative]
+             for alternative in model.alternatives]
+            ].to_numpy(dtype=bool)
+
+        if model.choice_column in data.columns:
+            self.choices = self._encode_choices(
+                data[model.choice_column], model.alternatives)
+            self._check_choices_available(availability)
+        else:
+            self.choices = None
+
+        self._compile_data(data, availability)
+
+    def _compile_data(self, data, availability):
+        """
+        Create the data matrix and packed availability.
+        """
+        self.data = self.kernel.data_matrix(data, dtype=self.dtype)
+        self.all_available = bool(availability.all())
+        self.packed_availability = np.packbits(availability, axis=1)
+
+    def availability(self, rows=slice(None)):
+        """
+        Unpack the availability of each alternative.
+
+        Args:
+            rows (slice or numpy.ndarray, optional): The observations to
+                unpack. If not supplied all observations are unpacked.
+
+        Returns:
+            (numpy.ndarray): Boolean array of shape (number of observations,
+                number of alternatives), True where an alternative is
+                available.
+        """
+        return np.unpackbits(self.packed_availability[rows], axis=1,
+                             count=self.number_of_alternatives).view(bool)
+
+    def masked_data(self, rows=slice(None)):
+        """
+        Produce the data matrix of some observations with non-finite values
+        of fields used only by unavailable alternatives set to zero, as by
+        UtilityKernel.mask_unavailable.
+
+        Args:
+            rows (slice or numpy.ndarray, optional): The observations to
+                produce. If not supplied all observations are produced.
+
+        Returns:
+            (numpy.ndarray): The data matrix of the observations.
+        """
+        if self.all_available:
+            return self.data[rows]
+        return self.kernel.mask_unavailable(self.data[rows],
+                                            self.availability(rows))
+
+    @staticmethod
+    def _infer_dtype(fields):
+        """
+        Choose single precision if all fields are stored in single precision
+        and double precision otherwise.
+        """
+        if len(fields.columns) > 0 and all(
+                dtype == np.float32 for dtype in fields.dtypes):
+            return np.float32
+        return np.float64
+
+    @staticmethod
+    def _encode_choices(choices, alternatives):
+        """
+        Encode choice labels as the index of the alternative.
+        """
+        import pandas as pd
+
+        codes = pd.Categorical(choices, categories=alternatives).codes
+        if (codes < 0).any():
+            raise UnknownAlternative(
+                set(choices[codes < 0]).pop(), alternatives)
+        return codes.astype(np.min_scalar_type(len(alternatives) - 1))
+
+    def _check_choices_available(self, availability):
+        """
+        Ensure that the chosen alternative is available in every observation.
+        """
+        chosen_available = availability[
+            np.arange(len(self.choices)), self.choices]
+        if not chosen_available.all():
+            raise ChoiceNotAvailable(np.nonzero(~chosen_available)[0])
+
+    def subset(self, rows):
+        """
+        Produce the design of a subset of the observations, sharing the
+        kernel.
+
+        Args:
+            rows (numpy.ndarray or slice): The observations to include.
+
+        Returns:
+            (Design): The design of the observations.
+        """
+        subset = self._empty_copy()
+        subset.choices = _subset_choices(self.choices, rows)
+        subset.data = self.data[rows]
+        subset.packed_availability = self.packed_availability[rows]
+        subset.all_available = self.all_available
+        return subset
+
+    def append(self, model, data):
+        """
+        Compile observations and append them to the design, so that when
+        observations arrive in batches only the new observations are
+        compiled.
+
+        Args:
+            model (MultinomialLogit): The model of the design.
+            data (DataFrame): The observations to append. They must have a
+                choice column if and only if the design has choices.
+
+        Raises:
+            ValueError: Raised if the observations have choices and the
+                design does not, or the reverse.
+        """
+        self._extend(type(self)(model, data, dtype=self.dtype))
+
+    def _extend(self, other):
+        """
+        Append the observations of another design of the same kernel.
+        """
+        self.choices = _concatenate_choices(self.choices, other.choices)
+        self.data = np.concatenate([self.data, other.data])
+        self.packed_availability = np.concatenate(
+            [self.packed_availability, other.packed_availability])
+        self.all_available = self.all_available and other.all_available
+
+    def _empty_copy(self):
+        """
+        Create a design of the same type, kernel and precision without any
+        data.
+        """
+        copy = object.__new__(type(self))
+        copy.kernel = self.kernel
+        copy.dtype = self.dtype
+        return copy
+
+    @property
+    def number_of_observations(self):
+        return self.data.shape[0]
+
+    @property
+    def number_of_alternatives(self):
+        return self.kernel.number_of_alternatives
+
+    @property
+    def number_of_parameters(self):
+        return self.kernel.number_of_parameters
+
+
+class RaggedDesign(Design):
+    """
+    Compiled design of a multinomial logit model holding only the available
+    alternatives of each observation
+
+    The available (observation, alternative) pairs are numbered in
+    observation order, so that the pairs of observation n are those from
+    indptr[n] to indptr[n+1], as in a compressed sparse row matrix. The
+    values of each alternative's utility terms are stored for only the pairs
+    in which it is available, so memory and computation scale with the number
+    of available pairs rather than the number of observations multiplied by
+    the number of alternatives.
+
+    Args:
+        model (MultinomialLogit): The model to compile.
+        data (DataFrame, optional): The data to compile. If not supplied the
+            data loaded into model is used. The model's derived fields are
+            evaluated from it.
+        dtype (numpy.dtype, optional): The floating point type of the term
+            values, as for Design.
+
+    Attributes:
+        kernel (UtilityKernel): The utility kernel of the model.
+        dtype (numpy.dtype): The floating point type of the term values.
+        indptr (numpy.ndarray): The first pair of each observation, followed
+            by the total number of pairs.
+        pair_alternative (numpy.ndarray): The alternative of each pair.
+        alternative_pairs (list[numpy.ndarray]): The pairs in which each
+            alternative is available.
+        alternative_data (list[numpy.ndarray]): For each alternative, an array
+            of shape (number of pairs of the alternative, number of terms of
+            the alternative) of the values of the variables of its
+            (non-intercept) terms, in the order of the kernel's terms.
+        choices (numpy.ndarray or None): The index of the chosen alternative
+            of each observation, or None if data has no choice column.
+        chosen_pairs (numpy.ndarray or None): The pair of the chosen
+            alternative of each observation, or None if data has no choice
+            column.
+        pair_offset (numpy.ndarray or None): A constant added to the utility
+            of each pair, or None if there is no offset.
+
+    Raises:
+        NoAvailableAlternatives: Raised if any observation has no available
+            alternatives.
+    """
+
+    def _compile_data(self, data, availability):
+        """
+        Gather the term values of the available pairs of each alternative.
+        """
+        counts = availability.sum(axis=1)
+        if not counts.all():
+            raise NoAvailableAlternatives(np.nonzero(counts == 0)[0])
+        self.indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.intp)
+
+        # Pairs in observation order
+        observation, alternative = np.nonzero(availability)
+        self.pair_alternative = alternative.astype(
+            np.min_scalar_type(self.number_of_alternatives - 1))
+
+        # Each distinct field is read once, as a view of the dataframe's
+        # column where its type allows, and fields shared by several
+        # alternatives are gathered from the same column, which is released
+        # after the last alternative using it
+        kernel = self.kernel
+        last_use = dict(zip(kernel.term_field, kernel.term_alternative))
+        columns = {}
+        self.alternative_pairs = []
+        self.alternative_data = []
+        for j in range(self.number_of_alternatives):
+            pairs = np.nonzero(alternative == j)[0]
+            rows = observation[pairs]
+            fields = kernel.term_field[kernel.term_pointer[j]:
+                                       kernel.term_pointer[j+1]]
+            values = np.empty((len(pairs), len(fields)), dtype=self.dtype)
+            for position, field in enumerate(fields):
+                if field not in columns:
+                    columns[field] = data[kernel.fields[field]].to_numpy(
+                        dtype=self.dtype)
+                values[:, position] = columns[field][rows]
+            for field in fields:
+                if last_use[field] == j:
+                    columns.pop(field, None)
+            self.alternative_pairs.append(pairs)
+            self.alternative_data.append(values)
+
+        if self.choices is not None:
+            self.chosen_pairs = _find_pairs(observation, alternative,
+                                            self.number_of_alternatives,
+                                            self.choices)
+        else:
+            self.chosen_pairs = None
+        self.pair_offset = None
+
+    def availability(self, rows=slice(None)):
+        """
+        Produce the availability of each alternative.
+
+        Args:
+            rows (slice or numpy.ndarray, optional): The observations to
+                include. If not supplied all observations are included.
+
+        Returns:
+            (numpy.ndarray): Boolean array of shape (number of observations,
+                number of alternatives), True where an alternative is
+                available.
+        """
+        availability = np.zeros((self.number_of_observations,
+                                 self.number_of_alternatives), dtype=bool)
+        availability[self.pair_observation(), self.pair_alternative] = True
+        return availability[rows]
+
+    def subset(self, rows):
+        """
+        Produce the design of a subset of the observations, sharing the
+        kernel.
+
+        The work is proportional to the number of pairs of the subset.
+
+        Args:
+            rows (numpy.ndarray or slice): The observations to include, in
+                increasing order.
+
+        Returns:
+            (RaggedDesign): The design of the observations.
+        """
+        rows = np.arange(self.number_of_observations)[rows]
+        starts = self.indptr[rows]
+        counts = self.indptr[rows + 1] - starts
+
+        subset = self._empty_copy()
+        subset.choices = _subset_choices(self.choices, rows)
+        subset.indptr = np.concatenate([[0], np.cumsum(counts)]).astype(
+            np.intp)
+        pairs = (np.repeat(starts - subset.indptr[:-1], counts)
+                 + np.arange(subset.indptr[-1]))
+        subset.pair_alternative = self.pair_alternative[pairs]
+
+        # Gather the term values of each alternative from the positions of
+        # the pairs among the alternative's pairs
+        rank = self._pair_rank()[pairs]
+        subset.alternative_pairs = []
+        subset.alternative_data = []
+        for j, data in enumerate(self.alternative_data):
+            alternative_pairs = np.nonzero(subset.pair_alternative == j)[0]
+            subset.alternative_pairs.append(alternative_pairs)
+            subset.alternative_data.append(data[rank[alternative_pairs]])
+
+        if self.chosen_pairs is not None:
+            subset.chosen_pairs = (subset.indptr[:-1]
+                                   + self.chosen_pairs[rows] - starts)
+        else:
+            subset.chosen_pairs = None
+        if self.pair_offset is not None:
+            subset.pair_offset = self.pair_offset[pairs]
+        else:
+            subset.pair_offset = None
+        return subset
+
+    def _extend(self, other):
+        """
+        Append the observations of another ragged design of the same kernel,
+        renumbering its pairs to follow those of this design.
+        """
+        offset = self.number_of_pairs
+        self.choices = _concatenate_choices(self.choices, other.choices)
+        self.indptr = np.concatenate([self.indptr, other.indptr[1:] + offset])
+        self.pair_alternative = np.concatenate(
+            [self.pair_alternative, other.pair_alternative])
+        self.alternative_pairs = [
+            np.concatenate([pairs, other_pairs + offset])
+            for pairs, other_pairs in zip(self.alternative_pairs,
+                                          other.alternative_pairs)]
+        self.alternative_data = [
+            np.concatenate([data, other_data])
+            for data, other_data in zip(self.alternative_data,
+                                        other.alternative_data)]
+        if self.chosen_pairs is not None:
+            self.chosen_pairs = np.concatenate(
+                [self.chosen_pairs, other.chosen_pairs + offset])
+        if self.pair_offset is not None:
+            self.pair_offset = np.concatenate(
+                [self.pair_offset, other.pair_offset])
+        self._rank = None
+
+    def _pair_rank(self):
+        """
+        Produce the position of each pair among the pairs of its alternative,
+        computed on first use.
+        """
+        if getattr(self, '_rank', None) is None:
+            self._rank = np.empty(self.number_of_pairs, dtype=np.intp)
+            for pairs in self.alternative_pairs:
+                self._rank[pairs] = np.arange(len(pairs))
+        return self._rank
+
+    def pair_observation(self):
+        """
+        Produce the observation of each pair.
+
+        Returns:
+            (numpy.ndarray): The index of the observation of each pair.
+        """
+        return np.repeat(np.arange(self.number_of_observations),
+                         np.diff(self.indptr))
+
+    @property
+    def number_of_observations(self):
+        return len(self.indptr) - 1
+
+    @property
+    def number_of_pairs(self):
+        return self.indptr[-1]
+
+
+class SampledDesign(RaggedDesign):
+    """
+    Compiled design of a multinomial logit model in which the choice set of
+    each observation is a sample of its available alternatives
+
+    For each observation, a number of alternatives are drawn with
+    replacement from the available alternatives, with probabilities q_j
+    proportional to their importance, and the chosen alternative is added.
+    The choice set is the distinct alternatives drawn. Adding ln(k_j / q_j)
+    to the utility of each alternative in the choice set, where k_j is the
+    number of times it was drawn, counting the chosen alternative once more,
+    gives a conditional likelihood whose maximum is a consistent estimate of
+    the parameters of the full model (McFadden, 1978; Ben-Akiva and Lerman,
+    1985). The cost of estimation then depends on the number of draws rather
+    than the number of alternatives.
+
+    The term values are gathered for only the sampled pairs, and the offsets
+    are held in pair_offset.
+
+    Args:
+        model (MultinomialLogit): The model to compile.
+        number_of_samples (int): The number of draws per observation.
+        data (DataFrame, optional): The data to compile. If not supplied the
+            data loaded into model is used. It must have a choice column.
+        dtype (numpy.dtype, optional): The floating point type of the term
+            values, as for Design.
+        importance (numpy.ndarray, optional): Array of shape (number of
+            observations, number of alternatives) of the sampling weight of
+            each alternative, which must be positive for available
+            alternatives. If not supplied, alternatives are drawn uniformly.
+        seed (int, optional): The seed of the draws.
+
+    Attributes:
+        As RaggedDesign, with sample_counts (numpy.ndarray), the number of
+        times each pair was drawn, counting the chosen alternative once more,
+        sample_probabilities (numpy.ndarray), the probability of drawing
+        each pair, and available_counts (numpy.ndarray), the number of
+        available alternatives of each observation.
+
+    Raises:
+        ValueError: Raised if data has no choice column, or an importance is
+            not positive for an available alternative.
+    """
+
+    def __init__(self, model, number_of_samples, data=None, dtype=None,
+                 importance=None, seed=0):
+        self.number_of_samples = number_of_samples
+        self._importance = importance
+        self._seed = seed
+        super().__init__(model, data, dtype)
+        del self._importance
+
+    def _compile_data(self, data, availability):
+        """
+        Draw the choice set of each observation and gather the term values of
+        its pairs.
+        """
+        if self.choices is None:
+            raise ValueError('Sampling of alternatives requires choices')
+
+        counts = availability.sum(axis=1)
+        if not counts.all():
+            raise NoAvailableAlternatives(np.nonzero(counts == 0)[0])
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        observation, alternative = np.nonzero(availability)
+
+        # Probability of drawing each available pair
+        if self._importance is None:
+            probabilities = 1. / np.repeat(counts, counts)
+        else:
+            weights = np.asarray(self._importance, dtype=np.float64)[
+                observation, alternative]
+            if not (weights > 0).all():
+                raise ValueError('The importance of every available'
+                                 ' alternative must be positive')
+            probabilities = weights / np.repeat(
+                np.add.reduceat(weights, indptr[:-1]), counts)
+
+        # Draw by inverting the cumulative probabilities. Those of each
+        # observation sum to one, so the draws of observation n are uniform
+        # on [n, n+1), and are kept within the observation's pairs against
+        # rounding.
+        rng = np.random.default_rng(self._seed)
+        number_of_observations = len(counts)
+        uniform = (np.arange(number_of_observations)[:, np.newaxis]
+                   + rng.random((number_of_observations,
+                                 self.number_of_samples)))
+        draws = np.searchsorted(np.cumsum(probabilities), uniform,
+                                side='right')
+        draws = np.clip(draws, indptr[:-1, np.newaxis],
+                        indptr[1:, np.newaxis] - 1)
+
+        # Add the chosen pair of each observation
+        chosen = _find_pairs(observation, alternative,
+                             self.number_of_alternatives, self.choices)
+        pairs, sample_counts = np.unique(
+            np.concatenate([draws.ravel(), chosen]), return_counts=True)
+
+        sampled = np.zeros_like(availability)
+        sampled[observation[pairs], alternative[pairs]] = True
+        super()._compile_data(data, sampled)
+
+        # Sampled pairs are numbered in observation order, as are the
+        # available pairs
+        self.sample_counts = sample_counts
+        self.sample_probabilities = probabilities[pairs]
+        self.available_counts = counts
+        self.pair_offset = (np.log(sample_counts)
+                            - np.log(self.sample_probabilities)).astype(
+                                self.dtype)
+
+    def append(self, model, data, importance=None):
+        """
+        Draw the choice sets of observations and append them to the design.
+
+        The draws of the appended observations are seeded by the seed of the
+        design and the number of observations before appending.
+
+        Args:
+            model (MultinomialLogit): The model of the design.
+            data (DataFrame): The observations to append.
+            importance (numpy.ndarray, optional): The sampling weight of each
+                alternative of the appended observations. If not supplied,
+                alternatives are drawn uniformly.
+        """
+        self._extend(SampledDesign(
+            model, self.number_of_samples, data, dtype=self.dtype,
+            importance=importance,
+            seed=(self._seed, self.number_of_observations)))
+
+    def _extend(self, other):
+        super()._extend(other)
+        self.sample_counts = np.concatenate(
+            [self.sample_counts, other.sample_counts])
+        self.sample_probabilities = np.concatenate(
+            [self.sample_probabilities, other.sample_probabilities])
+        self.available_counts = np.concatenate(
+            [self.available_counts, other.available_counts])
+
+    def subset(self, rows):
+        subset = super().subset(rows)
+        subset.available_counts = self.available_counts[rows]
+        return subset
+
+
+def _find_pairs(observation, alternative, number_of_alternatives,
+                choices):
+    """
+    Find the pair of the chosen alternative of each observation, given the
+    observation and alternative of pairs numbered in observation order.
+    """
+    keys = observation.astype(np.int64) * number_of_alternatives + alternative
+    return np.searchsorted(
+        keys,
+        np.arange(len(choices), dtype=np.int64) * number_of_alternatives
+        + choices)
+
+
+def _concatenate_choices(choices, other_choices):
+    """
+    Concatenate the choices of two designs, which must both have choices or
+    both have none.
+    """
+    if (choices is None) != (other_choices is None):
+        raise ValueError('Appended observations must have choices if and'
+                         ' only if the design has choices')
+    if choices is None:
+        return None
+    return np.concatenate([choices, other_choices])
+
+
+def _subset_choices(choices, rows):
+    """
+    Select the choices of a subset of observations, if there are choices.
+    """
+    if choices is None:
+        return None
+    return choices[rows]
+
+
+class UnknownAlternative(Exception):
+    """
+    Exception for when the data contains a choice which is not one of the
+    model's alternatives.
+    """
+    def __init__(self, choice, alternatives):
+        super().__init__(
+            'Choice "{}" in the data is not one of the alternatives {}'.format(
+                choice, alternatives)
+            )
+
+
+class ChoiceNotAvailable(Exception):
+    """
+    Exception for when the chosen alternative of an observation is not
+    available.
+    """
+    def __init__(self, observations):
+        super().__init__(
+            'The chosen alternative is not available in {} observation/s,'
+            ' the first is observation {}'.format(len(observations),
+                                                  observations[0])
+            )
+
+
+class NoAvailableAlternatives(Exception):
+    """
+    Exception for when an observation has no available alternatives.
+    """
+    def __init__(self, observations):
+        super().__init__(
+            'No alternatives are available in {} observation/s, the first is'
+            ' observation {}'.format(len(observations), observations[0])
+            )
@@ -0,0 +1,62 @@
+"""
+Quasi-random draws for simulated likelihoods
+
+Draws are produced for a contiguous range of observations at a time, so that
+simulation can work through the observations in chunks without holding every
+draw in memory. The draws of an observation do not depend on how the
+observations are divided into chunks.
+"""
+
+import numpy as np
+
+DRAW_METHODS = ('halton', 'sobol')
+
+
+def standard_normal_draws(method, number_of_draws, dimension, start, count,
+                          seed=0):
+    """
+    Produce standard normal draws for a range of observations.
+
+    The draws are consecutive points of a scrambled Halton or Sobol sequence,
+    number_of_draws points for each observation, transformed by the inverse
+    of the standard normal cumulative distribution.
+
+    Args:
+        method (str): The sequence, 'halton' or 'sobol'.
+        number_of_draws (int): The number of draws for each observation.
+        dimension (int): The number of random variables of each draw.
+        start (int): The index of the first observation.
+        count (int): The number of observations.
+        seed (int, optional): The seed of the scrambling of the sequence.
+
+    Returns:
+        (numpy.ndarray): Array of shape (count, number_of_draws, dimension).
+
+    Raises:
+        ValueError: Raised if method is not one of DRAW_METHODS.
+    """
+    import scipy.special
+    from scipy.stats import qmc
+    import warnings
+
+    if method == 'halton':
+        sampler = qmc.Halton(dimension, scramble=True, seed=seed)
+    elif method == 'sobol':
+        sampler = qmc.Sobol(dimension, scramble=True, seed=seed)
+    else:
+        raise ValueError('Draw method must be one of {}, not "{}"'.format(
+            list(DRAW_METHODS), method))
+
+    with warnings.catch_warnings():
+        # Sobol sequences warn when the number of points is not a power of
+        # two, which does not apply to consecutive blocks of points
+        warnings.simplefilter('ignore', UserWarning)
+        if start > 0:
+            sampler.fast_forward(start * number_of_draws)
+        uniform = sampler.random(count * number_of_draws)
+
+    # Keep uniform draws away from 0 and 1, which map to infinities
+    tiny = np.finfo(np.float64).eps
+    uniform = np.clip(uniform, tiny, 1. - tiny)
+    return scipy.special.ndtri(uniform).reshape(count, number_of_draws,
+                                                dimension)
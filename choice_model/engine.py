@@ -0,0 +1,1687 @@
+"""
+Multinomial logit log likelihood engines
+
+Engines evaluate the log likelihood of a compiled design, and its gradient and
+Hessian with respect to the parameters. The numpy engine is always available.
+The numba engine, which compiles fused loops over observations, is used when
+numba is installed. Ragged designs, holding only available alternatives, are
+evaluated by the numpy engine.
+"""
+
+from .draws import DRAW_METHODS, standard_normal_draws
+import numpy as np
+
+# Target number of elements in the temporary arrays created for each chunk of
+# observations
+_CHUNK_ELEMENTS = 2**20
+
+# Largest size of the draws of all observations that is kept in memory
+_DRAW_CACHE_BYTES = 2**28
+
+
+class NumpyEngine(object):
+    """
+    Log likelihood engine using vectorised NumPy operations
+
+    Observations are processed in chunks so that the memory used by
+    temporary arrays is bounded. Utilities and probabilities are evaluated in
+    the precision of the design, and the log likelihood, gradient and Hessian
+    are accumulated in double precision.
+
+    Args:
+        design (Design): The compiled design of the model and data.
+        weights (numpy.ndarray, optional): The weight of each observation in
+            the log likelihood. If not supplied every observation has a
+            weight of one.
+    """
+    name = 'numpy'
+    layout = 'dense'
+
+    def __init__(self, design, weights=None):
+        self.design = design
+        self.weights = _check_weights(design, weights)
+
+        # Terms of each alternative, with intercepts referring to a column of
+        # ones appended to the data
+        pointer, field, parameter = design.kernel.terms_by_alternative()
+        field = np.where(field < 0, design.kernel.number_of_fields, field)
+        self._alternative_terms = [
+            (field[pointer[j]:pointer[j+1]],
+             parameter[pointer[j]:pointer[j+1]])
+            for j in range(design.number_of_alternatives)
+            ]
+
+    @property
+    def parameter_names(self):
+        """
+        The names of the parameters, in the order of parameter vectors.
+        """
+        return self.design.kernel.parameter_names
+
+    def null_parameters(self):
+        """
+        Produce the parameters at which every alternative has the same
+        utility, giving the null log likelihood.
+
+        Returns:
+            (numpy.ndarray): The null parameter vector.
+        """
+        return np.zeros(len(self.parameter_names))
+
+    def initial_parameters(self):
+        """
+        Produce the starting point of estimation.
+
+        Returns:
+            (numpy.ndarray): The initial parameter vector.
+        """
+        return self.null_parameters()
+
+    def subset(self, rows):
+        """
+        Produce an engine of the same type for a subset of the observations,
+        as used by mini-batch estimation.
+
+        Args:
+            rows (numpy.ndarray): The observations to include, in increasing
+                order.
+
+        Returns:
+            (NumpyEngine): The engine of the observations.
+        """
+        weights = self.weights[rows] if self.weights is not None else None
+        return type(self)(self.design.subset(rows), weights)
+
+    def _chunks(self, width):
+        """
+        Produce slices dividing the observations into chunks, each with
+        approximately _CHUNK_ELEMENTS elements for arrays with width elements
+        per observation.
+        """
+        size = max(1, _CHUNK_ELEMENTS // max(1, width))
+        for start in range(0, self.design.number_of_observations, size):
+            yield slice(start, start+size)
+
+    def _weights(self, rows):
+        """
+        Produce the weights of a chunk of observations, or None if
+        observations are not weighted.
+        """
+        if self.weights is None:
+            return None
+        return self.weights[rows]
+
+    def _utilities(self, rows, parameters, data=None):
+        """
+        Evaluate the utilities of a chunk of observations with unavailable
+        alternatives set to -inf, from the chunk's masked data if it is given.
+        """
+        design = self.design
+        if data is None:
+            data = design.masked_data(rows)
+        utilities = design.kernel.utilities(data, parameters)
+        if not design.all_available:
+            utilities[~design.availability(rows)] = -np.inf
+        return utilities
+
+    @staticmethod
+    def _softmax(utilities):
+        """
+        Calculate probabilities and the log of the normalising sum from
+        utilities.
+        """
+        maximum = utilities.max(axis=1, keepdims=True)
+        exponentials = np.exp(utilities - maximum)
+        total = exponentials.sum(axis=1, keepdims=True)
+        return exponentials / total, (maximum + np.log(total))[:, 0]
+
+    def probabilities(self, parameters):
+        """
+        Calculate the choice probabilities.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The probability of each alternative (columns) for
+                each observation (rows).
+        """
+        design = self.design
+        probabilities = np.empty((design.number_of_observations,
+                                  design.number_of_alternatives),
+                                 dtype=design.dtype)
+        for rows in self._chunks(design.number_of_alternatives):
+            probabilities[rows], _ = self._softmax(
+                self._utilities(rows, parameters))
+        return probabilities
+
+    def log_likelihood(self, parameters):
+        """
+        Calculate the log likelihood.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (float): The log likelihood.
+        """
+        return self.log_likelihood_and_gradient(parameters)[0]
+
+    def observation_log_likelihoods(self, parameters):
+        """
+        Calculate the log of the probability of each observation's choice.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The unweighted log likelihood of each
+                observation.
+        """
+        design = self.design
+        log_likelihoods = np.empty(design.number_of_observations)
+        for rows in self._chunks(design.number_of_alternatives):
+            utilities = self._utilities(rows, parameters)
+            _, log_normaliser = self._softmax(utilities)
+            log_likelihoods[rows] = (
+                utilities[np.arange(len(log_normaliser)), design.choices[rows]]
+                - log_normaliser)
+        return log_likelihoods
+
+    def log_likelihood_and_gradient(self, parameters):
+        """
+        Calculate the log likelihood and its gradient.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (tuple): The log likelihood (float) and its gradient with respect
+                to the parameters (numpy.ndarray).
+        """
+        design = self.design
+        kernel = design.kernel
+        log_likelihood = 0.
+        gradient = np.zeros(design.number_of_parameters)
+        for rows in self._chunks(design.number_of_alternatives):
+            data = design.masked_data(rows)
+            utilities = self._utilities(rows, parameters, data)
+            probabilities, log_normaliser = self._softmax(utilities)
+            weights = self._weights(rows)
+
+            observations = np.arange(len(log_normaliser))
+            choices = design.choices[rows]
+            contributions = utilities[observations, choices] - log_normaliser
+            if weights is not None:
+                contributions = contributions * weights
+            log_likelihood += np.sum(contributions, dtype=np.float64)
+
+            # The derivative of the log likelihood with respect to the
+            # utilities is (chosen - probability)
+            residuals = -probabilities
+            residuals[observations, choices] += 1.
+            if weights is not None:
+                residuals *= weights[:, np.newaxis]
+            gradient += kernel.gradient(data, residuals)
+
+        return log_likelihood, gradient
+
+    def observation_gradients(self, parameters):
+        """
+        Calculate the gradient of the log likelihood of each observation.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The unweighted derivative of the log likelihood
+                of each observation (rows) with respect to each parameter
+                (columns).
+        """
+        design = self.design
+        gradients = np.empty((design.number_of_observations,
+                              design.number_of_parameters))
+        width = (design.number_of_alternatives + len(design.kernel.term_field)
+                 + design.number_of_parameters)
+        for rows in self._chunks(width):
+            probabilities, _ = self._softmax(self._utilities(rows, parameters))
+            residuals = -probabilities
+            residuals[np.arange(len(residuals)), design.choices[rows]] += 1.
+            gradients[rows] = design.kernel.observation_gradients(
+                design.masked_data(rows), residuals)
+        return gradients
+
+    def score_outer_product(self, parameters):
+        """
+        Calculate the weighted sum of the outer products of the observation
+        gradients, the BHHH approximation of the negative Hessian.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The outer product matrix.
+        """
+        return _score_outer_product(self.observation_gradients(parameters),
+                                    self.weights)
+
+    def hessian(self, parameters):
+        """
+        Calculate the Hessian of the log likelihood.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The matrix of second derivatives of the log
+                likelihood with respect to the parameters.
+        """
+        design = self.design
+        hessian = np.zeros((design.number_of_parameters,
+                            design.number_of_parameters))
+        width = design.number_of_alternatives + design.kernel.number_of_fields
+        for rows in self._chunks(width):
+            probabilities, _ = self._softmax(self._utilities(rows, parameters))
+            self._accumulate_hessian(rows, probabilities, hessian)
+        return hessian
+
+    def _accumulate_hessian(self, rows, probabilities, hessian):
+        """
+        Add the Hessian contribution of a chunk of observations given their
+        choice probabilities.
+
+        The Hessian is -sum_n w_n (sum_j P_nj x_nj x_nj^T - xbar_n xbar_n^T)
+        where w_n are the observation weights, x_nj are the variables
+        multiplying each parameter in the utility of alternative j and xbar_n
+        = sum_j P_nj x_nj. The first term is formed for each alternative from
+        only the parameters in its utility.
+        """
+        data = self.design.masked_data(rows).astype(np.float64)
+        probabilities = probabilities.astype(np.float64, copy=False)
+        # Append a column of ones for the intercepts
+        data = np.concatenate([data, np.ones((data.shape[0], 1))], axis=1)
+        weights = self._weights(rows)
+
+        mean = np.zeros((data.shape[0], hessian.shape[0]))
+        for alternative, (fields, parameters) in enumerate(
+                self._alternative_terms):
+            variables = data[:, fields]
+            weighted = variables * probabilities[:, alternative, np.newaxis]
+            mean[:, parameters] += weighted
+            if weights is not None:
+                weighted = weighted * weights[:, np.newaxis]
+            hessian[np.ix_(parameters, parameters)] -= np.matmul(
+                weighted.T, variables)
+        if weights is None:
+            hessian += np.matmul(mean.T, mean)
+        else:
+            hessian += np.matmul(mean.T * weights, mean)
+
+
+class NumbaEngine(NumpyEngine):
+    """
+    Log likelihood engine using numba compiled loops
+
+    The log likelihood and gradient are evaluated in a single fused loop over
+    observations, evaluating only the terms of available alternatives, with
+    observations divided between threads. For the Hessian, choice
+    probabilities are computed by a compiled loop and the outer products are
+    formed with BLAS.
+
+    Args:
+        design (Design): The compiled design of the model and data.
+        weights (numpy.ndarray, optional): The weight of each observation in
+            the log likelihood.
+    """
+    name = 'numba'
+
+    def __init__(self, design, weights=None):
+        super().__init__(design, weights)
+        from . import _numba
+        import numba
+
+        self._kernels = _numba
+        self._number_of_chunks = max(
+            1, min(4*numba.get_num_threads(), design.number_of_observations))
+
+    def _term_arguments(self, parameters):
+        """
+        Produce the term coefficients, intercepts and term indices for the
+        compiled kernels.
+        """
+        design = self.design
+        kernel = design.kernel
+        parameters = np.asarray(parameters, dtype=np.float64)
+        return (parameters[kernel.term_parameter].astype(design.dtype),
+                kernel.intercepts(parameters).astype(design.dtype),
+                kernel.term_pointer,
+                kernel.term_field)
+
+    def probabilities(self, parameters):
+        design = self.design
+        probabilities = np.empty((design.number_of_observations,
+                                  design.number_of_alternatives),
+                                 dtype=design.dtype)
+        return self._kernels.probabilities(
+            design.data, design.packed_availability,
+            *self._term_arguments(parameters), probabilities)
+
+    def log_likelihood_and_gradient(self, parameters):
+        design = self.design
+        # An empty weight array denotes unweighted observations
+        weights = self.weights if self.weights is not None else np.empty(0)
+        (log_likelihood, term_gradient,
+         intercept_gradient) = self._kernels.log_likelihood_and_gradient(
+            design.data, design.packed_availability, design.choices, weights,
+            *self._term_arguments(parameters), self._number_of_chunks)
+        return log_likelihood, design.kernel.parameter_gradient(
+            term_gradient, intercept_gradient)
+
+    def hessian(self, parameters):
+        design = self.design
+        probabilities = self.probabilities(parameters)
+        hessian = np.zeros((design.number_of_parameters,
+                            design.number_of_parameters))
+        width = design.number_of_alternatives + design.kernel.number_of_fields
+        for rows in self._chunks(width):
+            self._accumulate_hessian(rows, probabilities[rows], hessian)
+        return hessian
+
+
+class RaggedEngine(object):
+    """
+    Log likelihood engine using vectorised NumPy operations over the
+    available (observation, alternative) pairs of a ragged design
+
+    Utilities are evaluated for each alternative from only the pairs in which
+    it is available and the softmax over each observation's pairs is formed
+    with segmented reductions, so that work scales with the number of
+    available pairs.
+
+    Args:
+        design (RaggedDesign): The compiled ragged design of the model and
+            data.
+        weights (numpy.ndarray, optional): The weight of each observation in
+            the log likelihood.
+    """
+    name = 'numpy'
+    layout = 'ragged'
+
+    def __init__(self, design, weights=None):
+        self.design = design
+        self.weights = _check_weights(design, weights)
+
+    @property
+    def parameter_names(self):
+        """
+        The names of the parameters, in the order of parameter vectors.
+        """
+        return self.design.kernel.parameter_names
+
+    def null_parameters(self):
+        """
+        Produce the parameters at which every alternative has the same
+        utility, giving the null log likelihood.
+
+        Returns:
+            (numpy.ndarray): The null parameter vector.
+        """
+        return np.zeros(len(self.parameter_names))
+
+    def initial_parameters(self):
+        """
+        Produce the starting point of estimation.
+
+        Returns:
+            (numpy.ndarray): The initial parameter vector.
+        """
+        return self.null_parameters()
+
+    def subset(self, rows):
+        """
+        Produce an engine of the same type for a subset of the observations,
+        as used by mini-batch estimation.
+
+        Args:
+            rows (numpy.ndarray): The observations to include, in increasing
+                order.
+
+        Returns:
+            (RaggedEngine): The engine of the observations.
+        """
+        weights = self.weights[rows] if self.weights is not None else None
+        return type(self)(self.design.subset(rows), weights)
+
+    def _utilities(self, parameters):
+        """
+        Evaluate the utility of each available pair.
+        """
+        design = self.design
+        kernel = design.kernel
+        parameters = np.asarray(parameters, dtype=np.float64)
+        coefficients = parameters[kernel.term_parameter].astype(design.dtype)
+        intercepts = kernel.intercepts(parameters).astype(design.dtype)
+
+        utilities = np.empty(design.number_of_pairs, dtype=design.dtype)
+        pointer = kernel.term_pointer
+        for j, (pairs, data) in enumerate(zip(design.alternative_pairs,
+                                              design.alternative_data)):
+            terms = slice(pointer[j], pointer[j+1])
+            utilities[pairs] = (np.matmul(data, coefficients[terms])
+                                + intercepts[j])
+        if design.pair_offset is not None:
+            utilities += design.pair_offset
+        return utilities
+
+    def _softmax(self, utilities):
+        """
+        Calculate the probability of each pair and the log of the normalising
+        sum of each observation from the utilities of each pair.
+        """
+        starts = self.design.indptr[:-1]
+        counts = np.diff(self.design.indptr)
+        maximum = np.maximum.reduceat(utilities, starts)
+        exponentials = np.exp(utilities - np.repeat(maximum, counts))
+        total = np.add.reduceat(exponentials, starts)
+        return (exponentials / np.repeat(total, counts),
+                maximum + np.log(total))
+
+    def probabilities(self, parameters):
+        """
+        Calculate the choice probabilities.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The probability of each alternative (columns) for
+                each observation (rows), zero for unavailable alternatives.
+        """
+        design = self.design
+        pair_probabilities, _ = self._softmax(self._utilities(parameters))
+        probabilities = np.zeros((design.number_of_observations,
+                                  design.number_of_alternatives),
+                                 dtype=design.dtype)
+        probabilities[design.pair_observation(),
+                      design.pair_alternative] = pair_probabilities
+        return probabilities
+
+    def log_likelihood(self, parameters):
+        """
+        Calculate the log likelihood.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (float): The log likelihood.
+        """
+        return self.log_likelihood_and_gradient(parameters)[0]
+
+    def observation_log_likelihoods(self, parameters):
+        """
+        Calculate the log of the probability of each observation's choice.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The unweighted log likelihood of each
+                observation.
+        """
+        utilities = self._utilities(parameters)
+        _, log_normaliser = self._softmax(utilities)
+        return (utilities[self.design.chosen_pairs]
+                - log_normaliser).astype(np.float64)
+
+    def log_likelihood_and_gradient(self, parameters):
+        """
+        Calculate the log likelihood and its gradient.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (tuple): The log likelihood (float) and its gradient with respect
+                to the parameters (numpy.ndarray).
+        """
+        design = self.design
+        utilities = self._utilities(parameters)
+        probabilities, log_normaliser = self._softmax(utilities)
+        contributions = utilities[design.chosen_pairs] - log_normaliser
+        if self.weights is not None:
+            contributions = contributions * self.weights
+        log_likelihood = np.sum(contributions, dtype=np.float64)
+
+        # The derivative of the log likelihood with respect to the utilities
+        # is (chosen - probability)
+        residuals = -probabilities
+        residuals[design.chosen_pairs] += 1.
+        if self.weights is not None:
+            residuals *= np.repeat(self.weights, np.diff(design.indptr))
+
+        term_gradient = []
+        alternative_gradient = np.empty(design.number_of_alternatives)
+        for j, (pairs, data) in enumerate(zip(design.alternative_pairs,
+                                              design.alternative_data)):
+            alternative_residuals = residuals[pairs]
+            term_gradient.append(np.matmul(data.T, alternative_residuals,
+                                           dtype=np.float64))
+            alternative_gradient[j] = alternative_residuals.sum(
+                dtype=np.float64)
+
+        gradient = design.kernel.parameter_gradient(
+            np.concatenate(term_gradient), alternative_gradient)
+        return log_likelihood, gradient
+
+    def observation_gradients(self, parameters):
+        """
+        Calculate the gradient of the log likelihood of each observation.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The unweighted derivative of the log likelihood
+                of each observation (rows) with respect to each parameter
+                (columns).
+        """
+        design = self.design
+        kernel = design.kernel
+        probabilities, _ = self._softmax(self._utilities(parameters))
+        residuals = -probabilities.astype(np.float64)
+        residuals[design.chosen_pairs] += 1.
+        pair_observation = design.pair_observation()
+        intercept_parameter = dict(zip(kernel.intercept_alternative,
+                                       kernel.intercept_parameter))
+
+        # Each observation appears at most once among an alternative's pairs
+        gradients = np.zeros((design.number_of_observations,
+                              design.number_of_parameters))
+        pointer = kernel.term_pointer
+        for j, (pairs, data) in enumerate(zip(design.alternative_pairs,
+                                              design.alternative_data)):
+            observations = pair_observation[pairs]
+            alternative_residuals = residuals[pairs]
+            for term in range(pointer[j], pointer[j+1]):
+                gradients[observations, kernel.term_parameter[term]] += (
+                    data[:, term - pointer[j]] * alternative_residuals)
+            if j in intercept_parameter:
+                gradients[observations, intercept_parameter[j]] += (
+                    alternative_residuals)
+        return gradients
+
+    def score_outer_product(self, parameters):
+        """
+        Calculate the weighted sum of the outer products of the observation
+        gradients, the BHHH approximation of the negative Hessian.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The outer product matrix.
+        """
+        return _score_outer_product(self.observation_gradients(parameters),
+                                    self.weights)
+
+    def hessian(self, parameters):
+        """
+        Calculate the Hessian of the log likelihood.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The matrix of second derivatives of the log
+                likelihood with respect to the parameters.
+        """
+        import scipy.sparse
+
+        design = self.design
+        kernel = design.kernel
+        probabilities, _ = self._softmax(self._utilities(parameters))
+        probabilities = probabilities.astype(np.float64)
+        pair_observation = design.pair_observation()
+        if self.weights is None:
+            pair_weights = np.ones(design.number_of_pairs)
+        else:
+            pair_weights = self.weights[pair_observation]
+        intercept_parameter = dict(zip(kernel.intercept_alternative,
+                                       kernel.intercept_parameter))
+
+        # Accumulate sum_j P_nj x_nj x_nj^T for each alternative and the
+        # entries of the sparse matrix of xbar_n = sum_j P_nj x_nj
+        hessian = np.zeros((design.number_of_parameters,
+                            design.number_of_parameters))
+        rows, columns, values = [], [], []
+        pointer = kernel.term_pointer
+        for j, (pairs, data) in enumerate(zip(design.alternative_pairs,
+                                              design.alternative_data)):
+            parameter = kernel.term_parameter[pointer[j]:pointer[j+1]]
+            variables = data.astype(np.float64)
+            if j in intercept_parameter:
+                parameter = np.append(parameter, intercept_parameter[j])
+                variables = np.concatenate(
+                    [variables, np.ones((len(pairs), 1))], axis=1)
+
+            weighted = variables * probabilities[pairs, np.newaxis]
+            hessian[np.ix_(parameter, parameter)] -= np.matmul(
+                weighted.T * pair_weights[pairs], variables)
+            rows.append(np.repeat(pair_observation[pairs], len(parameter)))
+            columns.append(np.tile(parameter, len(pairs)))
+            values.append(weighted.ravel())
+
+        # Duplicate entries are summed on conversion
+        mean = scipy.sparse.csr_matrix(
+            (np.concatenate(values),
+             (np.concatenate(rows), np.concatenate(columns))),
+            shape=(design.number_of_observations, design.number_of_parameters)
+            )
+        weights = (self.weights if self.weights is not None
+                   else np.ones(design.number_of_observations))
+        hessian += (mean.T @ scipy.sparse.diags(weights) @ mean).toarray()
+        return hessian
+
+
+class MixedLogitEngine(NumpyEngine):
+    """
+    Simulated log likelihood engine for mixed logit models
+
+    The probability of each observation's choice is simulated by averaging
+    the logit probability over quasi-random draws of the random parameters.
+    Observations are processed in chunks, bounding the memory used by the
+    (observations, draws, alternatives) temporary arrays, and chunks are
+    evaluated in parallel threads. Draws are kept in memory if they fit within
+    _DRAW_CACHE_BYTES and are otherwise regenerated for each evaluation.
+
+    The parameter vector is the parameters of the kernel followed by the
+    standard deviations of the random parameters.
+
+    Args:
+        design (Design): The compiled design of the model and data.
+        random_parameters (dict): The random parameters, as keys, and the
+            names of their standard deviations, as values.
+        number_of_draws (int, optional): The number of draws per observation.
+        draws (str, optional): The quasi-random sequence, 'halton' or
+            'sobol'.
+        seed (int, optional): The seed of the scrambling of the sequence.
+        threads (int, optional): The number of threads to use. If not
+            supplied, the number of processors is used.
+        weights (numpy.ndarray, optional): The weight of each observation in
+            the log likelihood.
+    """
+    name = 'numpy'
+
+    # Observation gradients of the simulated likelihood are not evaluated and
+    # the draws are not divided between subsets of observations
+    observation_gradients = None
+    score_outer_product = None
+    subset = None
+
+    def __init__(self, design, random_parameters, number_of_draws=500,
+                 draws='halton', seed=0, threads=None, weights=None):
+        import os
+
+        super().__init__(design, weights)
+        kernel = design.kernel
+        if draws not in DRAW_METHODS:
+            raise ValueError('Draw method must be one of {}, not "{}"'.format(
+                list(DRAW_METHODS), draws))
+
+        self.random_parameters = list(random_parameters)
+        self.standard_deviations = [random_parameters[parameter]
+                                    for parameter in self.random_parameters]
+        self.number_of_draws = number_of_draws
+        self.draws = draws
+        self.seed = seed
+        self.threads = threads or os.cpu_count() or 1
+
+        # The variables multiplying each random parameter in each utility,
+        # the utilities of unit parameter vectors, of shape (observations,
+        # random parameters, alternatives)
+        units = np.zeros((len(self.random_parameters),
+                          kernel.number_of_parameters))
+        units[np.arange(len(units)),
+              [kernel.parameter_names.index(parameter)
+               for parameter in self.random_parameters]] = 1.
+        self._random_variables = np.empty(
+            (design.number_of_observations, len(units),
+             design.number_of_alternatives), dtype=design.dtype)
+        for rows in super()._chunks(design.number_of_alternatives):
+            for index, unit in enumerate(units):
+                self._random_variables[rows, index] = kernel.utilities(
+                    design.masked_data(rows), unit)
+
+        self._cache_draws = (design.number_of_observations * number_of_draws
+                             * len(units) * 8 <= _DRAW_CACHE_BYTES)
+        self._draw_cache = {}
+
+    @property
+    def parameter_names(self):
+        return self.design.kernel.parameter_names + self.standard_deviations
+
+    def initial_parameters(self):
+        # The gradient with respect to the standard deviations is zero when
+        # they are all zero, so start from small standard deviations
+        parameters = super().initial_parameters()
+        parameters[self.design.number_of_parameters:] = 0.1
+        return parameters
+
+    def _chunks(self, width):
+        return super()._chunks(width * self.number_of_draws)
+
+    def _draws(self, rows):
+        """
+        Produce the standard normal draws of a chunk of observations.
+        """
+        if rows.start in self._draw_cache:
+            return self._draw_cache[rows.start]
+
+        start = rows.start
+        count = len(range(*rows.indices(self.design.number_of_observations)))
+        draws = standard_normal_draws(
+            self.draws, self.number_of_draws, len(self.random_parameters),
+            start, count, self.seed)
+        if self._cache_draws:
+            self._draw_cache[start] = draws
+        return draws
+
+    def _map_chunks(self, function, width):
+        """
+        Apply a function to each chunk of observations, in parallel threads.
+        """
+        chunks = list(self._chunks(width))
+        if self.threads == 1 or len(chunks) == 1:
+            return [function(rows) for rows in chunks]
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            return list(executor.map(function, chunks))
+
+    def _simulate(self, rows, parameters):
+        """
+        Calculate the probabilities of each alternative for each draw of a
+        chunk of observations.
+
+        Returns:
+            (tuple): The draws, of shape (observations, draws, random
+                parameters), the probabilities, of shape (observations, draws,
+                alternatives), and their logarithms.
+        """
+        design = self.design
+        number_of_parameters = design.number_of_parameters
+        standard_deviations = parameters[number_of_parameters:]
+
+        draws = self._draws(rows)
+        utilities = design.kernel.utilities(design.masked_data(rows),
+                                            parameters[:number_of_parameters])
+        utilities = utilities[:, np.newaxis, :] + np.matmul(
+            draws * standard_deviations, self._random_variables[rows])
+        if not design.all_available:
+            unavailable = ~design.availability(rows)[:, np.newaxis, :]
+            utilities = np.where(unavailable, -np.inf, utilities)
+
+        utilities -= utilities.max(axis=2, keepdims=True)
+        probabilities = np.exp(utilities)
+        total = probabilities.sum(axis=2, keepdims=True)
+        probabilities /= total
+        utilities -= np.log(total)
+        return draws, probabilities, utilities
+
+    def probabilities(self, parameters):
+        """
+        Calculate the simulated choice probabilities.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The probability of each alternative (columns) for
+                each observation (rows).
+        """
+        parameters = np.asarray(parameters, dtype=np.float64)
+        return np.concatenate(self._map_chunks(
+            lambda rows: self._simulate(rows, parameters)[1].mean(axis=1),
+            self.design.number_of_alternatives))
+
+    def log_likelihood_and_gradient(self, parameters):
+        """
+        Calculate the simulated log likelihood and its gradient.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (tuple): The log likelihood (float) and its gradient with respect
+                to the parameters (numpy.ndarray).
+        """
+        parameters = np.asarray(parameters, dtype=np.float64)
+        results = self._map_chunks(
+            lambda rows: self._chunk_log_likelihood_and_gradient(rows,
+                                                                 parameters),
+            self.design.number_of_alternatives)
+        log_likelihood = sum(result[0] for result in results)
+        gradient = np.sum([result[1] for result in results], axis=0)
+        return log_likelihood, gradient
+
+    def _chunk_log_likelihood_and_gradient(self, rows, parameters):
+        """
+        Calculate the contribution of a chunk of observations to the simulated
+        log likelihood and its gradient.
+
+        The derivative of the log of the simulated probability of observation
+        n is sum_r w_nr d(log L_nr), where L_nr is the logit probability of
+        the chosen alternative for draw r and w_nr = L_nr / sum_r L_nr.
+        """
+        design = self.design
+        draws, probabilities, log_probabilities = self._simulate(rows,
+                                                                 parameters)
+        choices = design.choices[rows]
+        observations = np.arange(len(choices))
+
+        # Average the chosen probabilities over the draws in log space, so
+        # that very small probabilities do not underflow
+        log_chosen = log_probabilities[observations, :, choices]
+        maximum = log_chosen.max(axis=1, keepdims=True)
+        chosen = np.exp(log_chosen - maximum)
+        contributions = maximum[:, 0] + np.log(chosen.mean(axis=1))
+        weights = chosen / chosen.sum(axis=1, keepdims=True)
+
+        # Mean parameters, utility residuals are chosen - weighted mean
+        # probability
+        residuals = -np.einsum('nr,nrj->nj', weights, probabilities)
+        residuals[observations, choices] += 1.
+
+        observation_weights = self._weights(rows)
+        if observation_weights is not None:
+            contributions = contributions * observation_weights
+            residuals *= observation_weights[:, np.newaxis]
+            weights = weights * observation_weights[:, np.newaxis]
+        log_likelihood = np.sum(contributions)
+
+        gradient = np.empty(len(parameters))
+        gradient[:design.number_of_parameters] = design.kernel.gradient(
+            design.masked_data(rows), residuals)
+
+        # Standard deviations, utility derivatives are draw * variable
+        random_variables = self._random_variables[rows]
+        expected = np.matmul(probabilities,
+                             random_variables.transpose(0, 2, 1))
+        chosen_variables = random_variables[observations, :, choices]
+        gradient[design.number_of_parameters:] = np.einsum(
+            'nr,nrd,nrd->d', weights, draws,
+            chosen_variables[:, np.newaxis, :] - expected)
+
+        return log_likelihood, gradient
+
+    def hessian(self, parameters):
+        """
+        Calculate the Hessian of the simulated log likelihood by central
+        differences of the analytic gradient.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The matrix of second derivatives of the log
+                likelihood with respect to the parameters.
+        """
+        return _difference_hessian(self.log_likelihood_and_gradient,
+                                   parameters)
+
+
+class NestedLogitEngine(NumpyEngine):
+    """
+    Log likelihood engine for two level nested logit models
+
+    Alternatives are reordered so that the alternatives of each nest are
+    contiguous, with each alternative outside of a nest forming its own nest
+    with a logsum parameter of one. The nest logsums of each chunk of
+    observations are then formed with grouped reductions over the columns of
+    the utility matrix.
+
+    The parameter vector is the parameters of the kernel followed by the
+    logsum parameters of the nests.
+
+    Args:
+        design (Design): The compiled design of the model and data.
+        nests (dict): The nests of the model, as NestedLogit.nests.
+        weights (numpy.ndarray, optional): The weight of each observation in
+            the log likelihood.
+    """
+    name = 'numpy'
+
+    # Observation gradients and subsets are not evaluated
+    observation_gradients = None
+    score_outer_product = None
+    subset = None
+
+    def __init__(self, design, nests, weights=None):
+        super().__init__(design, weights)
+        alternatives = design.kernel.alternatives
+
+        self.nest_parameters = [nest['parameter'] for nest in nests.values()]
+        groups = [[alternatives.index(alternative)
+                   for alternative in nest['alternatives']]
+                  for nest in nests.values()]
+        nested = frozenset(j for group in groups for j in group)
+        groups += [[j] for j in range(len(alternatives)) if j not in nested]
+
+        # Alternatives in nest order, the nest of each alternative in that
+        # order and the first column of each nest
+        self._order = np.array([j for group in groups for j in group],
+                               dtype=np.intp)
+        self._nest = np.repeat(np.arange(len(groups)),
+                               [len(group) for group in groups])
+        self._starts = np.concatenate(
+            [[0], np.cumsum([len(group) for group in groups])[:-1]]
+            ).astype(np.intp)
+        self._position = np.argsort(self._order)
+
+    @property
+    def parameter_names(self):
+        return self.design.kernel.parameter_names + self.nest_parameters
+
+    def null_parameters(self):
+        parameters = super().null_parameters()
+        parameters[self.design.number_of_parameters:] = 1.
+        return parameters
+
+    def _logsum_parameters(self, parameters):
+        """
+        Produce the logsum parameter of every nest, including the single
+        alternative nests.
+        """
+        logsums = np.ones(len(self._starts))
+        logsums[:len(self.nest_parameters)] = parameters[
+            self.design.number_of_parameters:]
+        return logsums
+
+    def _nest_probabilities(self, rows, parameters):
+        """
+        Evaluate the terms of the nested logit probabilities of a chunk of
+        observations, with alternatives in nest order.
+
+        Returns:
+            (dict): The scaled utilities 'scaled' (V / lambda, -inf if
+                unavailable), availability 'available', the probability of
+                each alternative within its nest 'conditional', the logsum of
+                each nest 'logsum' (-inf if no alternative is available), the
+                probability of each nest 'marginal', the probability of each
+                alternative 'probabilities', the log of the denominator of
+                the nest probabilities 'log_normaliser' and the logsum
+                parameters 'lambdas'.
+        """
+        design = self.design
+        lambdas = self._logsum_parameters(parameters)
+        nest = self._nest
+
+        utilities = design.kernel.utilities(
+            design.masked_data(rows),
+            parameters[:design.number_of_parameters])
+        scaled = utilities[:, self._order] / lambdas[nest]
+        if design.all_available:
+            available = np.ones(scaled.shape, dtype=bool)
+        else:
+            available = design.availability(rows)[:, self._order]
+            scaled[~available] = -np.inf
+
+        # Logsum of each nest by grouped reductions
+        maximum = np.maximum.reduceat(scaled, self._starts, axis=1)
+        maximum[~np.isfinite(maximum)] = 0.
+        exponentials = np.exp(scaled - maximum[:, nest])
+        totals = np.add.reduceat(exponentials, self._starts, axis=1)
+        with np.errstate(divide='ignore'):
+            logsum = maximum + np.log(totals)
+        conditional = exponentials / np.where(totals > 0., totals, 1.)[:, nest]
+
+        # Nest probabilities
+        upper = lambdas * logsum
+        upper_maximum = upper.max(axis=1, keepdims=True)
+        marginal = np.exp(upper - upper_maximum)
+        total = marginal.sum(axis=1, keepdims=True)
+        marginal /= total
+
+        return {
+            'scaled': scaled,
+            'available': available,
+            'conditional': conditional,
+            'logsum': logsum,
+            'marginal': marginal,
+            'probabilities': marginal[:, nest] * conditional,
+            'log_normaliser': (upper_maximum + np.log(total))[:, 0],
+            'lambdas': lambdas
+            }
+
+    def probabilities(self, parameters):
+        design = self.design
+        parameters = np.asarray(parameters, dtype=np.float64)
+        probabilities = np.empty((design.number_of_observations,
+                                  design.number_of_alternatives))
+        for rows in self._chunks(design.number_of_alternatives):
+            probabilities[rows] = self._nest_probabilities(
+                rows, parameters)['probabilities'][:, self._position]
+        return probabilities
+
+    def log_likelihood_and_gradient(self, parameters):
+        """
+        Calculate the log likelihood and its gradient.
+
+        For an observation choosing alternative c in nest m_c the log
+        likelihood is S_c - I_mc + lambda_mc I_mc - log sum_m exp(lambda_m
+        I_m), where S_j = V_j / lambda_m(j) are the scaled utilities and I_m
+        the nest logsums. Its derivative with respect to V_k is
+
+            ([k = c] - (1 - lambda_mc) Q_k [k in m_c]) / lambda_m(k) - P_k
+
+        where Q_k is the probability of k within its nest and P_k its
+        probability, and with respect to lambda_m is
+
+            [m = m_c] ((Sbar_m - S_c) / lambda_m + I_m - Sbar_m)
+            - P_m (I_m - Sbar_m)
+
+        where Sbar_m = sum_k in m Q_k S_k and P_m is the probability of
+        nest m.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (tuple): The log likelihood (float) and its gradient with respect
+                to the parameters (numpy.ndarray).
+        """
+        design = self.design
+        parameters = np.asarray(parameters, dtype=np.float64)
+        number_of_nests = len(self.nest_parameters)
+        nest = self._nest
+
+        log_likelihood = 0.
+        gradient = np.zeros(len(parameters))
+        for rows in self._chunks(design.number_of_alternatives):
+            terms = self._nest_probabilities(rows, parameters)
+            scaled = terms['scaled']
+            conditional = terms['conditional']
+            logsum = terms['logsum']
+            lambdas = terms['lambdas']
+
+            observations = np.arange(scaled.shape[0])
+            chosen = self._position[design.choices[rows]]
+            chosen_nest = nest[chosen]
+            weights = self._weights(rows)
+            if weights is None:
+                weights = np.ones(len(observations))
+            log_likelihood += np.sum(weights * (
+                scaled[observations, chosen]
+                + (lambdas[chosen_nest] - 1.)
+                * logsum[observations, chosen_nest]
+                - terms['log_normaliser']))
+
+            # Derivatives with respect to the utilities
+            in_chosen_nest = nest[np.newaxis, :] == chosen_nest[:, np.newaxis]
+            residuals = -((1. - lambdas[chosen_nest])[:, np.newaxis]
+                          * conditional * in_chosen_nest)
+            residuals[observations, chosen] += 1.
+            residuals = residuals / lambdas[nest] - terms['probabilities']
+            residuals *= weights[:, np.newaxis]
+            gradient[:design.number_of_parameters] += design.kernel.gradient(
+                design.masked_data(rows), residuals[:, self._position])
+
+            # Derivatives with respect to the logsum parameters
+            weighted = conditional * np.where(terms['available'], scaled, 0.)
+            mean_scaled = np.add.reduceat(weighted, self._starts, axis=1)
+            spread = np.where(np.isfinite(logsum), logsum - mean_scaled, 0.)
+            lambda_gradient = -terms['marginal'] * spread
+            lambda_gradient[observations, chosen_nest] += (
+                (mean_scaled[observations, chosen_nest]
+                 - scaled[observations, chosen])
+                / lambdas[chosen_nest]
+                + spread[observations, chosen_nest])
+            gradient[design.number_of_parameters:] += np.matmul(
+                weights, lambda_gradient[:, :number_of_nests])
+
+        return log_likelihood, gradient
+
+    def hessian(self, parameters):
+        """
+        Calculate the Hessian of the log likelihood by central differences of
+        the analytic gradient.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The matrix of second derivatives of the log
+                likelihood with respect to the parameters.
+        """
+        return _difference_hessian(self.log_likelihood_and_gradient,
+                                   parameters)
+
+
+class LatentClassEngine(object):
+    """
+    Log likelihood engine and expectation maximisation (EM) estimator for
+    latent class logit models
+
+    The parameter vector is the parameters of each class, in the order of the
+    kernel's parameters, followed by the class membership parameters of each
+    class except the first, the constant then the coefficient of each
+    membership variable.
+
+    Every class is evaluated by a multinomial logit engine on the same
+    compiled design. In the expectation step the log likelihood of every
+    observation under every class is evaluated, one engine call per class,
+    and the posterior class probabilities of all observations are formed
+    together. In the maximisation step each class's parameters are updated
+    by a weighted multinomial logit fit, with the posterior probabilities as
+    observation weights, and the membership parameters by a weighted fit of
+    the membership model to the posterior probabilities.
+
+    Args:
+        design (Design or RaggedDesign): The compiled design of the model and
+            data.
+        class_parameter_names (list[list[str]]): The names of each class's
+            parameters, in the order of the kernel's parameters.
+        membership_parameter_names (list[str]): The names of the membership
+            parameters.
+        membership_data (numpy.ndarray): The membership variables of each
+            observation (rows). May have no columns.
+        engine (type, optional): The multinomial logit engine class
+            evaluating each class. NumpyEngine if not supplied.
+        weights (numpy.ndarray, optional): The weight of each observation in
+            the log likelihood.
+        threads (int, optional): The number of threads running random
+            restarts. If not supplied, the number of processors is used.
+    """
+
+    def __init__(self, design, class_parameter_names,
+                 membership_parameter_names, membership_data,
+                 engine=NumpyEngine, weights=None, threads=None):
+        import os
+
+        self.design = design
+        self.class_parameter_names = class_parameter_names
+        self.membership_parameter_names = membership_parameter_names
+        self.weights = _check_weights(design, weights)
+        self.threads = threads or os.cpu_count() or 1
+        self._engine_class = engine
+        self.name = engine.name
+        self.layout = engine.layout
+
+        # Membership variables with a leading column of ones for the constants
+        membership_data = np.asarray(membership_data, dtype=np.float64)
+        self._membership_data = np.concatenate(
+            [np.ones((design.number_of_observations, 1)),
+             membership_data.reshape(design.number_of_observations, -1)],
+            axis=1)
+        self.number_of_classes = len(class_parameter_names)
+
+        # Engine evaluating the log likelihood of each observation, which
+        # does not depend on its weights
+        self._engine = engine(design)
+
+    @property
+    def parameter_names(self):
+        """
+        The names of the parameters, in the order of parameter vectors.
+        """
+        return ([name for names in self.class_parameter_names
+                 for name in names] + self.membership_parameter_names)
+
+    def null_parameters(self):
+        """
+        Produce the parameters at which every alternative has the same
+        utility, and every class the same share, giving the null log
+        likelihood.
+
+        Returns:
+            (numpy.ndarray): The null parameter vector.
+        """
+        return np.zeros(len(self.parameter_names))
+
+    def initial_parameters(self, seed=0):
+        """
+        Produce a random starting point of estimation, the result of a
+        maximisation step from random posterior class probabilities.
+
+        Args:
+            seed (int, optional): The seed of the random posterior
+                probabilities.
+
+        Returns:
+            (numpy.ndarray): The initial parameter vector.
+        """
+        random = np.random.default_rng(seed)
+        posteriors = random.dirichlet(np.ones(self.number_of_classes),
+                                      self.design.number_of_observations)
+        return self._maximisation(self.null_parameters(), posteriors,
+                                  self._class_engines())
+
+    def _split(self, parameters):
+        """
+        Split a parameter vector into the parameters of each class, of shape
+        (classes, kernel parameters), and the membership parameters, of shape
+        (classes - 1, membership variables + 1).
+        """
+        parameters = np.asarray(parameters, dtype=np.float64)
+        number_of_classes = self.number_of_classes
+        size = number_of_classes * self.design.number_of_parameters
+        return (parameters[:size].reshape(number_of_classes, -1),
+                parameters[size:].reshape(number_of_classes - 1, -1))
+
+    def _log_shares(self, membership):
+        """
+        Calculate the log of the probability of each observation (rows)
+        belonging to each class (columns).
+        """
+        utilities = np.zeros((self.design.number_of_observations,
+                              self.number_of_classes))
+        utilities[:, 1:] = np.matmul(self._membership_data, membership.T)
+        maximum = utilities.max(axis=1, keepdims=True)
+        return utilities - maximum - np.log(
+            np.exp(utilities - maximum).sum(axis=1, keepdims=True))
+
+    def _class_engines(self):
+        """
+        Create an engine for each class, sharing the design.
+        """
+        return [self._engine_class(self.design)
+                for _ in range(self.number_of_classes)]
+
+    def _expectation(self, parameters):
+        """
+        Evaluate the log likelihood of each observation and the posterior
+        probability of each observation (rows) belonging to each class
+        (columns).
+        """
+        class_parameters, membership = self._split(parameters)
+        joint = self._log_shares(membership)
+        for index, values in enumerate(class_parameters):
+            joint[:, index] += self._engine.observation_log_likelihoods(
+                values)
+        maximum = joint.max(axis=1, keepdims=True)
+        log_likelihoods = maximum[:, 0] + np.log(
+            np.exp(joint - maximum).sum(axis=1))
+        return log_likelihoods, np.exp(joint - log_likelihoods[:, np.newaxis])
+
+    def _total(self, log_likelihoods):
+        """
+        Sum the, possibly weighted, log likelihoods of the observations.
+        """
+        if self.weights is None:
+            return log_likelihoods.sum()
+        return np.dot(self.weights, log_likelihoods)
+
+    def _weighted(self, posteriors):
+        """
+        Multiply posterior class probabilities by the observation weights.
+        """
+        if self.weights is None:
+            return posteriors
+        return posteriors * self.weights[:, np.newaxis]
+
+    def posteriors(self, parameters):
+        """
+        Calculate the posterior class membership probabilities, given each
+        observation's choice.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The probability of each observation (rows)
+                belonging to each class (columns).
+        """
+        return self._expectation(parameters)[1]
+
+    def class_shares(self, parameters):
+        """
+        Calculate the prior class membership probabilities.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The probability of each observation (rows)
+                belonging to each class (columns).
+        """
+        return np.exp(self._log_shares(self._split(parameters)[1]))
+
+    def probabilities(self, parameters):
+        """
+        Calculate the choice probabilities.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The probability of each alternative (columns) for
+                each observation (rows).
+        """
+        class_parameters, membership = self._split(parameters)
+        shares = np.exp(self._log_shares(membership))
+        probabilities = np.zeros((self.design.number_of_observations,
+                                  self.design.number_of_alternatives))
+        for index, values in enumerate(class_parameters):
+            probabilities += (shares[:, index, np.newaxis]
+                              * self._engine.probabilities(values))
+        return probabilities
+
+    def log_likelihood(self, parameters):
+        """
+        Calculate the log likelihood.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (float): The log likelihood.
+        """
+        return self._total(self._expectation(parameters)[0])
+
+    def log_likelihood_and_gradient(self, parameters):
+        """
+        Calculate the log likelihood and its gradient.
+
+        The derivative of the log likelihood with respect to the parameters
+        of class c is the gradient of the class's multinomial logit log
+        likelihood with the posterior probabilities h_nc as observation
+        weights, and with respect to the membership parameters of class c is
+        sum_n (h_nc - pi_nc) z_n, where pi_nc are the class shares and z_n the
+        membership variables.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (tuple): The log likelihood (float) and its gradient with respect
+                to the parameters (numpy.ndarray).
+        """
+        class_parameters, membership = self._split(parameters)
+        log_likelihoods, posteriors = self._expectation(parameters)
+        weighted = self._weighted(posteriors)
+
+        gradient = []
+        engine = self._engine_class(self.design)
+        for index, values in enumerate(class_parameters):
+            engine.weights = np.ascontiguousarray(weighted[:, index])
+            gradient.append(engine.log_likelihood_and_gradient(values)[1])
+
+        shares = np.exp(self._log_shares(membership))
+        residuals = weighted - shares * weighted.sum(axis=1, keepdims=True)
+        gradient.append(np.matmul(residuals[:, 1:].T,
+                                  self._membership_data).ravel())
+        return self._total(log_likelihoods), np.concatenate(gradient)
+
+    def hessian(self, parameters):
+        """
+        Calculate the Hessian of the log likelihood by central differences of
+        the analytic gradient.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The matrix of second derivatives of the log
+                likelihood with respect to the parameters.
+        """
+        return _difference_hessian(self.log_likelihood_and_gradient,
+                                   parameters)
+
+    def _maximisation(self, parameters, posteriors, engines):
+        """
+        Update the parameters given the posterior class probabilities, with a
+        weighted multinomial logit fit for each class and a fit of the
+        membership model.
+        """
+        import scipy.optimize
+
+        class_parameters, membership = self._split(parameters)
+        weighted = self._weighted(posteriors)
+
+        updated = []
+        for index, (engine, values) in enumerate(zip(engines,
+                                                     class_parameters)):
+            engine.weights = np.ascontiguousarray(weighted[:, index])
+
+            def objective(values):
+                log_likelihood, gradient = engine.log_likelihood_and_gradient(
+                    values)
+                return -log_likelihood, -gradient
+
+            result = scipy.optimize.minimize(
+                objective, values, jac=True,
+                hess=lambda values: -engine.hessian(values),
+                method='trust-exact', options={'maxiter': 10})
+            updated.append(result.x)
+
+        updated.append(self._maximise_membership(membership, weighted))
+        return np.concatenate(updated)
+
+    def _maximise_membership(self, membership, weighted):
+        """
+        Fit the membership model to weighted posterior class probabilities.
+        """
+        import scipy.optimize
+
+        # Without membership variables the shares are the mean posterior
+        # probabilities
+        totals = np.maximum(weighted.sum(axis=0), np.finfo(float).tiny)
+        if self._membership_data.shape[1] == 1:
+            return np.log(totals[1:] / totals[0])
+
+        data = self._membership_data
+        observation_weights = weighted.sum(axis=1)
+        shape = membership.shape
+
+        def objective(values):
+            log_shares = self._log_shares(values.reshape(shape))
+            residuals = weighted - (np.exp(log_shares)
+                                    * observation_weights[:, np.newaxis])
+            return (-np.sum(weighted * log_shares),
+                    -np.matmul(residuals[:, 1:].T, data).ravel())
+
+        def hessian(values):
+            # The Hessian of the negative log likelihood of class c and d
+            # membership parameters is sum_n w_n (pi_c [c = d] - pi_c pi_d)
+            # z_n z_n^T
+            shares = np.exp(self._log_shares(values.reshape(shape)))[:, 1:]
+            weighted_data = data * observation_weights[:, np.newaxis]
+            blocks = -np.einsum('nc,nd,nk,nl->ckdl', shares, shares,
+                                weighted_data, data, optimize=True)
+            for index in range(shape[0]):
+                blocks[index, :, index, :] += np.matmul(
+                    (weighted_data * shares[:, index, np.newaxis]).T, data)
+            return blocks.reshape(membership.size, membership.size)
+
+        result = scipy.optimize.minimize(
+            objective, membership.ravel(), jac=True, hess=hessian,
+            method='trust-exact', options={'maxiter': 10})
+        return result.x
+
+    def expectation_maximisation(self, parameters, tolerance=1.0e-6,
+                                 maximum_iterations=1000):
+        """
+        Maximise the log likelihood by expectation maximisation.
+
+        Args:
+            parameters (numpy.ndarray): The starting parameter vector.
+            tolerance (float, optional): Iterations stop when the log
+                likelihood increases by less than tolerance times its
+                magnitude.
+            maximum_iterations (int, optional): The largest number of
+                iterations.
+
+        Returns:
+            (tuple): The parameter vector (numpy.ndarray) and its log
+                likelihood (float).
+        """
+        engines = self._class_engines()
+        parameters = np.asarray(parameters, dtype=np.float64)
+        log_likelihoods, posteriors = self._expectation(parameters)
+        log_likelihood = self._total(log_likelihoods)
+        for _ in range(maximum_iterations):
+            updated = self._maximisation(parameters, posteriors, engines)
+            log_likelihoods, updated_posteriors = self._expectation(updated)
+            updated_log_likelihood = self._total(log_likelihoods)
+            if updated_log_likelihood < log_likelihood:
+                break
+            converged = (updated_log_likelihood - log_likelihood
+                         <= tolerance * abs(updated_log_likelihood))
+            parameters, posteriors = updated, updated_posteriors
+            log_likelihood = updated_log_likelihood
+            if converged:
+                break
+        return parameters, log_likelihood
+
+    def estimate(self, restarts=5, seed=0, method='BFGS', **options):
+        """
+        Estimate the parameters by expectation maximisation from several
+        random starting points, run in parallel threads, keeping the best.
+
+        Expectation maximisation converges slowly close to an optimum, so
+        each run is finished by gradient based optimisation.
+
+        Args:
+            restarts (int, optional): The number of random starting points.
+            seed (int, optional): The seed of the starting points.
+            method (str, optional): The optimisation method finishing each
+                run, see choice_model.optimize.maximise.
+
+        Keyword Args:
+            gradient_tolerance, loss_tolerance, maximum_iterations: Options of
+                the optimisation finishing each run, see
+                choice_model.optimize.maximise.
+
+        Returns:
+            (tuple): The parameter vector with the highest log likelihood
+                (numpy.ndarray) and the final log likelihood of each run
+                (list[float]).
+        """
+        from .optimize import maximise
+
+        seeds = np.random.SeedSequence(seed).spawn(restarts)
+
+        def run(seed):
+            parameters, _ = self.expectation_maximisation(
+                self.initial_parameters(seed))
+            result = maximise(self.log_likelihood_and_gradient, parameters,
+                              method, hessian=self.hessian, **options)
+            return result.x, result.log_likelihood
+
+        if self.threads == 1 or restarts == 1:
+            results = [run(seed) for seed in seeds]
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                results = list(executor.map(run, seeds))
+
+        log_likelihoods = [log_likelihood for _, log_likelihood in results]
+        return results[int(np.argmax(log_likelihoods))][0], log_likelihoods
+
+
+def _check_weights(design, weights):
+    """
+    Convert observation weights to a double precision array, ensuring that
+    there is one weight for each observation of a design.
+    """
+    if weights is None:
+        return None
+    weights = np.ascontiguousarray(weights, dtype=np.float64)
+    if weights.shape != (design.number_of_observations,):
+        raise ValueError(
+            'Expected {} observation weights, received an array of shape '
+            '{}'.format(design.number_of_observations, weights.shape))
+    return weights
+
+
+def _score_outer_product(gradients, weights):
+    """
+    Sum the outer products of observation gradients, each multiplied by the
+    observation's weight.
+    """
+    if weights is None:
+        return np.matmul(gradients.T, gradients)
+    return np.matmul(gradients.T * weights, gradients)
+
+
+def _difference_hessian(log_likelihood_and_gradient, parameters):
+    """
+    Approximate the Hessian of the log likelihood by central differences of
+    its analytic gradient.
+    """
+    parameters = np.asarray(parameters, dtype=np.float64)
+    steps = 1.0e-5 * np.maximum(1., np.abs(parameters))
+    hessian = np.empty((len(parameters), len(parameters)))
+    for index, step in enumerate(steps):
+        shift = np.zeros(len(parameters))
+        shift[index] = step
+        hessian[index] = (
+            log_likelihood_and_gradient(parameters + shift)[1]
+            - log_likelihood_and_gradient(parameters - shift)[1]
+            ) / (2*step)
+    return (hessian + hessian.T) / 2
+
+
+_ENGINES = {
+    'numpy': NumpyEngine,
+    'numba': NumbaEngine
+    }
+
+_LAYOUTS = ('dense', 'ragged')
+
+
+def numba_available():
+    """
+    Determine whether numba can be imported.
+    """
+    try:
+        import numba  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_engine(name=None, layout='dense'):
+    """
+    Get a log likelihood engine class.
+
+    Args:
+        name (str or None): The engine name, 'numpy' or 'numba'. If None the
+            numba engine is used if numba is installed and the layout is
+            dense, and the numpy engine otherwise.
+        layout (str, optional): The layout of the design the engine
+            evaluates, 'dense' for Design or 'ragged' for RaggedDesign.
+
+    Returns:
+        (type): The engine class.
+
+    Raises:
+        ValueError: Raised if name is not an engine name, layout is not a
+            layout or the engine does not support the layout.
+        ImportError: Raised if the numba engine is requested but numba is not
+            installed.
+    """
+    if layout not in _LAYOUTS:
+        raise ValueError('Layout must be one of {}, not "{}"'.format(
+            list(_LAYOUTS), layout))
+
+    if name is None:
+        if layout == 'dense' and numba_available():
+            name = 'numba'
+        else:
+            name = 'numpy'
+
+    if name not in _ENGINES:
+        raise ValueError('Engine must be one of {}, not "{}"'.format(
+            list(_ENGINES), name))
+    if layout == 'ragged' and name != 'numpy':
+        raise ValueError(
+            'The {} engine does not support the ragged layout'.format(name)
+            )
+    if name == 'numba' and not numba_available():
+        raise ImportError('The numba engine requires numba to be installed')
+
+    if layout == 'ragged':
+        return RaggedEngine
+    return _ENGINES[name]
@@ -1,5 +1,29 @@
-from .interface import Interface
-from .pylogit import PylogitInterface
-from .alogit import AlogitInterface
+"""
+Interfaces to choice model estimation back ends.
 
-__all__ = ['Interface', 'PylogitInterface', 'AlogitInterface']
+Each back end is imported on first access so that, for example, pylogit is
+only imported when the pylogit interface is used. Back ends may also be
+requested by name with get_interface, see the registry module.
+"""
+
+from .._lazy import lazy_attributes
+
+# Map of interface class names to the submodule which defines them
+_LAZY_ATTRIBUTES = {
+    'Interface': '.interface',
+    'PylogitInterface': '.pylogit',
+    'AlogitInterface': '.alogit',
+    'NativeInterface': '.native',
+    'get_interface': '.registry',
+    'best_interface': '.registry',
+    'register_interface': '.registry',
+    'available_interfaces': '.registry',
+    }
+
+# Submodules which may be accessed as attributes of the package
+_SUBMODULES = ('interface', 'pylogit', 'alogit', 'native', 'registry')
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+__getattr__, __dir__ = lazy_attributes(__name__, _LAZY_ATTRIBUTES,
+                                       _SUBMODULES)
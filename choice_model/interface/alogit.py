@@ -2,8 +2,8 @@
 ALOGIT interface
 """
 
-from .interface import Interface, requires_estimation
-from .. import MultinomialLogit
+from .interface import Capabilities, Interface, requires_estimation
+from ..model import MultinomialLogit, NestedLogit
 import numpy as np
 import os.path
 import subprocess
@@ -22,6 +22,8 @@ _ALO_LABEL_VARIABLE = 'v'
 _ALO_LABEL_CHOICE_DEPENDENT_VARIABLE = 'cv'
 _ALO_LABEL_INTERCEPT = 'c'
 _ALO_LABEL_PARAMETER = 'prm'
+_ALO_LABEL_NEST = 'nst'
+_ALO_LABEL_NEST_PARAMETER = 'lam'
 
 _MAX_CHARACTER_LENGTH = 10
 _MAX_LINE_LENGTH = 77
@@ -43,8 +45,11 @@ class AlogitInterface(Interface):
             file. If not supplied then a prefix is created based on the model
             title and appended with '.alo'
     """
-    _valid_models = [MultinomialLogit]
+    capabilities = Capabilities(models=[MultinomialLogit, NestedLogit],
+                                weights=False, parallel=False,
+                                prediction=False)
     name = 'ALOGIT'
+    priority = 0
 
     def __init__(self, model, **kwargs):
         super().__init__(model)
@@ -68,7 +73,7 @@ class AlogitInterface(Interface):
 
         # Create column labels
         column_labels = [self.abbreviate(label)
-                         for label in model.data.columns]
+                         for label in model.materialise().columns]
         self.column_labels = column_labels
 
         # Create ALOGIT input file string
@@ -124,6 +129,15 @@ class AlogitInterface(Interface):
             full.append(parameter)
             abbreviations.append(_ALO_LABEL_PARAMETER + str(number))
 
+        # Abbreviate nest names and logsum parameter names
+        if isinstance(model, NestedLogit):
+            for number, (nest, definition) in enumerate(model.nests.items(),
+                                                        start=1):
+                full.append(nest)
+                abbreviations.append(_ALO_LABEL_NEST + str(number))
+                full.append(definition['parameter'])
+                abbreviations.append(_ALO_LABEL_NEST_PARAMETER + str(number))
+
         self.abbreviation = dict(zip(full, abbreviations))
         self.elongation = dict(zip(abbreviations, full))
 
@@ -178,13 +192,13 @@ class AlogitInterface(Interface):
         alo += self._alo_record(_ALO_COMMAND_TITLE, model.title)
         # Estimate instruction
         alo += self._alo_record(_ALO_COMMAND_ESTIMATE)
-        # Write coefficients (parameters and intercepts)
-        alo += self._alo_record(
-            _ALO_COMMAND_COEFFICIENTS,
-            *model.parameters + list(model.intercepts.values())
-            )
+        # Write coefficients (parameters, intercepts and nest parameters)
+        coefficients = model.parameters + list(model.intercepts.values())
+        if isinstance(model, NestedLogit):
+            coefficients += model.nest_parameters()
+        alo += self._alo_record(_ALO_COMMAND_COEFFICIENTS, *coefficients)
         # Write alternatives
-        alo += self._alo_record(_ALO_COMMAND_ALTERNATIVES, *model.alternatives)
+        alo += self._nest_records()
         # Write data file specification
         alo += self._specify_data_file()
         # Write availability columns
@@ -209,6 +223,28 @@ class AlogitInterface(Interface):
                                     self._utility_string(choice))
         return alo
 
+    def _nest_records(self):
+        """
+        Write the tree of alternatives. For nested logit models the root
+        contains the unnested alternatives and the nests, and each nest is
+        defined with its logsum parameter.
+        """
+        model = self.model
+        if not isinstance(model, NestedLogit):
+            return self._alo_record(_ALO_COMMAND_ALTERNATIVES,
+                                    *model.alternatives)
+
+        records = self._alo_record(
+            _ALO_COMMAND_ALTERNATIVES,
+            *model.unnested_alternatives() + list(model.nests)
+            )
+        for nest, definition in model.nests.items():
+            records += self._alo_record(
+                '$nest ' + self._array(nest, definition['parameter']),
+                *definition['alternatives']
+                )
+        return records
+
     def _alo_record(self, command, *args):
         """
         Write a record to the ALOGIT input file
@@ -295,6 +331,8 @@ class AlogitInterface(Interface):
         Write the data in the format defined by the ALOGIT input file
         """
         model = self.model
+        # Write the derived fields with the data
+        data = model.materialise()
 
         # Encode alternatives as numbers in new dataframe column
         number_of_alternatives = model.number_of_alternatives()
@@ -302,25 +340,24 @@ class AlogitInterface(Interface):
             zip(model.alternatives,
                 np.arange(number_of_alternatives, dtype=float)+1)
             )
-        model.data[_ALO_LABEL_CHOICE_COLUMN] = (
-            model.data[model.choice_column].apply(lambda x: choice_encoding[x])
+        data[_ALO_LABEL_CHOICE_COLUMN] = (
+            data[model.choice_column].apply(lambda x: choice_encoding[x])
             )
 
         # Produce list of column labels replacing old choice column with the
         # new encoded choice column
-        column_labels = list(model.data.columns)[:-1]
+        column_labels = list(data.columns)[:-1]
         column_labels[
             column_labels.index(model.choice_column)
             ] = _ALO_LABEL_CHOICE_COLUMN
 
         # Write data file
         with open(self.data_file, 'w') as data_file:
-            model.data.to_csv(data_file, header=False, index=False,
-                              line_terminator='\n',
-                              columns=column_labels)
+            data.to_csv(data_file, header=False, index=False,
+                        line_terminator='\n', columns=column_labels)
 
         # Drop encoded choice column
-        model.data.drop(columns=_ALO_LABEL_CHOICE_COLUMN, inplace=True)
+        data.drop(columns=_ALO_LABEL_CHOICE_COLUMN, inplace=True)
 
     def estimate(self):
         """
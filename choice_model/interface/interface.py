@@ -2,14 +2,35 @@
 Base interface class definition
 """
 
-from .. import ChoiceModel
+from ..model import ChoiceModel
+from collections import namedtuple
 from functools import wraps
 import pandas as pd
 
+# Description of the features an interface supports
+#   models: The choice model classes the interface can estimate
+#   weights: Whether observations may be weighted in estimation
+#   parallel: Whether estimation uses multiple cores
+#   prediction: Whether the interface can predict choice probabilities
+#   sampling: Whether alternatives may be sampled in estimation
+Capabilities = namedtuple('Capabilities',
+                          ['models', 'weights', 'parallel', 'prediction',
+                           'sampling'],
+                          defaults=[False])
+
 
 class Interface(object):
-    _valid_models = [ChoiceModel]
+    """
+    Base interface class
+
+    Interfaces declare the features they support in the capabilities
+    attribute. When an interface is selected automatically, the available
+    interface with the highest priority which supports the model is chosen.
+    """
+    capabilities = Capabilities(models=[ChoiceModel], weights=False,
+                                parallel=False, prediction=False)
     name = None
+    priority = 0
 
     def __init__(self, model):
         self._ensure_valid_model(model)
@@ -19,15 +40,57 @@ class Interface(object):
         if not isinstance(model.data, pd.DataFrame):
             raise NoDataLoaded
 
+    @classmethod
+    def supports(cls, model):
+        """
+        Determine whether the interface can estimate a model.
+
+        Args:
+            model (ChoiceModel): The choice model to check.
+
+        Returns:
+            (bool): True if the type of model, and sampling of alternatives
+                if the model defines it, are supported by the interface.
+        """
+        if getattr(model, 'sampling', None) is not None:
+            if not cls.capabilities.sampling:
+                return False
+        return type(model) in cls.capabilities.models
+
     @classmethod
     def _ensure_valid_model(cls, model):
-        if type(model) not in cls._valid_models:
+        if (getattr(model, 'sampling', None) is not None
+                and not cls.capabilities.sampling):
+            raise TypeError('{} does not support sampling of'
+                            ' alternatives'.format(cls.__name__))
+        if not cls.supports(model):
             raise TypeError(
                 'Argument "model" for cls.__name__ must be one of {}'.format(
-                    [model_class.__name__ for model_class in cls._valid_models]
+                    [model_class.__name__
+                     for model_class in cls.capabilities.models]
                     )
                 )
 
+    def append_data(self, data_or_file):
+        """
+        Append observations to the model's data for re-estimation. The
+        results of any previous estimation are discarded.
+
+        Interfaces which hold converted copies of the data extend them with
+        only the new observations, and may start the next estimation from the
+        previous optimum.
+
+        Args:
+            data_or_file (DataFrame or FileLike): The observations to append,
+                as for ChoiceModel.append_data.
+
+        Returns:
+            (DataFrame): The appended observations.
+        """
+        data = self.model.append_data(data_or_file)
+        self._estimated = False
+        return data
+
     def estimate(self):
         """
         Estimate the parameters of the choice model.
@@ -0,0 +1,434 @@
+"""
+Native interface
+"""
+
+from .interface import Capabilities, Interface, requires_estimation
+from ..design import Design, RaggedDesign, SampledDesign
+from ..engine import (get_engine, LatentClassEngine, MixedLogitEngine,
+                      NestedLogitEngine)
+from ..model import LatentClassLogit, MixedLogit, MultinomialLogit, NestedLogit
+import numpy as np
+import time
+
+
+class NativeInterface(Interface):
+    """
+    Native interface class
+
+    Estimates multinomial, mixed, nested and latent class logit models using
+    this package's own log likelihood engines and analytic gradients. Latent
+    class models are estimated by expectation maximisation.
+
+    Multinomial logit models defining sampling of alternatives are estimated
+    on a SampledDesign, with the ragged layout, drawn when the interface is
+    created. Probabilities are predicted over all available alternatives,
+    and the null log likelihood is that of the full choice sets.
+
+    Args:
+        model (ChoiceModel): The choice model to create an interface for.
+
+    Keyword Args:
+        engine (str, optional): The log likelihood engine to use, 'numpy' or
+            'numba'. If not supplied or None numba is used if it is installed.
+        dtype (numpy.dtype, optional): The floating point type, float32 or
+            float64, in which the data is stored and utilities and
+            probabilities are evaluated. The log likelihood and its gradient
+            are accumulated in double precision. If not supplied it is
+            inferred from the data, see Design.
+        layout (str, optional): The layout of the compiled data, 'dense'
+            (the default) to hold every alternative of every observation or
+            'ragged' to hold only available alternatives, see RaggedDesign.
+            The ragged layout is evaluated by the numpy engine.
+        number_of_draws (int, optional): For mixed logit models, the number
+            of draws per observation used to simulate the likelihood.
+        draws (str, optional): For mixed logit models, the quasi-random
+            sequence of the draws, 'halton' (the default) or 'sobol'.
+        seed (int, optional): For mixed logit models, the seed of the
+            scrambling of the quasi-random sequence. For latent class models,
+            the seed of the random starting points. For the 'adam'
+            estimation method, the seed of the shuffling of observations.
+            For sampling of alternatives, the seed of the draws.
+        threads (int, optional): For mixed logit models, the number of threads
+            simulating the likelihood and for latent class models the number
+            of threads running random restarts. If not supplied, the number
+            of processors is used.
+        restarts (int, optional): For latent class models, the number of
+            random starting points of expectation maximisation.
+        weights (str or array_like, optional): The weight of each observation
+            in estimation, or the label of a data column holding the weights.
+            If not supplied every observation has a weight of one.
+        batch_size (int, optional): For the 'adam' estimation method, the
+            number of observations in each mini-batch.
+        epochs (int, optional): For the 'adam' estimation method, the
+            number of passes through the observations.
+        learning_rate (float, optional): For the 'adam' estimation method,
+            the initial largest change in any parameter in one step.
+
+    Raises:
+        ValueError: Raised if the engine or layout is unknown or cannot
+            evaluate the model. Mixed and nested logit models are evaluated by
+            the numpy engine with the dense layout, and sampled alternatives
+            by the numpy engine with the ragged layout.
+            Also raised if the number of weights is not the number of
+            observations.
+    """
+    capabilities = Capabilities(
+        models=[MultinomialLogit, MixedLogit, NestedLogit, LatentClassLogit],
+        weights=True, parallel=True, prediction=True, sampling=True)
+    name = 'native'
+    priority = 20
+
+    def __init__(self, model, **kwargs):
+        super().__init__(model)
+
+        sampling = getattr(model, 'sampling', None)
+        layout = kwargs.get('layout', 'dense' if sampling is None
+                            else 'ragged')
+        if sampling is not None and layout != 'ragged':
+            raise ValueError('Sampled alternatives are evaluated with the'
+                             ' ragged layout')
+        if isinstance(model, (MixedLogit, NestedLogit)):
+            if (kwargs.get('engine') not in (None, 'numpy')
+                    or layout != 'dense'):
+                raise ValueError('{} models are evaluated by the numpy engine'
+                                 ' with the dense layout'.format(
+                                     type(model).__name__))
+        if isinstance(model, MixedLogit):
+            self._simulation_options = {
+                key: kwargs[key] for key in
+                ('number_of_draws', 'draws', 'seed', 'threads')
+                if key in kwargs
+                }
+        if isinstance(model, LatentClassLogit):
+            self._restarts = kwargs.get('restarts', 5)
+            self._seed = kwargs.get('seed', 0)
+            self._threads = kwargs.get('threads')
+        self._stochastic_options = {
+            key: kwargs[key] for key in
+            ('batch_size', 'epochs', 'learning_rate', 'seed')
+            if key in kwargs
+            }
+        self._engine_class = get_engine(kwargs.get('engine'), layout)
+        self._design_class = RaggedDesign if layout == 'ragged' else Design
+
+        weights = kwargs.get('weights')
+        self._weight_column = weights if isinstance(weights, str) else None
+        if isinstance(weights, str):
+            weights = model.data[weights].to_numpy()
+
+        if sampling is not None:
+            self.design = SampledDesign(
+                model, sampling['alternatives'], dtype=kwargs.get('dtype'),
+                importance=self._importance(model.data),
+                seed=kwargs.get('seed', 0))
+        else:
+            self.design = self._design_class(model, dtype=kwargs.get('dtype'))
+        self.engine = self._create_engine(self.design, model.data, weights)
+        self.parameter_names = self.engine.parameter_names
+        self._initial_parameters = None
+
+    def _importance(self, data):
+        """
+        Produce the sampling weights of the alternatives of data, or None if
+        alternatives are drawn uniformly.
+        """
+        fields = self.model.sampling_fields()
+        if not fields:
+            return None
+        return self.model.materialise(data)[fields].to_numpy()
+
+    def append_data(self, data_or_file, weights=None):
+        """
+        Append observations to the model's data for re-estimation.
+
+        Only the new observations are compiled and appended to the design,
+        and the next estimation starts from the optimum of the previous one.
+        Latent class models are then estimated from the previous optimum
+        without random restarts.
+
+        Args:
+            data_or_file (DataFrame or FileLike): The observations to append,
+                as for ChoiceModel.append_data.
+            weights (array_like, optional): The weights of the new
+                observations, if observations are weighted by an array rather
+                than a data column.
+
+        Returns:
+            (DataFrame): The appended observations.
+
+        Raises:
+            ValueError: Raised if weights are supplied for unweighted
+                observations, or are missing for observations weighted by an
+                array.
+        """
+        engine_weights = self.engine.weights
+        if self._weight_column is None:
+            if (weights is None) != (engine_weights is None):
+                raise ValueError('Weights must be supplied for the new'
+                                 ' observations if and only if observations'
+                                 ' are weighted by an array')
+        elif weights is not None:
+            raise ValueError('Observations are weighted by the column {}'
+                             .format(self._weight_column))
+
+        estimated = self._estimated
+        data = super().append_data(data_or_file)
+        if self._weight_column is not None:
+            weights = data[self._weight_column].to_numpy()
+        if engine_weights is not None:
+            weights = np.concatenate([engine_weights, weights])
+
+        if isinstance(self.design, SampledDesign):
+            self.design.append(self.model, data, self._importance(data))
+        else:
+            self.design.append(self.model, data)
+        self.engine = self._create_engine(self.design, self.model.data,
+                                          weights)
+        if estimated:
+            self._initial_parameters = self._parameter_vector
+        return data
+
+    def _create_engine(self, design, data, weights=None):
+        """
+        Create the log likelihood engine of the model for a design of data.
+        """
+        model = self.model
+        if isinstance(model, MixedLogit):
+            return MixedLogitEngine(design, model.random_parameters,
+                                    weights=weights,
+                                    **self._simulation_options)
+        if isinstance(model, NestedLogit):
+            return NestedLogitEngine(design, model.nests, weights)
+        if isinstance(model, LatentClassLogit):
+            return LatentClassEngine(
+                design,
+                [[model.class_parameter(name, latent_class)
+                  for name in design.kernel.parameter_names]
+                 for latent_class in model.classes],
+                model.membership_parameters(),
+                model.materialise(data)[
+                    model.class_membership_variables].to_numpy(),
+                engine=self._engine_class, weights=weights,
+                threads=self._threads)
+        return self._engine_class(design, weights)
+
+    def estimate(self, method='BFGS', gradient_tolerance=None,
+                 loss_tolerance=None, maximum_iterations=None):
+        """
+        Estimate the parameters of the choice model.
+
+        The multinomial logit log likelihood is concave, so Newton and trust
+        region iterations using its analytic Hessian converge in a few
+        iterations. Where the optimiser evaluates the Hessian at the optimum
+        it is reused for the standard errors.
+
+        Latent class models are estimated by expectation maximisation from
+        several random starting points, each finished by the optimiser, and
+        the final log likelihood of each is recorded in
+        restart_log_likelihoods.
+
+        After observations are appended, estimation starts from the previous
+        optimum, see append_data.
+
+        For large data sets the 'adam' method first takes Adam steps on
+        shuffled mini-batches of observations and then finishes with Newton
+        iterations on all observations, see
+        choice_model.optimize.stochastic_maximise. It is available for
+        multinomial logit models.
+
+        Args:
+            method (str, optional): The optimisation method, 'newton',
+                'bhhh', 'l-bfgs', 'adam' or a scipy.optimize.minimize method
+                such as 'BFGS', 'trust-exact' or 'trust-ncg'. See
+                choice_model.optimize.maximise.
+            gradient_tolerance (float, optional): The largest element of the
+                gradient at convergence.
+            loss_tolerance (float, optional): The relative change in the log
+                likelihood at convergence.
+            maximum_iterations (int, optional): The largest number of
+                iterations.
+
+        Raises:
+            ValueError: Raised if the method requires observation gradients
+                or subsets of observations and the model's engine does not
+                evaluate them.
+        """
+        from ..optimize import maximise, stochastic_maximise
+
+        engine = self.engine
+        options = {'gradient_tolerance': gradient_tolerance,
+                   'loss_tolerance': loss_tolerance,
+                   'maximum_iterations': maximum_iterations}
+
+        stochastic = method.lower() == 'adam'
+        if stochastic and getattr(engine, 'subset', None) is None:
+            raise ValueError('The adam method is not available for {}'
+                             ' models'.format(type(self.model).__name__))
+
+        start = time.perf_counter()
+        if self._initial_parameters is not None:
+            # Warm start from the optimum before observations were appended
+            initial_parameters = self._initial_parameters
+            if isinstance(engine, LatentClassEngine):
+                self.restart_log_likelihoods = []
+        elif isinstance(engine, LatentClassEngine):
+            initial_parameters, self.restart_log_likelihoods = (
+                engine.estimate(self._restarts, self._seed, method,
+                                **options))
+        else:
+            initial_parameters = engine.initial_parameters()
+        if stochastic:
+            result = stochastic_maximise(engine, initial_parameters,
+                                         **self._stochastic_options,
+                                         **options)
+        else:
+            result = maximise(
+                engine.log_likelihood_and_gradient, initial_parameters,
+                method, hessian=engine.hessian,
+                score_outer_product=getattr(engine, 'score_outer_product',
+                                            None),
+                **options)
+        self._estimation_time = time.perf_counter() - start
+
+        self.optimization_result = result
+        parameters = result.x
+        self._parameter_vector = parameters
+        self._final_log_likelihood = result.log_likelihood
+        if isinstance(self.design, SampledDesign):
+            # At the null parameters every available alternative is equally
+            # likely. Evaluating them on the sampled choice sets, with their
+            # correction terms, gives neither the full nor the sampled null.
+            log_counts = np.log(self.design.available_counts)
+            weights = engine.weights
+            self._null_log_likelihood = -(
+                log_counts.sum() if weights is None else weights @ log_counts)
+        else:
+            self._null_log_likelihood = engine.log_likelihood(
+                engine.null_parameters())
+
+        # The covariance is the inverse of the negative Hessian of the log
+        # likelihood at the optimum
+        hessian = result.hess
+        if hessian is None:
+            hessian = engine.hessian(parameters)
+        self._covariance = np.linalg.inv(-hessian)
+
+        # Set estimated flag
+        self._estimated = True
+
+    @requires_estimation
+    def display_results(self):
+        print(self.model.title)
+        print('Null log likelihood: {:.6f}'.format(self._null_log_likelihood))
+        print('Final log likelihood: {:.6f}'.format(
+            self._final_log_likelihood))
+        print('{:20s} {:>14s} {:>14s} {:>10s}'.format(
+            'Parameter', 'Estimate', 'Std. Error', 't value'))
+        errors = self.standard_errors()
+        t_values = self.t_values()
+        for parameter, value in self.parameters().items():
+            print('{:20s} {:14.6g} {:14.6g} {:10.4f}'.format(
+                parameter, value, errors[parameter], t_values[parameter]))
+
+    @requires_estimation
+    def null_log_likelihood(self):
+        return self._null_log_likelihood
+
+    @requires_estimation
+    def final_log_likelihood(self):
+        return self._final_log_likelihood
+
+    @requires_estimation
+    def parameters(self):
+        return dict(zip(self.parameter_names, self._parameter_vector))
+
+    @requires_estimation
+    def standard_errors(self):
+        return dict(zip(self.parameter_names,
+                        np.sqrt(np.diag(self._covariance))))
+
+    @requires_estimation
+    def t_values(self):
+        errors = np.sqrt(np.diag(self._covariance))
+        return dict(zip(self.parameter_names,
+                        self._parameter_vector / errors))
+
+    @requires_estimation
+    def estimation_time(self):
+        return self._estimation_time
+
+    @requires_estimation
+    def covariance(self):
+        """
+        Determine the covariance matrix of the optimised parameters.
+
+        Returns:
+            (numpy.ndarray): The covariance matrix, with rows and columns in
+                the order of parameter_names.
+        """
+        return self._covariance
+
+    @requires_estimation
+    def probabilities(self, data=None):
+        """
+        Predict choice probabilities using the optimised parameters.
+
+        Args:
+            data (DataFrame, optional): The data to predict for. If not
+                supplied the model's data is used.
+
+        Returns:
+            (DataFrame): The probability of each alternative (columns) for
+                each observation (rows).
+        """
+        import pandas as pd
+
+        engine, index = self._prediction_engine(data)
+        return pd.DataFrame(engine.probabilities(self._parameter_vector),
+                            index=index, columns=self.model.alternatives)
+
+    def _prediction_engine(self, data=None):
+        """
+        Produce an engine evaluating data, or the model's data if data is
+        None, and the index of its observations.
+        """
+        if data is None:
+            if not isinstance(self.design, SampledDesign):
+                return self.engine, self.model.data.index
+            data = self.model.data
+        engine = self._create_engine(
+            self._design_class(self.model, data, dtype=self.design.dtype),
+            data)
+        return engine, data.index
+
+    @requires_estimation
+    def class_probabilities(self, data=None, posterior=True):
+        """
+        Predict the latent class membership probabilities of a latent class
+        model using the optimised parameters.
+
+        Args:
+            data (DataFrame, optional): The data to predict for. If not
+                supplied the model's data is used.
+            posterior (bool, optional): If True, the probabilities given each
+                observation's choice, otherwise the prior class shares.
+
+        Returns:
+            (DataFrame): The probability of each class (columns) for each
+                observation (rows).
+
+        Raises:
+            TypeError: Raised if the model is not a latent class model.
+        """
+        import pandas as pd
+
+        if not isinstance(self.model, LatentClassLogit):
+            raise TypeError('Class probabilities require a latent class model')
+
+        engine, index = self._prediction_engine(data)
+        if posterior:
+            probabilities = engine.posteriors(self._parameter_vector)
+        else:
+            probabilities = engine.class_shares(self._parameter_vector)
+        return pd.DataFrame(probabilities, index=index,
+                            columns=self.model.classes)
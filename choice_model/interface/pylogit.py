@@ -2,8 +2,8 @@
 pylogit interface
 """
 
-from .interface import Interface, requires_estimation
-from .. import MultinomialLogit
+from .interface import Capabilities, Interface, requires_estimation
+from ..model import MultinomialLogit
 from collections import OrderedDict
 from contextlib import redirect_stdout
 from io import StringIO
@@ -27,8 +27,10 @@ class PylogitInterface(Interface):
     Args:
         model (ChoiceModel): The choice model to create an interface for.
     """
-    _valid_models = [MultinomialLogit]
+    capabilities = Capabilities(models=[MultinomialLogit], weights=False,
+                                parallel=False, prediction=False)
     name = 'pylogit'
+    priority = 10
 
     def __init__(self, model, **kwargs):
         super().__init__(model)
@@ -40,11 +42,12 @@ class PylogitInterface(Interface):
                 np.arange(number_of_alternatives, dtype=int)+1)
             )
 
-        self._convert_to_long_format()
+        self.long_data = self._convert_to_long_format(model.materialise())
         self._create_specification_and_names()
         self._create_model()
+        self._initial_parameters = None
 
-    def _encode_alternatives_as_integers(self):
+    def _encode_alternatives_as_integers(self, data):
         """
         Convert choice labels from strings to integers as pylogit expects
         """
@@ -67,25 +70,27 @@ class PylogitInterface(Interface):
         # Create a dataframe column with the integer encoding. In the long
         # format this column will be a boolean for whether this choice was made
         # or not.
-        model.data[_CHOICE_COL] = model.data[model.choice_column].apply(
+        data[_CHOICE_COL] = data[model.choice_column].apply(
             lambda x: choice_encoding[x])
 
         return alt_specific_vars, availability_vars
 
-    def _convert_to_long_format(self):
+    def _convert_to_long_format(self, data, first_observation=0):
         """
-        Convert data to the long format expected by pylogit
+        Convert data to the long format expected by pylogit, numbering the
+        observations from first_observation + 1
         """
         model = self.model
         (alt_specific_vars,
-         availability_vars) = self._encode_alternatives_as_integers()
+         availability_vars) = self._encode_alternatives_as_integers(data)
         # Create observation number column as a range of integers from 1
-        model.data[_OBSERVATION_COL] = np.arange(model.data.shape[0],
-                                                 dtype=int)+1
+        data[_OBSERVATION_COL] = np.arange(
+            first_observation, first_observation + data.shape[0],
+            dtype=int)+1
 
         # Use pylogit routine to convert to long format
-        self.long_data = pl.convert_wide_to_long(
-            wide_data=model.data,
+        long_data = pl.convert_wide_to_long(
+            wide_data=data,
             ind_vars=model.alternative_independent_variables,
             alt_specific_vars=alt_specific_vars,
             availability_vars=availability_vars,
@@ -95,8 +100,41 @@ class PylogitInterface(Interface):
             )
 
         # Remove choice bool and observation_id column from wide data
-        model.data.drop(columns=[_CHOICE_COL, _OBSERVATION_COL],
-                        inplace=True)
+        data.drop(columns=[_CHOICE_COL, _OBSERVATION_COL], inplace=True)
+        return long_data
+
+    def append_data(self, data_or_file):
+        """
+        Append observations to the model's data for re-estimation.
+
+        Only the new observations are converted to the long format, and the
+        next estimation starts from the optimum of the previous one.
+
+        Args:
+            data_or_file (DataFrame or FileLike): The observations to append,
+                as for ChoiceModel.append_data.
+
+        Returns:
+            (DataFrame): The appended observations.
+        """
+        import pandas as pd
+
+        if self._estimated:
+            self._initial_parameters = self.pylogit_model.params.to_numpy()
+        number_of_observations = self.model.data.shape[0]
+        data = super().append_data(data_or_file)
+
+        long_data = self._convert_to_long_format(
+            self.model.materialise(data), number_of_observations)
+
+        # pylogit adds an intercept column to the long data it creates a model
+        # from, which the new observations do not have
+        previous = self.long_data
+        if 'intercept' in previous and 'intercept' not in long_data:
+            previous = previous.drop(columns='intercept')
+        self.long_data = pd.concat([previous, long_data], ignore_index=True)
+        self._create_model()
+        return data
 
     def _create_specification_and_names(self):
         """
@@ -104,7 +142,6 @@ class PylogitInterface(Interface):
         """
         specification = OrderedDict()
         names = OrderedDict()
-        pass
 
         model = self.model
         choice_encoding = self.choice_encoding
@@ -115,22 +152,20 @@ class PylogitInterface(Interface):
         names['intercept'] = [intercept
                               for intercept in model.intercepts.values()]
 
-        # Variables
-        for variable in model.all_variables():
-            # Identify which choice utilities contain variable
-            relevant_alternatives = [
-                choice for choice in model.alternatives
-                if variable in model.specification[choice].all_variables]
-
-            # Determine the corresponding parameters
-            parameters = [model.specification[choice].term_dict[variable]
-                          for choice in relevant_alternatives]
+        # Collect the (choice, parameter) pairs each variable appears in
+        # using a single pass over the utility terms
+        variable_terms = {variable: [] for variable in model.all_variables()}
+        for choice in model.alternatives:
+            for term in model.specification[choice].terms:
+                variable_terms[term.variable].append((choice, term.parameter))
 
+        # Variables
+        for variable, terms in variable_terms.items():
             # Group alternatives into parameter sets using choice encoding
-            parameter_set = set(parameters)
-            parameter_set = {parameter: [] for parameter in parameter_set}
-            for choice, parameter in zip(relevant_alternatives, parameters):
-                parameter_set[parameter].append(choice_encoding[choice])
+            parameter_set = {}
+            for choice, parameter in terms:
+                parameter_set.setdefault(parameter, []).append(
+                    choice_encoding[choice])
 
             # Unpack choice lists of length 1
             for parameter, alternatives in parameter_set.items():
@@ -158,11 +193,29 @@ class PylogitInterface(Interface):
                 names=self.names,
                 model_type='MNL')
 
-    def estimate(self, method='BFGS'):
+    def estimate(self, method='BFGS', gradient_tolerance=1.0e-6,
+                 loss_tolerance=1.0e-6, maximum_iterations=1000):
         """
-        Estimate the parameters of the choice model using pylogit.
+        Estimate the parameters of the choice model using pylogit. After
+        observations are appended estimation starts from the previous
+        optimum.
+
+        Args:
+            method (str, optional): The scipy.optimize.minimize method pylogit
+                uses. Methods using the Hessian, such as 'trust-ncg' or
+                'newton-cg', are given pylogit's analytic Hessian.
+            gradient_tolerance (float, optional): The gradient tolerance of
+                the optimisation.
+            loss_tolerance (float, optional): The tolerance of the change in
+                the objective function.
+            maximum_iterations (int, optional): The largest number of
+                iterations.
         """
-        initial_parameters = np.zeros(self.model.number_of_parameters())
+        if self._initial_parameters is not None:
+            # Warm start from the optimum before observations were appended
+            initial_parameters = self._initial_parameters
+        else:
+            initial_parameters = np.zeros(self.model.number_of_parameters())
 
         # Capture stdout as this contains the estimation time
         stdout = StringIO()
@@ -170,7 +223,10 @@ class PylogitInterface(Interface):
             # Call the pylogit estimation routine
             self.pylogit_model.fit_mle(
                 init_vals=initial_parameters,
-                method=method)
+                method=method,
+                loss_tol=loss_tolerance,
+                gradient_tol=gradient_tolerance,
+                maxiter=maximum_iterations)
 
         # Get estimation time from stdout
         self._estimation_time = float(
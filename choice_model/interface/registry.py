@@ -0,0 +1,221 @@
+"""
+Registry of estimation back ends
+
+Interfaces are registered by name and only imported when they are first
+requested. As well as the interfaces shipped with this package, other packages
+may provide interfaces by declaring an entry point in the
+"choice_model.interfaces" group, for example in setup.py:
+
+    entry_points={
+        'choice_model.interfaces': [
+            'my_engine = my_package.interface:MyEngineInterface'
+            ]
+        }
+"""
+
+from importlib import import_module
+
+ENTRY_POINT_GROUP = 'choice_model.interfaces'
+
+# Interfaces provided by this package, in the form 'module:class'
+_BUILTIN_INTERFACES = {
+    'pylogit': 'choice_model.interface.pylogit:PylogitInterface',
+    'alogit': 'choice_model.interface.alogit:AlogitInterface',
+    'native': 'choice_model.interface.native:NativeInterface',
+    }
+
+# Interfaces registered by name. Values are either interface classes or
+# 'module:class' strings which have not yet been imported.
+_registry = dict(_BUILTIN_INTERFACES)
+_entry_points_loaded = False
+
+
+def register_interface(name, interface):
+    """
+    Register an interface under a name.
+
+    Args:
+        name (str): The name used to request the interface.
+        interface (type or str): The interface class, or a string of the form
+            'module:class' locating it. Strings are not imported until the
+            interface is requested.
+    """
+    _registry[name] = interface
+
+
+def available_interfaces():
+    """
+    Produce a list of the names of all registered interfaces, including those
+    declared by entry points.
+
+    Returns:
+        (list[str]): The registered interface names.
+    """
+    _load_entry_points()
+    return list(_registry.keys())
+
+
+def get_interface(name):
+    """
+    Get an interface class by name, importing it if necessary.
+
+    Args:
+        name (str): The name the interface is registered under.
+
+    Returns:
+        (type): The interface class.
+
+    Raises:
+        UnknownInterface: Raised if no interface is registered as name.
+        InterfaceUnavailable: Raised if the interface, or one of its
+            dependencies, cannot be imported.
+    """
+    if name not in _registry:
+        _load_entry_points()
+        if name not in _registry:
+            raise UnknownInterface(name)
+
+    interface = _registry[name]
+    if isinstance(interface, str):
+        try:
+            interface = _import_object(interface)
+        except ImportError as error:
+            raise InterfaceUnavailable(name, error) from error
+        _registry[name] = interface
+    return interface
+
+
+def best_interface(model, **requirements):
+    """
+    Select the highest priority interface which can be imported and supports
+    a model.
+
+    Args:
+        model (ChoiceModel): The choice model to estimate.
+
+    Keyword Args:
+        Capabilities the interface must have, for example weights=True or
+        prediction=True.
+
+    Returns:
+        (type): The selected interface class.
+
+    Raises:
+        NoSuitableInterface: Raised if no available interface supports the
+            model and requirements.
+        ValueError: Raised if a requirement is not a capability.
+    """
+    from .interface import Capabilities
+
+    unknown = [key for key in requirements if key not in Capabilities._fields]
+    if unknown:
+        raise ValueError(
+            'Unknown capabilities {}, expected any of {}'.format(
+                unknown, list(Capabilities._fields)))
+
+    candidates = []
+    for name in available_interfaces():
+        try:
+            interface = get_interface(name)
+        except InterfaceUnavailable:
+            continue
+
+        if not interface.supports(model):
+            continue
+        capabilities = interface.capabilities._asdict()
+        if all(capabilities[key] == value
+               for key, value in requirements.items()):
+            candidates.append(interface)
+
+    if candidates == []:
+        raise NoSuitableInterface(model, requirements)
+
+    return max(candidates, key=lambda interface: interface.priority)
+
+
+def _import_object(path):
+    """
+    Import an object from a string of the form 'module:attribute'.
+    """
+    module, attribute = path.split(':')
+    return getattr(import_module(module), attribute)
+
+
+def _load_entry_points():
+    """
+    Add interfaces declared by installed packages' entry points to the
+    registry. Entry points are only scanned once and are not imported until
+    requested.
+    """
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+
+    for entry_point in _entry_points():
+        # Do not replace interfaces that have been explicitly registered
+        if entry_point.name not in _registry:
+            _registry[entry_point.name] = entry_point.value
+
+
+def _entry_points():
+    """
+    Produce the entry points in the interface group.
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        # Python < 3.8
+        import pkg_resources
+        return [_EntryPoint(entry_point.name,
+                            '{}:{}'.format(entry_point.module_name,
+                                           '.'.join(entry_point.attrs)))
+                for entry_point in
+                pkg_resources.iter_entry_points(ENTRY_POINT_GROUP)]
+
+    all_entry_points = entry_points()
+    if hasattr(all_entry_points, 'select'):
+        return list(all_entry_points.select(group=ENTRY_POINT_GROUP))
+    else:
+        # Python < 3.10 returns a dictionary of groups
+        return list(all_entry_points.get(ENTRY_POINT_GROUP, []))
+
+
+class _EntryPoint(object):
+    """
+    Minimal entry point record for Python versions without importlib.metadata
+    """
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+
+class UnknownInterface(Exception):
+    """
+    Exception for when an interface name has not been registered.
+    """
+    def __init__(self, name):
+        super().__init__(
+            'No interface registered with the name "{}"'.format(name)
+            )
+
+
+class InterfaceUnavailable(Exception):
+    """
+    Exception for when a registered interface cannot be imported.
+    """
+    def __init__(self, name, error):
+        super().__init__(
+            'Interface "{}" could not be imported: {}'.format(name, error)
+            )
+
+
+class NoSuitableInterface(Exception):
+    """
+    Exception for when no available interface supports a model.
+    """
+    def __init__(self, model, requirements):
+        super().__init__(
+            'No available interface supports model type "{}" with'
+            ' requirements {}'.format(type(model).__name__, requirements)
+            )
@@ -0,0 +1,356 @@
+"""
+Compiled utility evaluation kernels
+"""
+
+import numpy as np
+
+
+class UtilityKernel(object):
+    """
+    Utility evaluation kernel for a multinomial logit model.
+
+    The kernel is compiled from the terms of each alternative's utility and the
+    model's variable mappings into index arrays. The utilities of all
+    observations and alternatives are then evaluated as a single matrix product
+    of the data matrix, which holds each distinct data field once, with a
+    coefficient matrix scattered from the parameter vector. This avoids
+    creating a temporary array for each utility term.
+
+    The same kernel is used for estimation, prediction and simulation.
+
+    Args:
+        model (MultinomialLogit): The model to compile.
+
+    Attributes:
+        alternatives (list[str]): The alternatives, in the column order of
+            utility matrices.
+        parameter_names (list[str]): The intercept and parameter names, in the
+            order of parameter vectors.
+        fields (list[str]): The data fields used by the utilities, in the
+            column order of data matrices.
+    """
+
+    def __init__(self, model):
+        self.alternatives = list(model.alternatives)
+        self.parameter_names = (list(model.intercepts.values())
+                                + list(model.parameters))
+        parameter_index = {parameter: index for index, parameter
+                           in enumerate(self.parameter_names)}
+
+        fields = {}
+        term_alternative = []
+        term_field = []
+        term_parameter = []
+        intercept_alternative = []
+        intercept_parameter = []
+        for alternative_index, alternative in enumerate(self.alternatives):
+            utility = model.specification[alternative]
+
+            if utility.intercept is not None:
+                intercept_alternative.append(alternative_index)
+                intercept_parameter.append(parameter_index[utility.intercept])
+
+            for term in utility.terms:
+                field = model.variable_field(term.variable, alternative)
+                term_alternative.append(alternative_index)
+                term_field.append(fields.setdefault(field, len(fields)))
+                term_parameter.append(parameter_index[term.parameter])
+
+        self.fields = list(fields)
+        self.term_alternative = np.array(term_alternative, dtype=np.intp)
+        self.term_field = np.array(term_field, dtype=np.intp)
+        self.term_parameter = np.array(term_parameter, dtype=np.intp)
+        self.intercept_alternative = np.array(intercept_alternative,
+                                              dtype=np.intp)
+        self.intercept_parameter = np.array(intercept_parameter,
+                                            dtype=np.intp)
+        self._index_terms()
+
+    # The index arrays which, with the alternatives, parameter names and
+    # fields, define a kernel
+    _ARRAYS = ('term_alternative', 'term_field', 'term_parameter',
+               'intercept_alternative', 'intercept_parameter')
+
+    @classmethod
+    def from_dict(cls, kernel_dict):
+        """
+        Recreate a kernel from a dictionary, as produced by to_dict, without
+        the model it was compiled from.
+
+        Args:
+            kernel_dict (dict): The alternatives, parameter names, fields and
+                index arrays of the kernel.
+
+        Returns:
+            (UtilityKernel): The kernel.
+        """
+        kernel = cls.__new__(cls)
+        kernel.alternatives = list(kernel_dict['alternatives'])
+        kernel.parameter_names = list(kernel_dict['parameter_names'])
+        kernel.fields = list(kernel_dict['fields'])
+        for name in cls._ARRAYS:
+            setattr(kernel, name, np.asarray(kernel_dict[name], dtype=np.intp))
+        kernel._index_terms()
+        return kernel
+
+    def to_dict(self):
+        """
+        Produce a dictionary of the compiled kernel.
+
+        Returns:
+            (dict): The alternatives, parameter names and fields, as lists,
+                and the index arrays of the kernel.
+        """
+        kernel_dict = {'alternatives': self.alternatives,
+                       'parameter_names': self.parameter_names,
+                       'fields': self.fields}
+        for name in self._ARRAYS:
+            kernel_dict[name] = getattr(self, name)
+        return kernel_dict
+
+    def _index_terms(self):
+        """
+        Create the arrays locating the terms of each alternative and each
+        coefficient.
+        """
+        # Terms are created in alternative order, the terms of alternative j
+        # are those from term_pointer[j] to term_pointer[j+1]
+        self.term_pointer = np.searchsorted(
+            self.term_alternative,
+            np.arange(len(self.alternatives)+1)).astype(np.intp)
+
+        # Flat index of each term in the (field, alternative) coefficient
+        # matrix
+        self._coefficient_index = (self.term_field*self.number_of_alternatives
+                                   + self.term_alternative)
+
+    @property
+    def number_of_alternatives(self):
+        return len(self.alternatives)
+
+    @property
+    def number_of_parameters(self):
+        return len(self.parameter_names)
+
+    @property
+    def number_of_fields(self):
+        return len(self.fields)
+
+    def terms_by_alternative(self):
+        """
+        Produce the intercept and parameter terms of all utilities grouped by
+        alternative.
+
+        Returns:
+            (tuple): A tuple of three integer arrays (pointer, field,
+                parameter). The terms of alternative j are those from
+                pointer[j] to pointer[j+1]. field is the index of the term's
+                data field, or -1 for intercepts, and parameter is the index of
+                the term's parameter.
+        """
+        alternative = np.concatenate([self.intercept_alternative,
+                                      self.term_alternative])
+        field = np.concatenate([np.full(len(self.intercept_alternative), -1,
+                                        dtype=np.intp),
+                                self.term_field])
+        parameter = np.concatenate([self.intercept_parameter,
+                                    self.term_parameter])
+
+        order = np.argsort(alternative, kind='stable')
+        pointer = np.searchsorted(alternative[order],
+                                  np.arange(self.number_of_alternatives+1))
+        return (pointer.astype(np.intp), field[order], parameter[order])
+
+    def parameter_vector(self, parameters):
+        """
+        Arrange a dictionary of parameters as a parameter vector.
+
+        Args:
+            parameters (dict): Dictionary of parameter values, as returned by
+                Interface.parameters. Keys are the intercept and parameter
+                names.
+
+        Returns:
+            (numpy.ndarray): The parameter vector in the order of
+                parameter_names.
+        """
+        return np.array([parameters[name] for name in self.parameter_names],
+                        dtype=np.float64)
+
+    def data_matrix(self, data, dtype=np.float64):
+        """
+        Extract the fields used by the utilities from a dataframe.
+
+        Args:
+            data (DataFrame): The data, containing all fields in self.fields.
+            dtype (numpy.dtype, optional): The data type of the matrix.
+
+        Returns:
+            (numpy.ndarray): A C-contiguous array of shape (number of
+                observations, number of fields).
+        """
+        return np.ascontiguousarray(data[self.fields].to_numpy(dtype=dtype))
+
+    def mask_unavailable(self, data_matrix, availability):
+        """
+        Set non-finite values of fields used only by unavailable alternatives
+        to zero, so that missing values of unavailable alternatives, which
+        are often NaN, do not spread through the matrix product to the
+        utilities of available alternatives.
+
+        Args:
+            data_matrix (numpy.ndarray): The data matrix, as produced by
+                data_matrix.
+            availability (numpy.ndarray): Boolean array of shape (number of
+                observations, number of alternatives), True where an
+                alternative is available.
+
+        Returns:
+            (numpy.ndarray): data_matrix if all of its values are finite and
+                otherwise a masked copy.
+        """
+        finite = np.isfinite(data_matrix)
+        if finite.all():
+            return data_matrix
+        used = np.zeros((self.number_of_fields, self.number_of_alternatives),
+                        dtype=bool)
+        used[self.term_field, self.term_alternative] = True
+        needed = np.matmul(availability, used.T)
+        return np.where(finite | needed, data_matrix,
+                        data_matrix.dtype.type(0))
+
+    def coefficients(self, parameters):
+        """
+        Create the coefficient matrix for a parameter vector.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): Array of shape (number of fields, number of
+                alternatives) where element [i, j] is the coefficient of field
+                i in the utility of alternative j.
+        """
+        shape = (self.number_of_fields, self.number_of_alternatives)
+        # Use bincount so that coefficients of terms sharing a field and
+        # alternative are summed
+        return np.bincount(
+            self._coefficient_index,
+            weights=parameters[self.term_parameter],
+            minlength=shape[0]*shape[1]
+            ).reshape(shape)
+
+    def intercepts(self, parameters):
+        """
+        Create the vector of intercepts for a parameter vector.
+
+        Args:
+            parameters (numpy.ndarray): The parameter vector.
+
+        Returns:
+            (numpy.ndarray): The intercept of each alternative.
+        """
+        return np.bincount(self.intercept_alternative,
+                           weights=parameters[self.intercept_parameter],
+                           minlength=self.number_of_alternatives)
+
+    def utilities(self, data_matrix, parameters, out=None):
+        """
+        Evaluate the utility of every alternative for every observation.
+
+        Args:
+            data_matrix (numpy.ndarray): The data matrix, as produced by
+                data_matrix.
+            parameters (numpy.ndarray): The parameter vector.
+            out (numpy.ndarray, optional): Array of shape (number of
+                observations, number of alternatives) to write the utilities
+                to.
+
+        Returns:
+            (numpy.ndarray): The utilities, of shape (number of observations,
+                number of alternatives) with the data type of data_matrix.
+        """
+        dtype = data_matrix.dtype
+        coefficients = self.coefficients(parameters).astype(dtype, copy=False)
+        out = np.matmul(data_matrix, coefficients, out=out)
+        out += self.intercepts(parameters).astype(dtype, copy=False)
+        return out
+
+    def gradient(self, data_matrix, residuals):
+        """
+        Map derivatives with respect to the utilities onto the parameters.
+
+        Args:
+            data_matrix (numpy.ndarray): The data matrix, as produced by
+                data_matrix.
+            residuals (numpy.ndarray): Array of shape (number of observations,
+                number of alternatives) of the derivative of some function with
+                respect to each utility.
+
+        Returns:
+            (numpy.ndarray): The derivative of the function with respect to
+                each parameter.
+        """
+        # Accumulate in double precision whatever the precision of the data
+        field_gradient = np.matmul(data_matrix.T, residuals,
+                                   dtype=np.float64).ravel()
+        return self.parameter_gradient(
+            field_gradient[self._coefficient_index],
+            residuals.sum(axis=0, dtype=np.float64))
+
+    def observation_gradients(self, data_matrix, residuals):
+        """
+        Map derivatives with respect to the utilities onto the parameters for
+        each observation separately.
+
+        Args:
+            data_matrix (numpy.ndarray): The data matrix, as produced by
+                data_matrix.
+            residuals (numpy.ndarray): Array of shape (number of observations,
+                number of alternatives) of the derivative of some function of
+                each observation with respect to each utility.
+
+        Returns:
+            (numpy.ndarray): Array of shape (number of observations, number of
+                parameters) of the derivative of each observation's function
+                with respect to each parameter.
+        """
+        residuals = residuals.astype(np.float64, copy=False)
+        term_gradient = (data_matrix[:, self.term_field]
+                         * residuals[:, self.term_alternative])
+        alternative_gradient = residuals[:, self.intercept_alternative]
+        return (np.matmul(term_gradient, self._indicator(self.term_parameter))
+                + np.matmul(alternative_gradient,
+                            self._indicator(self.intercept_parameter)))
+
+    def _indicator(self, parameter):
+        """
+        Produce the matrix summing values of terms, as columns, onto their
+        parameters.
+        """
+        indicator = np.zeros((len(parameter), self.number_of_parameters))
+        indicator[np.arange(len(parameter)), parameter] = 1.
+        return indicator
+
+    def parameter_gradient(self, term_gradient, alternative_gradient):
+        """
+        Sum derivatives with respect to the coefficient of each term and the
+        intercept of each alternative onto the parameters.
+
+        Args:
+            term_gradient (numpy.ndarray): The derivative with respect to the
+                coefficient of each term.
+            alternative_gradient (numpy.ndarray): The derivative with respect
+                to the intercept of each alternative.
+
+        Returns:
+            (numpy.ndarray): The derivative with respect to each parameter.
+        """
+        gradient = np.bincount(self.term_parameter, weights=term_gradient,
+                               minlength=self.number_of_parameters)
+        gradient += np.bincount(
+            self.intercept_parameter,
+            weights=alternative_gradient[self.intercept_alternative],
+            minlength=self.number_of_parameters
+            )
+        return gradient
@@ -2,10 +2,12 @@
 Choice model definitions.
 """
 
+from collections import Counter
 from io import IOBase
-import pandas as pd
-from .utility import Utility
-import yaml
+import json
+import os.path
+from .utility import (Utility, InvalidTermContents, DuplicateVariables,
+                      DuplicateParameters)
 
 
 class ChoiceModel(object):
@@ -15,7 +17,8 @@ class ChoiceModel(object):
 
     def __init__(self, title, alternatives, choice_column, availability,
                  alternative_independent_variables,
-                 alternative_dependent_variables, intercepts, parameters):
+                 alternative_dependent_variables, intercepts, parameters,
+                 derived=None):
         """
         Choice model constructor.
 
@@ -48,6 +51,24 @@ class ChoiceModel(object):
                 intercept than the number of alternatives.
             parameters (list[str]): Names of all parameters (except intercepts)
                 used in defining the utlity specifications.
+            derived (dict, optional): Fields evaluated from the data rather
+                than read from it. The keys are the field labels and the
+                values expressions of other fields, as for
+                preprocess.Preprocessor, numbers for constant fields, or skim
+                lookups. For example:
+                    {'cycle_time': 'dist * 0.24',
+                     'cycle_non_linear':
+                         'minimum(maximum(cycle_time - 900, 0), 900)',
+                     'car_time': {'skim': 'skims/car_time.npy',
+                                  'origin': 'origin_zone',
+                                  'destination': 'destination_zone'}}
+                A skim lookup takes the element of an origin-destination
+                matrix, stored as a .npy file and memory mapped, at the zones
+                of two other fields. The zones are the row and column indices
+                of the matrix unless the key 'zones' gives the list of zones,
+                or the path of a .npy file of them, in matrix order.
+                Derived fields are evaluated only if the model uses them,
+                when data is compiled by an interface, see materialise.
         """
 
         self.title = title
@@ -60,11 +81,18 @@ class ChoiceModel(object):
         self.alternative_dependent_variables = alternative_dependent_variables
         self.intercepts = intercepts
         self.parameters = parameters
+        self.derived = derived or {}
         self.data = None
+        self._derived_cache = {}
+        self._skims = {}
 
         # Ensure all alternatives have an availability variable
         self._check_availability()
 
+        # Ensure derived fields are valid expressions which do not depend on
+        # themselves
+        self._check_derived()
+
         # Ensure that there are enough intercepts (one fewer than the number of
         # alternatives)
         self._check_intercepts()
@@ -81,8 +109,104 @@ class ChoiceModel(object):
             (ChoiceModel): A choice model object corresponding to the
                 definition in the stream.
         """
-        model_dict = yaml.load(stream, Loader=yaml.FullLoader)
-        return cls(*cls._unpack_yaml(model_dict))
+        model_dict = _load_yaml(stream)
+        return cls(*cls._unpack_yaml(model_dict),
+                   derived=model_dict.get('derived'))
+
+    @classmethod
+    def from_yaml_file(cls, path, cache_path=None):
+        """
+        Read the model definition from a YAML file, optionally using a compiled
+        cache of the definition.
+
+        If cache_path is given and the cache is newer than the YAML file the
+        model is loaded from the cache. Otherwise the YAML file is read and the
+        compiled model is written to cache_path.
+
+        Args:
+            path (str): Path of the YAML model definition.
+            cache_path (str, optional): Path of the compiled (JSON) model
+                definition.
+
+        Returns:
+            (ChoiceModel): A choice model object corresponding to the
+                definition in the file.
+        """
+        if (cache_path is not None and os.path.exists(cache_path)
+                and os.path.getmtime(cache_path) >= os.path.getmtime(path)):
+            with open(cache_path, 'r') as cache_file:
+                return cls.from_json(cache_file)
+
+        with open(path, 'r') as yaml_file:
+            model = cls.from_yaml(yaml_file)
+
+        if cache_path is not None:
+            with open(cache_path, 'w') as cache_file:
+                model.to_json(cache_file)
+
+        return model
+
+    @classmethod
+    def from_dict(cls, model_dict):
+        """
+        Create a model from a compiled model dictionary, as produced by
+        to_dict.
+
+        Args:
+            model_dict (dict): Dictionary of the compiled model definition.
+
+        Returns:
+            (ChoiceModel): The choice model object.
+        """
+        return cls(*cls._unpack_yaml(model_dict),
+                   derived=model_dict.get('derived'))
+
+    @classmethod
+    def from_json(cls, stream):
+        """
+        Read a compiled model definition, as written by to_json.
+
+        Args:
+            stream (stream): Data stream of the compiled model definition.
+
+        Returns:
+            (ChoiceModel): The choice model object.
+        """
+        return cls.from_dict(json.load(stream))
+
+    def to_dict(self):
+        """
+        Produce a dictionary of the validated model definition. Unlike the
+        YAML definition this is in a form which may be reloaded without any
+        parsing.
+
+        Returns:
+            (dict): Dictionary of the compiled model definition.
+        """
+        model_dict = {
+            'title': self.title,
+            'alternatives': self.alternatives,
+            'choice_column': self.choice_column,
+            'availability': self.availability,
+            'alternative_independent_variables': (
+                self.alternative_independent_variables),
+            'alternative_dependent_variables': (
+                self.alternative_dependent_variables),
+            'intercepts': self.intercepts,
+            'parameters': self.parameters
+            }
+        if self.derived:
+            model_dict['derived'] = self.derived
+        return model_dict
+
+    def to_json(self, stream):
+        """
+        Write the compiled model definition to a stream in JSON format.
+
+        Args:
+            stream (stream): Data stream to write to.
+        """
+        json.dump(self.to_dict(), stream)
 
     @classmethod
     def _unpack_yaml(cls, model_dict):
@@ -132,46 +256,349 @@ class ChoiceModel(object):
         else:
             raise MissingYamlKey(key)
 
-    def load_data(self, data_or_file):
+    def load_data(self, data_or_file, dtype=None):
         """
         Load data into pandas dataframe.
 
         Args:
             data_or_file (DataFrame or FileLike): Pandas dataframe or file
                 object containing the data to load into the model.
+            dtype (numpy.dtype, optional): If supplied, the variable fields
+                are converted to this type, for example numpy.float32 to
+                halve the memory used by the data.
         """
+        self.data = self._read_data(data_or_file, 'load_data')
+        self._derived_cache = {}
+
+        # Ensure that all required fields are defined in the dataframe
+        self._check_fields(data_or_file)
+
+        if dtype is not None:
+            self.data = self.data.astype(self._variable_types(dtype))
+
+    def append_data(self, data_or_file, dtype=None):
+        """
+        Append observations to the loaded data, as when survey data arrives
+        in batches. If no data is loaded the observations are loaded.
+
+        Only the new observations are read and checked. If both the loaded
+        and new data have the default integer index, the index of the new
+        observations continues from the loaded data.
+
+        Args:
+            data_or_file (DataFrame or FileLike): Pandas dataframe or file
+                object containing the observations to append.
+            dtype (numpy.dtype, optional): If supplied, the variable fields
+                of the new observations are converted to this type, as for
+                load_data.
+
+        Returns:
+            (DataFrame): The appended observations.
+        """
+        import pandas as pd
+
+        if self.data is None:
+            self.load_data(data_or_file, dtype)
+            return self.data
+
+        data = self._read_data(data_or_file, 'append_data')
+        self._check_fields(data_or_file, data)
+        if dtype is not None:
+            data = data.astype(self._variable_types(dtype))
+        if (isinstance(self.data.index, pd.RangeIndex)
+                and isinstance(data.index, pd.RangeIndex)):
+            data = data.set_index(pd.RangeIndex(
+                len(self.data), len(self.data) + len(data)))
+
+        self.data = pd.concat([self.data, data])
+        self._derived_cache = {}
+        return data
+
+    def _variable_types(self, dtype):
+        """
+        Produce the type of each data field the variables are evaluated from,
+        for DataFrame.astype.
+        """
+        return {field: dtype
+                for field in self.raw_fields(self.all_variable_fields())}
+
+    @staticmethod
+    def _read_data(data_or_file, method):
+        """
+        Produce a dataframe from a dataframe or a file-like object holding
+        CSV data.
+        """
+        import pandas as pd
+
         if isinstance(data_or_file, pd.DataFrame):
-            self.data = data_or_file
+            return data_or_file
         elif isinstance(data_or_file, IOBase):
-            self.data = pd.read_csv(data_or_file)
+            return pd.read_csv(data_or_file)
         else:
             raise TypeError(
-                'The argument to load_data must be a pandas dataframe or a '
-                'file-like object'
+                'The argument to {} must be a pandas dataframe or a '
+                'file-like object'.format(method)
                 )
 
-        # Ensure that all required fields are defined in the dataframe
-        self._check_fields(data_or_file)
+    def _check_fields(self, stream, data=None):
+        """
+        Ensures all required field are present in the pandas dataframe, data
+        if supplied or otherwise the loaded data. Derived fields need not be
+        present, but the fields they are evaluated from must be.
+        """
+        if data is None:
+            data = self.data
+        dataframe_columns = data.columns
+
+        # Ensure the choice column, availability and variable fields, or the
+        # fields they are derived from, are present
+        for field in self.raw_fields():
+            if field not in dataframe_columns:
+                raise MissingField(field, stream)
+
+    def _check_derived(self):
+        for label, definition in self.derived.items():
+            if isinstance(definition, dict):
+                missing = [key for key in ('skim', 'origin', 'destination')
+                           if key not in definition]
+                if missing:
+                    raise InvalidDerivedField(
+                        label, 'is a skim lookup without {}'.format(missing))
+
+        dependencies = {
+            label: [name for name in self._derived_dependencies(label)
+                    if name in self.derived]
+            for label in self.derived
+            }
+
+        # Depth first search for cycles of dependencies
+        finished = set()
+
+        def visit(label, path):
+            if label in path:
+                raise InvalidDerivedField(
+                    label, 'depends on itself through {}'.format(
+                        ' -> '.join(path[path.index(label):] + [label])))
+            if label not in finished:
+                for name in dependencies[label]:
+                    visit(name, path + [label])
+                finished.add(label)
+
+        for label in self.derived:
+            visit(label, [])
+
+    def required_fields(self):
+        """
+        Produce a list of the fields the model uses, the choice column,
+        availability fields and variable fields, without duplicates. These
+        may be derived fields.
+        """
+        fields = ([self.choice_column] + self.availability_fields()
+                  + self.all_variable_fields())
+        return list(dict.fromkeys(fields))
+
+    def _derived_dependencies(self, label):
+        """
+        Produce the fields a derived field is evaluated from.
+        """
+        from .preprocess import expression_columns
+
+        definition = self.derived[label]
+        if isinstance(definition, str):
+            return expression_columns(definition)
+        if isinstance(definition, dict):
+            return [definition['origin'], definition['destination']]
+        return []
+
+    def raw_fields(self, fields=None):
+        """
+        Produce a list of the fields of the data needed to evaluate fields,
+        replacing derived fields by the fields they are evaluated from.
+
+        Args:
+            fields (list[str], optional): The fields. If not supplied the
+                fields the model uses, given by required_fields, are used.
+
+        Returns:
+            (list[str]): The data fields, without duplicates.
+        """
+        if fields is None:
+            fields = self.required_fields()
+        raw = {}
+
+        def add(label):
+            if label not in self.derived:
+                raw[label] = None
+            else:
+                for name in self._derived_dependencies(label):
+                    add(name)
 
-    def _check_fields(self, stream):
+        for field in fields:
+            add(field)
+        return list(raw)
+
+    def derived_fields(self):
+        """
+        Produce a list of the derived fields the model uses, directly or
+        through other derived fields, in order of evaluation.
+        """
+        used = {}
+
+        def add(label):
+            if label in self.derived and label not in used:
+                for name in self._derived_dependencies(label):
+                    add(name)
+                used[label] = None
+
+        for field in self.required_fields():
+            add(field)
+        return list(used)
+
+    def materialise(self, data=None, cache=True):
+        """
+        Produce data with the derived fields the model uses evaluated.
+
+        Derived fields are evaluated as whole column operations, and only if
+        the model uses them. The columns evaluated for the loaded data are
+        cached until data is next loaded or appended.
+
+        Args:
+            data (DataFrame, optional): The data. If not supplied the loaded
+                data is used.
+            cache (bool, optional): If False, the columns of the loaded data
+                are evaluated again rather than taken from, or stored in, the
+                cache.
+
+        Returns:
+            (DataFrame): data with the derived fields the model uses added
+                or, if the model has no derived fields, data itself.
+
+        Raises:
+            UndefinedColumn: Raised if an expression refers to a field which
+                is not in data.
+            MissingField: Raised if a zone field of a skim lookup is not in
+                data.
+            UnknownZone: Raised if a zone is not in a skim matrix.
+        """
+        import pandas as pd
+
+        if data is None:
+            data = self.data
+        if not self.derived:
+            return data
+
+        columns = self._derived_cache if (
+            cache and data is self.data) else {}
+        derived = self.derived_fields()
+        for label in derived:
+            if label in columns:
+                continue
+            values = {}
+            for name in self._derived_dependencies(label):
+                if name in self.derived:
+                    values[name] = columns[name]
+                elif name in data.columns:
+                    values[name] = data[name].to_numpy()
+            columns[label] = self.evaluate_derived(label, values, data)
+
+        # Derived fields replace data fields of the same label
+        replaced = [label for label in derived if label in data.columns]
+        if replaced:
+            data = data.drop(columns=replaced)
+        return pd.concat(
+            [data, pd.DataFrame({label: columns[label] for label in derived},
+                                index=data.index)],
+            axis=1, copy=False)
+
+    def evaluate_derived(self, label, values, data):
+        """
+        Evaluate a derived field from the values of the fields it depends on.
+
+        Args:
+            label (str): The label of the derived field.
+            values (dict): The array of each field the derived field depends
+                on.
+            data (DataFrame): The data the values are from, giving the number
+                of observations.
+
+        Returns:
+            (numpy.ndarray): The values of the derived field.
+
+        Raises:
+            UndefinedColumn: Raised if an expression refers to a field which
+                is not in values.
+            MissingField: Raised if a zone field of a skim lookup is not in
+                values.
+            UnknownZone: Raised if a zone is not in a skim matrix.
         """
-        Ensures all required field are present in the pandas dataframe.
+        from .preprocess import evaluate, _as_column
+
+        definition = self.derived[label]
+        if isinstance(definition, str):
+            definition = evaluate(definition, values)
+        elif isinstance(definition, dict):
+            for name in (definition['origin'], definition['destination']):
+                if name not in values:
+                    raise MissingField(name, data)
+            definition = self._skim_values(
+                label, values[definition['origin']],
+                values[definition['destination']])
+        return _as_column(definition, len(data))
+
+    def skim_matrix(self, field):
         """
-        dataframe_columns = self.data.columns
+        Open the matrix of a skim lookup field. Matrices are memory mapped,
+        so that only the elements looked up are read, and opened once.
+
+        Args:
+            field (str): The label of the derived field.
+
+        Returns:
+            (numpy.ndarray): The read only, memory mapped matrix.
 
-        # Ensure choice column is present
-        if self.choice_column not in dataframe_columns:
-            raise MissingField(self.choice_column, stream)
+        Raises:
+            InvalidDerivedField: Raised if the matrix is not two dimensional
+                or does not have a row and column for each zone.
+        """
+        import numpy as np
 
-        # Ensure all availability variables are present
-        for availability in self.availability.values():
-            if availability not in dataframe_columns:
-                raise MissingField(availability, stream)
+        definition = self.derived[field]
+        path = definition['skim']
+        if path not in self._skims:
+            matrix = np.load(path, mmap_mode='r')
+            if matrix.ndim != 2:
+                raise InvalidDerivedField(
+                    field, 'skim "{}" is not a matrix'.format(path))
+            self._skims[path] = matrix
+        matrix = self._skims[path]
 
-        # Ensure all variables are present
-        for variable in self.all_variable_fields():
-            if variable not in dataframe_columns:
-                raise MissingField(variable, stream)
+        zones = self._skim_zones(field)
+        if zones is not None and matrix.shape != (len(zones), len(zones)):
+            raise InvalidDerivedField(
+                field, 'skim "{}" of shape {} does not have {} zones'.format(
+                    path, matrix.shape, len(zones)))
+        return matrix
+
+    def _skim_zones(self, field):
+        """
+        Produce the zones of a skim lookup field in matrix order, or None if
+        the zones are the matrix indices.
+        """
+        import numpy as np
+
+        zones = self.derived[field].get('zones')
+        if isinstance(zones, str):
+            if zones not in self._skims:
+                self._skims[zones] = np.load(zones)
+            return self._skims[zones]
+        return None if zones is None else np.asarray(zones)
+
+    def _skim_values(self, field, origin, destination):
+        """
+        Look up the skim matrix of a field at each origin and destination.
+        """
+        return _skim_lookup(self.skim_matrix(field), self._skim_zones(field),
+                            origin, destination, field)
 
     def _check_availability(self):
         for choice in self.alternatives:
@@ -206,22 +633,47 @@ class ChoiceModel(object):
     def alternative_dependent_variable_fields(self):
         """
         Produce a list of all expected fields in the data file corresponding to
-        choice dependent variables.
+        choice dependent variables. A field mapped to several alternatives or
+        variables, such as a car time shared by car drivers and passengers,
+        is listed once.
         """
         alternative_dependent = [
             label for variable in self.alternative_dependent_variables.values()
             for label in variable.values()
             ]
-        return alternative_dependent
+        return list(dict.fromkeys(alternative_dependent))
 
     def all_variable_fields(self):
         """
         Produce a list of all expected fields in the data file corresponding to
-        choice dependent or independent variables.
+        choice dependent or independent variables, without duplicates.
         """
         alternative_independent = self.alternative_independent_variables
         alternative_dependent = self.alternative_dependent_variable_fields()
-        return alternative_independent + alternative_dependent
+        return list(dict.fromkeys(alternative_independent
+                                  + alternative_dependent))
+
+    def variable_field(self, variable, alternative):
+        """
+        Determine the field in the data file holding the value of a variable
+        for an alternative.
+
+        Args:
+            variable (str): The variable name.
+            alternative (str): The alternative.
+
+        Returns:
+            (str): The label of the field. For alternative independent
+                variables this is the variable name.
+
+        Raises:
+            KeyError: Raised if variable is alternative dependent and not
+                defined for alternative.
+        """
+        if variable in self.alternative_dependent_variables:
+            return self.alternative_dependent_variables[variable][alternative]
+        else:
+            return variable
 
     def availability_fields(self):
         """
@@ -252,34 +704,684 @@ class ChoiceModel(object):
 class MultinomialLogit(ChoiceModel):
     """
     Multinomial logit choice model class.
+
+    For models with very many alternatives, such as destination choice,
+    estimation may use a sample of the alternatives of each observation,
+    defined for example by
+
+        sampling:
+          alternatives: 20
+          importance:
+            zone1: size_zone1
+            zone2: size_zone2
+
+    which draws 20 alternatives with replacement for each observation, in
+    proportion to the values of the importance field of each available
+    alternative, and adds the chosen alternative. Without importance the
+    draws are uniform over the available alternatives.
+
+    Args:
+        title, alternatives, choice_column, availability,
+            alternative_independent_variables,
+            alternative_dependent_variables, intercepts, parameters: As for
+            ChoiceModel.
+        specification (dict): The utility of each alternative, as a string
+            or Utility object.
+        sampling (dict, optional): The sampling of alternatives in
+            estimation, with the keys 'alternatives', the number of draws per
+            observation, and optionally 'importance', a dictionary of the
+            label of the field holding the sampling weight of each
+            alternative.
+        derived (dict, optional): As for ChoiceModel.
     """
     def __init__(self, title, alternatives, choice_column, availability,
                  alternative_independent_variables,
                  alternative_dependent_variables, intercepts, parameters,
-                 specification):
+                 specification, sampling=None, derived=None):
         super().__init__(title, alternatives, choice_column, availability,
                          alternative_independent_variables,
                          alternative_dependent_variables, intercepts,
-                         parameters)
+                         parameters, derived)
+        self.sampling = sampling
+
+        # Ensure that a positive number of alternatives is drawn and that
+        # every alternative has an importance field
+        self._check_sampling()
 
-        # Create utility definitions
+        # Create utility definitions. Utility objects are used as given,
+        # strings are parsed.
+        all_variables = frozenset(self.all_variables())
+        all_parameters = frozenset(self.parameters)
         self.specification = {}
         for choice in self.alternatives:
+            if isinstance(specification[choice], Utility):
+                self.specification[choice] = specification[choice]
+                continue
+
             if choice in self.intercepts:
                 intercept = self.intercepts[choice]
             else:
                 intercept = None
             self.specification[choice] = Utility(specification[choice],
-                                                 self.all_variables(),
+                                                 all_variables,
                                                  intercept,
-                                                 self.parameters)
+                                                 all_parameters)
 
     @classmethod
     def from_yaml(cls, stream):
-        model_dict = yaml.load(stream, Loader=yaml.FullLoader)
+        model_dict = _load_yaml(stream)
         specification = cls._copy_yaml_record('specification', model_dict)
 
-        return cls(*super()._unpack_yaml(model_dict), specification)
+        return cls(*super()._unpack_yaml(model_dict), specification,
+                   model_dict.get('sampling'), model_dict.get('derived'))
+
+    @classmethod
+    def from_dict(cls, model_dict):
+        specification = cls._unpack_compiled_specification(model_dict)
+
+        return cls(*super()._unpack_yaml(model_dict), specification,
+                   model_dict.get('sampling'), model_dict.get('derived'))
+
+    @classmethod
+    def _unpack_compiled_specification(cls, model_dict):
+        """
+        Create the utilities of a compiled model dictionary.
+        """
+        return {
+            choice: Utility.from_terms(utility['terms'], utility['intercept'])
+            for choice, utility in cls._copy_yaml_record(
+                'specification', model_dict).items()
+            }
+
+    def to_dict(self):
+        model_dict = super().to_dict()
+        model_dict['specification'] = {
+            choice: {'intercept': utility.intercept,
+                     'terms': [list(term) for term in utility.terms]}
+            for choice, utility in self.specification.items()
+            }
+        if self.sampling is not None:
+            model_dict['sampling'] = self.sampling
+        return model_dict
+
+    def _check_sampling(self):
+        if self.sampling is None:
+            return
+        number = self.sampling.get('alternatives')
+        if not isinstance(number, int) or number < 1:
+            raise InvalidSampling(
+                'the number of alternatives must be a positive integer')
+        importance = self.sampling.get('importance')
+        if importance is not None:
+            missing = [alternative for alternative in self.alternatives
+                       if alternative not in importance]
+            if missing:
+                raise InvalidSampling(
+                    'no importance field for {}'.format(missing))
+
+    def required_fields(self):
+        """
+        Produce a list of the fields the model uses, including the importance
+        fields of sampling of alternatives.
+        """
+        return list(dict.fromkeys(
+            super().required_fields() + self.sampling_fields()))
+
+    def sampling_fields(self):
+        """
+        Produce a list of the importance fields of sampling of alternatives,
+        in the order of the alternatives, which is empty if alternatives are
+        not sampled by importance.
+        """
+        if self.sampling is None or 'importance' not in self.sampling:
+            return []
+        importance = self.sampling['importance']
+        return [importance[alternative] for alternative in self.alternatives]
+
+    @classmethod
+    def from_terms(cls, title, alternatives, choice_column, availability,
+                   alternative_independent_variables,
+                   alternative_dependent_variables, intercepts, parameters,
+                   terms):
+        """
+        Create a multinomial logit model from lists of utility terms, without
+        creating or parsing utility strings.
+
+        All terms are validated together before any utilities are created.
+
+        Args:
+            title, alternatives, choice_column, availability,
+                alternative_independent_variables,
+                alternative_dependent_variables, intercepts, parameters: As
+                for the ChoiceModel constructor.
+            terms (dict): A dictionary with alternatives as keys and lists of
+                (variable, parameter) pairs as values. The terms are the
+                non-intercept terms of the alternative's utility, the intercept
+                is taken from intercepts.
+
+        Returns:
+            (MultinomialLogit): Multinomial logit choice model object.
+
+        Raises:
+            InvalidTermContents: Raised if a term's variable or parameter is
+                not defined in the model.
+            DuplicateVariables: Raised if a variable is used more than once in
+                a utility.
+            DuplicateParameters: Raised if a parameter is used more than once
+                in a utility.
+        """
+        all_variables = frozenset(alternative_independent_variables
+                                  + list(alternative_dependent_variables))
+        all_parameters = frozenset(parameters)
+
+        for choice in alternatives:
+            variables = [variable for variable, _ in terms[choice]]
+            choice_parameters = [parameter for _, parameter in terms[choice]]
+            if not (all_variables.issuperset(variables)
+                    and all_parameters.issuperset(choice_parameters)):
+                # Find the first offending term to report
+                for variable, parameter in terms[choice]:
+                    if (variable not in all_variables
+                            or parameter not in all_parameters):
+                        raise InvalidTermContents(variable, parameter)
+            if len(set(variables)) != len(variables):
+                raise DuplicateVariables(cls._duplicates(variables))
+            if len(set(choice_parameters)) != len(choice_parameters):
+                raise DuplicateParameters(cls._duplicates(choice_parameters))
+
+        specification = {
+            choice: Utility.from_terms(terms[choice], intercepts.get(choice))
+            for choice in alternatives
+            }
+
+        return cls(title, alternatives, choice_column, availability,
+                   alternative_independent_variables,
+                   alternative_dependent_variables, intercepts, parameters,
+                   specification)
+
+    @classmethod
+    def from_parameter_matrix(cls, title, alternatives, choice_column,
+                              availability, alternative_independent_variables,
+                              alternative_dependent_variables, intercepts,
+                              parameters, parameter_index):
+        """
+        Create a multinomial logit model from a matrix of parameter indices.
+
+        Element [i, j] of the matrix is the index in parameters of the
+        parameter multiplying variable j in the utility of alternative i, or -1
+        if variable j does not appear in the utility. Variables are ordered as
+        returned by all_variables, that is alternative independent variables
+        followed by alternative dependent variables.
+
+        Args:
+            title, alternatives, choice_column, availability,
+                alternative_independent_variables,
+                alternative_dependent_variables, intercepts, parameters: As
+                for the ChoiceModel constructor.
+            parameter_index (array_like): Integer array of shape
+                (number of alternatives, number of variables).
+
+        Returns:
+            (MultinomialLogit): Multinomial logit choice model object.
+
+        Raises:
+            ValueError: Raised if parameter_index has the wrong shape or
+                contains indices outside of parameters.
+            DuplicateParameters: Raised if a parameter is used more than once
+                in a utility.
+        """
+        import numpy as np
+
+        variables = (alternative_independent_variables
+                     + list(alternative_dependent_variables))
+        parameter_index = np.asarray(parameter_index)
+
+        # Validate the whole matrix at once
+        expected_shape = (len(alternatives), len(variables))
+        if parameter_index.shape != expected_shape:
+            raise ValueError(
+                'parameter_index has shape {}, expected {}'.format(
+                    parameter_index.shape, expected_shape)
+                )
+        if ((parameter_index < -1).any()
+                or (parameter_index >= len(parameters)).any()):
+            raise ValueError('parameter_index contains invalid indices')
+        # Parameters used more than once in a row are adjacent once sorted
+        ordered = np.sort(parameter_index, axis=1)
+        repeated = (ordered[:, 1:] == ordered[:, :-1]) & (ordered[:, 1:] >= 0)
+        if repeated.any():
+            row = np.nonzero(repeated.any(axis=1))[0][0]
+            raise DuplicateParameters(
+                [parameters[index] for index in np.unique(
+                    ordered[row, 1:][repeated[row]])]
+                )
+
+        terms = {}
+        for choice, row in zip(alternatives, parameter_index):
+            columns = np.nonzero(row >= 0)[0]
+            terms[choice] = [(variables[column], parameters[row[column]])
+                             for column in columns]
+
+        specification = {
+            choice: Utility.from_terms(terms[choice], intercepts.get(choice))
+            for choice in alternatives
+            }
+
+        return cls(title, alternatives, choice_column, availability,
+                   alternative_independent_variables,
+                   alternative_dependent_variables, intercepts, parameters,
+                   specification)
+
+    @staticmethod
+    def _duplicates(labels):
+        """
+        Produce a list of labels which occur more than once.
+        """
+        return [key for key, value in Counter(labels).items() if value > 1]
+
+
+class MixedLogit(MultinomialLogit):
+    """
+    Mixed logit choice model class.
+
+    A multinomial logit model in which some parameters are random, each
+    normally distributed over the observations with its own standard deviation
+    parameter. For example a random parameter defined by
+
+        random_parameters:
+          ptime: sigma_time
+
+    takes the value ptime + sigma_time * z in each observation, where z is a
+    standard normal random variable.
+
+    Args:
+        title, alternatives, choice_column, availability,
+            alternative_independent_variables,
+            alternative_dependent_variables, intercepts, parameters,
+            specification, derived: As for MultinomialLogit.
+        random_parameters (dict): A dictionary with the random parameters,
+            which may be parameters or intercepts, as keys and the names of
+            their standard deviation parameters as values.
+    """
+    def __init__(self, title, alternatives, choice_column, availability,
+                 alternative_independent_variables,
+                 alternative_dependent_variables, intercepts, parameters,
+                 specification, random_parameters, derived=None):
+        super().__init__(title, alternatives, choice_column, availability,
+                         alternative_independent_variables,
+                         alternative_dependent_variables, intercepts,
+                         parameters, specification, derived=derived)
+        self.random_parameters = random_parameters
+
+        # Ensure the random parameters exist and their standard deviations
+        # have unique, new names
+        self._check_random_parameters()
+
+    @classmethod
+    def from_yaml(cls, stream):
+        model_dict = _load_yaml(stream)
+        specification = cls._copy_yaml_record('specification', model_dict)
+        random_parameters = cls._copy_yaml_record('random_parameters',
+                                                  model_dict)
+
+        return cls(*cls._unpack_yaml(model_dict), specification,
+                   random_parameters, model_dict.get('derived'))
+
+    @classmethod
+    def from_dict(cls, model_dict):
+        specification = cls._unpack_compiled_specification(model_dict)
+        random_parameters = cls._copy_yaml_record('random_parameters',
+                                                  model_dict)
+
+        return cls(*cls._unpack_yaml(model_dict), specification,
+                   random_parameters, model_dict.get('derived'))
+
+    def to_dict(self):
+        model_dict = super().to_dict()
+        model_dict['random_parameters'] = self.random_parameters
+        return model_dict
+
+    def _check_random_parameters(self):
+        all_parameters = (frozenset(self.parameters)
+                          | frozenset(self.intercepts.values()))
+        for parameter in self.random_parameters:
+            if parameter not in all_parameters:
+                raise UndefinedRandomParameter(parameter)
+
+        standard_deviations = self.standard_deviations()
+        clashes = all_parameters.intersection(standard_deviations)
+        if clashes:
+            raise DuplicateParameters(sorted(clashes))
+        if len(set(standard_deviations)) != len(standard_deviations):
+            raise DuplicateParameters(self._duplicates(standard_deviations))
+
+    def standard_deviations(self):
+        """
+        Produce a list of the standard deviation parameters, in the order of
+        random_parameters.
+        """
+        return list(self.random_parameters.values())
+
+    def number_of_parameters(self, include_intercepts=True):
+        """
+        Determine the number of parameters/coefficients in the model,
+        including the standard deviations of the random parameters.
+
+        Args:
+            including_intercepts (bool, default=True): if True include the
+                number of intercepts in the count.
+        """
+        return (super().number_of_parameters(include_intercepts)
+                + len(self.random_parameters))
+
+
+class NestedLogit(MultinomialLogit):
+    """
+    Nested logit choice model class.
+
+    A two level nested logit model. Alternatives may be grouped into nests,
+    each with a logsum (scale) parameter, for example
+
+        nests:
+          motorised:
+            alternatives:
+              - car
+              - passenger
+            parameter: lambda_motorised
+
+    Alternatives which are not in a nest are choices at the root of the tree.
+    When every logsum parameter is one the model is multinomial logit.
+
+    Args:
+        title, alternatives, choice_column, availability,
+            alternative_independent_variables,
+            alternative_dependent_variables, intercepts, parameters,
+            specification, derived: As for MultinomialLogit.
+        nests (dict): A dictionary with the nest names as keys and
+            dictionaries with the keys 'alternatives', the list of
+            alternatives in the nest, and 'parameter', the name of the nest's
+            logsum parameter, as values.
+    """
+    def __init__(self, title, alternatives, choice_column, availability,
+                 alternative_independent_variables,
+                 alternative_dependent_variables, intercepts, parameters,
+                 specification, nests, derived=None):
+        super().__init__(title, alternatives, choice_column, availability,
+                         alternative_independent_variables,
+                         alternative_dependent_variables, intercepts,
+                         parameters, specification, derived=derived)
+        self.nests = nests
+
+        # Ensure that nests contain known alternatives, each alternative is in
+        # at most one nest and nest parameters have unique, new names
+        self._check_nests()
+
+    @classmethod
+    def from_yaml(cls, stream):
+        model_dict = _load_yaml(stream)
+        specification = cls._copy_yaml_record('specification', model_dict)
+        nests = cls._copy_yaml_record('nests', model_dict)
+
+        return cls(*cls._unpack_yaml(model_dict), specification, nests,
+                   model_dict.get('derived'))
+
+    @classmethod
+    def from_dict(cls, model_dict):
+        specification = cls._unpack_compiled_specification(model_dict)
+        nests = cls._copy_yaml_record('nests', model_dict)
+
+        return cls(*cls._unpack_yaml(model_dict), specification, nests,
+                   model_dict.get('derived'))
+
+    def to_dict(self):
+        model_dict = super().to_dict()
+        model_dict['nests'] = self.nests
+        return model_dict
+
+    def _check_nests(self):
+        alternatives = frozenset(self.alternatives)
+        nest_of = {}
+        for name, nest in self.nests.items():
+            for key in ('alternatives', 'parameter'):
+                if key not in nest:
+                    raise MissingYamlKey('nests: {}: {}'.format(name, key))
+            if name in alternatives:
+                raise InvalidNest(name, 'has the name of an alternative')
+            if not nest['alternatives']:
+                raise InvalidNest(name, 'has no alternatives')
+            for alternative in nest['alternatives']:
+                if alternative not in alternatives:
+                    raise InvalidNest(
+                        name,
+                        'contains unknown alternative "{}"'.format(alternative)
+                        )
+                if alternative in nest_of:
+                    raise InvalidNest(
+                        name,
+                        'contains alternative "{}" which is also in nest'
+                        ' "{}"'.format(alternative, nest_of[alternative])
+                        )
+                nest_of[alternative] = name
+
+        all_parameters = (frozenset(self.parameters)
+                          | frozenset(self.intercepts.values()))
+        nest_parameters = self.nest_parameters()
+        clashes = all_parameters.intersection(nest_parameters)
+        if clashes:
+            raise DuplicateParameters(sorted(clashes))
+        if len(set(nest_parameters)) != len(nest_parameters):
+            raise DuplicateParameters(self._duplicates(nest_parameters))
+
+    def nest_parameters(self):
+        """
+        Produce a list of the logsum parameters of the nests, in the order of
+        nests.
+        """
+        return [nest['parameter'] for nest in self.nests.values()]
+
+    def unnested_alternatives(self):
+        """
+        Produce a list of the alternatives which are not in a nest.
+        """
+        nested = frozenset(alternative for nest in self.nests.values()
+                           for alternative in nest['alternatives'])
+        return [alternative for alternative in self.alternatives
+                if alternative not in nested]
+
+    def number_of_parameters(self, include_intercepts=True):
+        """
+        Determine the number of parameters/coefficients in the model,
+        including the logsum parameters of the nests.
+
+        Args:
+            including_intercepts (bool, default=True): if True include the
+                number of intercepts in the count.
+        """
+        return (super().number_of_parameters(include_intercepts)
+                + len(self.nests))
+
+
+class LatentClassLogit(MultinomialLogit):
+    """
+    Latent class logit choice model class.
+
+    Each observation belongs to one of a number of unobserved classes, and
+    makes its choice by a multinomial logit model with the specification of
+    the model and the class's own values of the parameters and intercepts.
+    The probability of membership of each class is a multinomial logit
+    function of a constant and, optionally, alternative independent
+    variables, for example
+
+        classes:
+          - habitual
+          - flexible
+        class_membership_variables:
+          - has_car
+
+    The parameters of a class are named by appending the class name to the
+    model's parameters, for example ptime_habitual. The membership parameters
+    of every class but the first, which is the reference class, are named
+    share_<class> for the constant and share_<class>_<variable> for the
+    variables.
+
+    Args:
+        title, alternatives, choice_column, availability,
+            alternative_independent_variables,
+            alternative_dependent_variables, intercepts, parameters,
+            specification, derived: As for MultinomialLogit.
+        classes (list[str]): The names of the latent classes.
+        class_membership_variables (list[str], optional): Alternative
+            independent variables of the class membership model.
+    """
+    def __init__(self, title, alternatives, choice_column, availability,
+                 alternative_independent_variables,
+                 alternative_dependent_variables, intercepts, parameters,
+                 specification, classes, class_membership_variables=None,
+                 derived=None):
+        super().__init__(title, alternatives, choice_column, availability,
+                         alternative_independent_variables,
+                         alternative_dependent_variables, intercepts,
+                         parameters, specification, derived=derived)
+        self.classes = classes
+        self.class_membership_variables = list(
+            class_membership_variables or [])
+
+        # Ensure there are at least two, uniquely named classes, membership
+        # variables are alternative independent variables and class parameter
+        # names are unique
+        self._check_classes()
+
+    @classmethod
+    def from_yaml(cls, stream):
+        model_dict = _load_yaml(stream)
+        specification = cls._copy_yaml_record('specification', model_dict)
+        classes = cls._copy_yaml_record('classes', model_dict)
+
+        return cls(*cls._unpack_yaml(model_dict), specification, classes,
+                   model_dict.get('class_membership_variables'),
+                   model_dict.get('derived'))
+
+    @classmethod
+    def from_dict(cls, model_dict):
+        specification = cls._unpack_compiled_specification(model_dict)
+        classes = cls._copy_yaml_record('classes', model_dict)
+
+        return cls(*cls._unpack_yaml(model_dict), specification, classes,
+                   model_dict.get('class_membership_variables'),
+                   model_dict.get('derived'))
+
+    def to_dict(self):
+        model_dict = super().to_dict()
+        model_dict['classes'] = self.classes
+        model_dict['class_membership_variables'] = (
+            self.class_membership_variables)
+        return model_dict
+
+    def _check_classes(self):
+        if len(self.classes) < 2:
+            raise InvalidLatentClasses('at least two classes are required')
+        if len(set(self.classes)) != len(self.classes):
+            raise InvalidLatentClasses('duplicate classes {}'.format(
+                self._duplicates(self.classes)))
+        for variable in self.class_membership_variables:
+            if variable not in self.alternative_independent_variables:
+                raise InvalidLatentClasses(
+                    'membership variable "{}" is not an alternative'
+                    ' independent variable'.format(variable))
+
+        all_parameters = [self.class_parameter(parameter, latent_class)
+                          for latent_class in self.classes
+                          for parameter in (list(self.intercepts.values())
+                                            + self.parameters)]
+        all_parameters += self.membership_parameters()
+        if len(set(all_parameters)) != len(all_parameters):
+            raise DuplicateParameters(self._duplicates(all_parameters))
+
+    @staticmethod
+    def class_parameter(parameter, latent_class):
+        """
+        Produce the name of a class's value of a parameter or intercept.
+
+        Args:
+            parameter (str): The parameter or intercept name.
+            latent_class (str): The class name.
+
+        Returns:
+            (str): The name of the class parameter.
+        """
+        return '{}_{}'.format(parameter, latent_class)
+
+    def membership_parameters(self):
+        """
+        Produce a list of the parameters of the class membership model, the
+        constant followed by the variable parameters of each class except the
+        first.
+        """
+        return [name for latent_class in self.classes[1:]
+                for name in (
+                    ['share_{}'.format(latent_class)]
+                    + ['share_{}_{}'.format(latent_class, variable)
+                       for variable in self.class_membership_variables]
+                    )]
+
+    def number_of_parameters(self, include_intercepts=True):
+        """
+        Determine the number of parameters/coefficients in the model,
+        including the parameters of every class and of the class membership
+        model.
+
+        Args:
+            including_intercepts (bool, default=True): if True include the
+                number of intercepts in the count.
+        """
+        return (len(self.classes)
+                * super().number_of_parameters(include_intercepts)
+                + len(self.membership_parameters()))
+
+
+def _skim_lookup(matrix, zones, origin, destination, field):
+    """
+    Look up a skim matrix at each origin and destination, where zones are the
+    zones of the matrix rows and columns or None if the zones are the matrix
+    indices.
+    """
+    import numpy as np
+
+    if zones is not None:
+        order = np.argsort(zones, kind='stable')
+        sorted_zones = zones[order]
+
+    indices = []
+    for zone, size in zip((origin, destination), matrix.shape):
+        if zones is None:
+            index = zone.astype(np.intp)
+            unknown = (index != zone) | (index < 0) | (index >= size)
+        else:
+            position = np.minimum(np.searchsorted(sorted_zones, zone),
+                                  size - 1)
+            index = order[position]
+            unknown = zones[index] != zone
+        if unknown.any():
+            raise UnknownZone(zone[unknown][0], field)
+        indices.append(index)
+    return matrix[indices[0], indices[1]]
+
+
+def _load_yaml(stream):
+    """
+    Parse a YAML stream. yaml is imported here, rather than at module level, so
+    that importing the package does not require it.
+
+    Args:
+        stream (stream): Data stream of the YAML document.
+
+    Returns:
+        (dict): The parsed YAML document.
+    """
+    import yaml
+    # Use the libyaml based loader if it is available
+    loader = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+    return yaml.load(stream, Loader=loader)
 
 
 class MissingYamlKey(Exception):
@@ -307,13 +1409,70 @@ class MissingField(Exception):
     Exception for missing field in the data file
     """
     def __init__(self, field, stream):
+        if hasattr(stream, 'name'):
+            super().__init__(
+                'Field "{}" not present in data file "{}"'.format(
+                    field,
+                    stream.name)
+                )
+        else:
+            super().__init__('Field "{}" not present in data'.format(field))
+
+
+class UndefinedRandomParameter(Exception):
+    """
+    Exception for a random parameter which is not a parameter or intercept of
+    the model.
+    """
+    def __init__(self, parameter):
         super().__init__(
-            'Field "{}" not present in data file "{}"'.format(
-                field,
-                stream.name)
+            'Random parameter "{}" is not a parameter or intercept'.format(
+                parameter)
             )
 
 
+class InvalidNest(Exception):
+    """
+    Exception for an incorrectly defined nest.
+    """
+    def __init__(self, nest, problem):
+        super().__init__('Nest "{}" {}'.format(nest, problem))
+
+
+class InvalidLatentClasses(Exception):
+    """
+    Exception for incorrectly defined latent classes.
+    """
+    def __init__(self, problem):
+        super().__init__('Invalid latent classes, {}'.format(problem))
+
+
+class InvalidDerivedField(Exception):
+    """
+    Exception for an incorrectly defined derived field.
+    """
+    def __init__(self, field, problem):
+        super().__init__('Derived field "{}" {}'.format(field, problem))
+
+
+class UnknownZone(Exception):
+    """
+    Exception for a zone which is not in a skim matrix.
+    """
+    def __init__(self, zone, field):
+        super().__init__('Zone {} is not in the skim of field "{}"'.format(
+            zone, field))
+
+
+class InvalidSampling(Exception):
+    """
+    Exception for incorrectly defined sampling of alternatives.
+    """
+    def __init__(self, problem):
+        super().__init__('Invalid sampling of alternatives, {}'.format(
+            problem))
+
+
 class IncorrectNumberOfIntercepts(Exception):
     """
     Exception for when the number of declared intercepts is incompatible
@@ -0,0 +1,325 @@
+"""
+Maximisation of log likelihoods
+
+The optimisers take a function returning the log likelihood and its gradient,
+and optionally functions returning the Hessian or the outer product of the
+observation gradients. Newton and BHHH iterations are implemented here, and
+other methods are delegated to scipy.optimize.minimize.
+
+For large data, stochastic_maximise takes Adam steps on the gradients of
+shuffled mini-batches of observations before finishing with Newton iterations
+on all of the data.
+"""
+
+import numpy as np
+
+# Methods implemented here rather than by scipy
+_NEWTON_METHODS = ('newton', 'bhhh')
+
+# Aliases of scipy methods
+_SCIPY_ALIASES = {
+    'l-bfgs': 'L-BFGS-B'
+    }
+
+# Scipy methods which use the Hessian
+_HESSIAN_METHODS = ('newton-cg', 'dogleg', 'trust-ncg', 'trust-exact',
+                    'trust-krylov', 'trust-constr')
+
+# Largest number of backtracking steps in Newton line searches
+_MAXIMUM_BACKTRACKS = 30
+
+# Relative rounding error allowed in log likelihoods summed over observations
+_ROUNDING = 1.0e-13
+
+# Decay rates of the moment estimates and denominator offset of Adam
+_ADAM_BETA1 = 0.9
+_ADAM_BETA2 = 0.999
+_ADAM_EPSILON = 1.0e-8
+
+
+def maximise(log_likelihood_and_gradient, initial_parameters, method='BFGS',
+             hessian=None, score_outer_product=None, gradient_tolerance=None,
+             loss_tolerance=None, maximum_iterations=None):
+    """
+    Maximise a log likelihood.
+
+    Args:
+        log_likelihood_and_gradient (callable): Function of the parameter
+            vector returning the log likelihood and its gradient.
+        initial_parameters (numpy.ndarray): The starting parameter vector.
+        method (str, optional): 'newton' for Newton iterations with the
+            Hessian, 'bhhh' for Newton iterations with the outer product of
+            the observation gradients in place of the negative Hessian,
+            'l-bfgs' for limited memory BFGS, or any scipy.optimize.minimize
+            method such as 'BFGS', 'trust-exact' or 'trust-ncg'.
+        hessian (callable, optional): Function of the parameter vector
+            returning the Hessian of the log likelihood. Required by 'newton'
+            and the scipy methods which use the Hessian.
+        score_outer_product (callable, optional): Function of the parameter
+            vector returning the sum of the outer products of the observation
+            gradients. Required by 'bhhh'.
+        gradient_tolerance (float, optional): Iterations stop when the largest
+            element of the gradient is smaller than this. If not supplied,
+            the default of the method is used.
+        loss_tolerance (float, optional): Iterations stop when the log
+            likelihood changes by less than this multiple of its magnitude.
+            Used by 'newton', 'bhhh' and 'l-bfgs'. If not supplied, the
+            default of the method is used.
+        maximum_iterations (int, optional): The largest number of iterations.
+            If not supplied, the default of the method is used.
+
+    Returns:
+        (scipy.optimize.OptimizeResult): The result, with the parameters at
+            the maximum 'x', the log likelihood 'log_likelihood' and its
+            gradient 'jac', the number of iterations 'nit', whether the
+            iterations converged 'success', a description of the outcome
+            'message', and the Hessian at x 'hess', or None if it was not
+            evaluated there.
+
+    Raises:
+        ValueError: Raised if a function the method requires is not supplied.
+    """
+    key = method.lower()
+    if key == 'bhhh' and score_outer_product is None:
+        raise ValueError('The bhhh method requires the outer product of the'
+                         ' observation gradients')
+    if (key == 'newton' or key in _HESSIAN_METHODS) and hessian is None:
+        raise ValueError('The {} method requires the Hessian'.format(method))
+
+    if key in _NEWTON_METHODS:
+        if key == 'bhhh':
+            curvature = score_outer_product
+        else:
+            def curvature(parameters):
+                return -hessian(parameters)
+        return _newton(log_likelihood_and_gradient, initial_parameters,
+                       curvature, exact=(key == 'newton'),
+                       gradient_tolerance=_default(gradient_tolerance,
+                                                   1.0e-6),
+                       loss_tolerance=_default(loss_tolerance, 1.0e-12),
+                       maximum_iterations=_default(maximum_iterations, 100))
+    return _scipy(log_likelihood_and_gradient, initial_parameters,
+                  _SCIPY_ALIASES.get(key, method), hessian,
+                  gradient_tolerance, loss_tolerance, maximum_iterations)
+
+
+def _default(value, default):
+    """
+    Replace a value which was not supplied by a default.
+    """
+    return default if value is None else value
+
+
+def _newton(log_likelihood_and_gradient, parameters, curvature, exact,
+            gradient_tolerance, loss_tolerance, maximum_iterations):
+    """
+    Maximise a log likelihood by Newton iterations with a backtracking line
+    search.
+
+    curvature returns a positive definite approximation of the negative
+    Hessian, or the negative Hessian itself if exact is True, in which case
+    it is returned for the final parameters. Where the negative Hessian is
+    not positive definite it is shifted by a multiple of the identity.
+    """
+    from scipy.optimize import OptimizeResult
+
+    parameters = np.array(parameters, dtype=np.float64)
+    log_likelihood, gradient = log_likelihood_and_gradient(parameters)
+    message = 'Maximum number of iterations reached'
+    converged = False
+    small_change = False
+    matrix = None
+    for iteration in range(maximum_iterations + 1):
+        matrix = curvature(parameters)
+        if np.max(np.abs(gradient)) <= gradient_tolerance:
+            message = 'Gradient below tolerance'
+            converged = True
+            break
+        if small_change:
+            message = 'Change in log likelihood below tolerance'
+            converged = True
+            break
+        if iteration == maximum_iterations:
+            break
+
+        step = _solve_positive_definite(matrix, gradient)
+
+        # Halve the step until the log likelihood increases sufficiently.
+        # Close to the maximum the change is within the rounding error of
+        # the sum, which is allowed for so that the full step is taken.
+        slope = np.dot(gradient, step)
+        rounding = _ROUNDING * abs(log_likelihood)
+        length = 1.
+        for _ in range(_MAXIMUM_BACKTRACKS):
+            trial = parameters + length * step
+            trial_log_likelihood, trial_gradient = (
+                log_likelihood_and_gradient(trial))
+            if trial_log_likelihood >= (log_likelihood
+                                        + 1.0e-4 * length * slope
+                                        - rounding):
+                break
+            length /= 2
+        else:
+            message = 'Line search failed to increase the log likelihood'
+            break
+
+        small_change = (trial_log_likelihood - log_likelihood
+                        <= loss_tolerance * abs(trial_log_likelihood))
+        parameters = trial
+        log_likelihood, gradient = trial_log_likelihood, trial_gradient
+
+    return OptimizeResult(
+        x=parameters, log_likelihood=log_likelihood, jac=gradient,
+        nit=iteration, success=converged, message=message,
+        hess=-matrix if exact and converged else None)
+
+
+def _solve_positive_definite(matrix, vector):
+    """
+    Solve matrix x = vector for a symmetric matrix by Cholesky decomposition,
+    adding multiples of the identity to the matrix until it is positive
+    definite.
+    """
+    import scipy.linalg
+
+    shift = 0.
+    scale = max(1., np.max(np.abs(np.diag(matrix))))
+    while True:
+        try:
+            factor = scipy.linalg.cho_factor(
+                matrix + shift * np.eye(len(matrix)))
+            return scipy.linalg.cho_solve(factor, vector)
+        except np.linalg.LinAlgError:
+            shift = max(2 * shift, 1.0e-8 * scale)
+
+
+def _scipy(log_likelihood_and_gradient, parameters, method, hessian,
+           gradient_tolerance, loss_tolerance, maximum_iterations):
+    """
+    Maximise a log likelihood with scipy.optimize.minimize.
+    """
+    import scipy.optimize
+
+    def objective(parameters):
+        log_likelihood, gradient = log_likelihood_and_gradient(parameters)
+        return -log_likelihood, -gradient
+
+    # Keep the last Hessian so that it can be returned if it was evaluated at
+    # the optimum
+    last = {}
+
+    def negative_hessian(parameters):
+        last['x'] = np.array(parameters)
+        last['hess'] = hessian(parameters)
+        return -last['hess']
+
+    options = {}
+    if gradient_tolerance is not None:
+        options['gtol'] = gradient_tolerance
+    if loss_tolerance is not None:
+        options['ftol'] = loss_tolerance
+    if maximum_iterations is not None:
+        options['maxiter'] = maximum_iterations
+
+    uses_hessian = method.lower() in _HESSIAN_METHODS
+    result = scipy.optimize.minimize(
+        objective, np.asarray(parameters, dtype=np.float64), jac=True,
+        hess=negative_hessian if uses_hessian else None, method=method,
+        options=options)
+
+    result.log_likelihood = -result.fun
+    result.jac = -result.jac
+    if 'x' in last and np.array_equal(last['x'], result.x):
+        result.hess = last['hess']
+    else:
+        result.hess = None
+    return result
+
+
+def stochastic_maximise(engine, initial_parameters, batch_size=5000,
+                        epochs=2, learning_rate=0.1, seed=0,
+                        gradient_tolerance=None, loss_tolerance=None,
+                        maximum_iterations=None):
+    """
+    Maximise a log likelihood by Adam steps on mini-batches of observations
+    followed by Newton iterations on all observations.
+
+    In each epoch the observations are shuffled and divided into batches, and
+    an engine is created for each batch, so only one batch's utilities and
+    probabilities are held at a time. Adam scales the step of each parameter
+    by the running magnitude of its gradient, which suits parameters of
+    different scales. The stochastic phase moves the parameters close to the
+    maximum cheaply, and the Newton iterations then converge exactly and
+    leave the Hessian at the optimum for the standard errors.
+
+    Args:
+        engine (NumpyEngine or RaggedEngine): The log likelihood engine of
+            all observations, which must produce engines of subsets of its
+            observations.
+        initial_parameters (numpy.ndarray): The starting parameter vector.
+        batch_size (int, optional): The number of observations in each
+            mini-batch.
+        epochs (int, optional): The number of passes through the
+            observations before the Newton iterations.
+        learning_rate (float, optional): The initial largest change in any
+            parameter in one Adam step, which decays linearly to zero over
+            the stochastic phase.
+        seed (int, optional): The seed of the shuffling of observations.
+        gradient_tolerance (float, optional): As for maximise, for the Newton
+            iterations.
+        loss_tolerance (float, optional): As for maximise, for the Newton
+            iterations.
+        maximum_iterations (int, optional): As for maximise, the largest
+            number of Newton iterations.
+
+    Returns:
+        (scipy.optimize.OptimizeResult): The result, as for maximise with
+            the 'newton' method, and the number of Adam steps
+            'stochastic_iterations'.
+
+    Raises:
+        ValueError: Raised if the engine cannot produce engines of subsets of
+            its observations.
+    """
+    if getattr(engine, 'subset', None) is None:
+        raise ValueError('Stochastic estimation requires an engine which'
+                         ' evaluates subsets of observations')
+
+    rng = np.random.default_rng(seed)
+    parameters = np.array(initial_parameters, dtype=np.float64)
+    number_of_observations = engine.design.number_of_observations
+    number_of_batches = max(1, -(-number_of_observations // batch_size))
+
+    first_moment = np.zeros_like(parameters)
+    second_moment = np.zeros_like(parameters)
+    number_of_steps = epochs * number_of_batches
+    step = 0
+    for _ in range(epochs):
+        order = rng.permutation(number_of_observations)
+        for rows in np.array_split(order, number_of_batches):
+            # Rows are sorted so that subsets are gathered in storage order
+            rows.sort()
+            _, gradient = engine.subset(rows).log_likelihood_and_gradient(
+                parameters)
+            gradient /= len(rows)
+
+            # The learning rate decays linearly so that the steps settle
+            # rather than wander in the noise of the batch gradients
+            rate = learning_rate * (1 - step / number_of_steps)
+            step += 1
+            first_moment = (_ADAM_BETA1 * first_moment
+                            + (1 - _ADAM_BETA1) * gradient)
+            second_moment = (_ADAM_BETA2 * second_moment
+                             + (1 - _ADAM_BETA2) * gradient**2)
+            parameters += (
+                rate * first_moment / (1 - _ADAM_BETA1**step)
+                / (np.sqrt(second_moment / (1 - _ADAM_BETA2**step))
+                   + _ADAM_EPSILON))
+
+    result = maximise(engine.log_likelihood_and_gradient, parameters,
+                      'newton', hessian=engine.hessian,
+                      gradient_tolerance=gradient_tolerance,
+                      loss_tolerance=loss_tolerance,
+                      maximum_iterations=maximum_iterations)
+    result.stochastic_iterations = step
+    return result
@@ -0,0 +1,318 @@
+"""
+Declarative preparation of choice data
+
+A Preprocessor turns raw survey records into the wide format data a choice
+model is loaded with. Derived columns, recodings of categorical codes and
+filters of invalid records are declared, for example in YAML, rather than
+written as row by row functions. Every step is evaluated as whole column
+NumPy operations, filters are combined into a single mask, and the output
+dataframe is assembled once.
+
+Expressions are Python expressions of column names, numbers, strings,
+operators (use & | ~ for and, or and not) and the functions in FUNCTIONS, for
+example
+
+    where(licences > 0, minimum(cars / licences, 1), 0.)
+"""
+
+import ast
+from collections import ChainMap
+import numpy as np
+
+# Functions which may be used in expressions
+FUNCTIONS = {
+    'where': np.where,
+    'minimum': np.minimum,
+    'maximum': np.maximum,
+    'clip': np.clip,
+    'isin': np.isin,
+    'abs': np.abs,
+    'exp': np.exp,
+    'log': np.log,
+    'sqrt': np.sqrt
+    }
+
+
+class Preprocessor(object):
+    """
+    Declarative, vectorised preparation of choice data
+
+    The steps are applied in a fixed order. Missing values of the raw columns
+    are filled and the raw columns converted, categorical codes are
+    recoded, derived columns are evaluated in the order given, records
+    failing any filter or whose chosen alternative is unavailable are
+    removed, and finally columns are dropped. For example
+
+        fill_missing: 0
+        dtype: int
+        recode:
+          mode:
+            values:
+              car: [5]
+              walk: [1]
+            default: other
+        derived:
+          avail_walk: dist <= 6000
+          walk_time: dist * 0.72
+        filters:
+          - mode != 'other'
+        choice_availability:
+          choice_column: mode
+          availability:
+            car: avail_car
+            walk: avail_walk
+        drop:
+          - dist
+
+    Args:
+        derived (dict, optional): The expression, or a number for a
+            constant column, of each derived column, in order of evaluation.
+            Boolean results are stored as 0 and 1.
+        filters (list[str], optional): Boolean expressions which records
+            must satisfy.
+        recode (dict, optional): For each recoded column, a dictionary with
+            the keys 'values', a dictionary of the list of codes of each new
+            value, and optionally 'default', the value of codes not listed.
+            Without a default, codes not listed are kept.
+        choice_availability (dict, optional): A dictionary with the keys
+            'choice_column' and 'availability', the column of the
+            availability of each alternative as in ChoiceModel. Records whose
+            chosen alternative is unavailable are removed.
+        drop (list[str], optional): Raw or derived columns to omit from the
+            output.
+        fill_missing (float, optional): The value replacing missing values in
+            the raw columns.
+        dtype (str or numpy.dtype, optional): The type the raw columns are
+            converted to, after filling missing values.
+
+    Attributes:
+        dropped (dict): After apply, the number of records failing each
+            filter, and the number choosing each unavailable alternative,
+            counted independently of the other filters.
+    """
+
+    def __init__(self, derived=None, filters=None, recode=None,
+                 choice_availability=None, drop=None, fill_missing=None,
+                 dtype=None):
+        self.derived = derived or {}
+        self.filters = filters or []
+        self.recode = recode or {}
+        self.choice_availability = choice_availability
+        self.drop = drop or []
+        self.fill_missing = fill_missing
+        self.dtype = dtype
+        self.dropped = {}
+
+    @classmethod
+    def from_yaml(cls, stream):
+        """
+        Read the preprocessing definition from a YAML file.
+
+        Args:
+            stream (stream): Data stream of the definition.
+
+        Returns:
+            (Preprocessor): The preprocessor.
+        """
+        from .model import _load_yaml
+        return cls.from_dict(_load_yaml(stream))
+
+    @classmethod
+    def from_dict(cls, definition):
+        """
+        Create a preprocessor from a dictionary, as produced by to_dict.
+
+        Args:
+            definition (dict): The preprocessing definition, with keys of the
+                constructor's argument names.
+
+        Returns:
+            (Preprocessor): The preprocessor.
+        """
+        return cls(**definition)
+
+    def to_dict(self):
+        """
+        Produce a dictionary of the preprocessing definition.
+
+        Returns:
+            (dict): The definition.
+        """
+        return {
+            'derived': self.derived,
+            'filters': self.filters,
+            'recode': self.recode,
+            'choice_availability': self.choice_availability,
+            'drop': self.drop,
+            'fill_missing': self.fill_missing,
+            'dtype': self.dtype
+            }
+
+    def apply(self, data):
+        """
+        Prepare data.
+
+        Args:
+            data (DataFrame): The raw records.
+
+        Returns:
+            (DataFrame): The prepared records, keeping the index of data.
+
+        Raises:
+            UndefinedColumn: Raised if an expression refers to an unknown
+                column.
+            InvalidExpression: Raised if an expression uses attributes or
+                private names.
+        """
+        import pandas as pd
+
+        raw = data
+        if self.fill_missing is not None:
+            raw = raw.fillna(self.fill_missing)
+        if self.dtype is not None:
+            raw = raw.astype(self.dtype)
+        columns = {label: raw[label].to_numpy() for label in raw.columns}
+        number_of_records = len(raw)
+
+        for label, recoding in self.recode.items():
+            columns[label] = _recode(columns[label], recoding)
+
+        for label, expression in self.derived.items():
+            if isinstance(expression, str):
+                expression = evaluate(expression, columns)
+            columns[label] = _as_column(expression, number_of_records)
+
+        # Combine the filters into a single mask
+        keep = np.ones(number_of_records, dtype=bool)
+        self.dropped = {}
+        for expression in self.filters:
+            passed = _as_column(evaluate(expression, columns),
+                                number_of_records).astype(bool)
+            self.dropped[expression] = int(np.count_nonzero(~passed))
+            keep &= passed
+        if self.choice_availability is not None:
+            choices = columns[self.choice_availability['choice_column']]
+            for alternative, availability in (
+                    self.choice_availability['availability'].items()):
+                unavailable = (choices == alternative) & (
+                    columns[availability] == 0)
+                self.dropped['{} not available'.format(alternative)] = int(
+                    np.count_nonzero(unavailable))
+                keep &= ~unavailable
+
+        dropped = frozenset(self.drop)
+        labels = [label for label in columns if label not in dropped]
+        return pd.DataFrame({label: columns[label][keep] for label in labels},
+                            index=raw.index[keep])
+
+
+def expression_columns(expression):
+    """
+    Find the columns an expression refers to.
+
+    Args:
+        expression (str): The expression.
+
+    Returns:
+        (list[str]): The names in the expression which are not functions, in
+            order of first appearance.
+
+    Raises:
+        InvalidExpression: Raised if the expression uses attributes or
+            private names, or is not a valid expression.
+    """
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as error:
+        raise InvalidExpression(expression, 'is not valid') from error
+
+    found = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute):
+            raise InvalidExpression(expression, 'uses attributes')
+        if isinstance(node, ast.Name):
+            if node.id.startswith('_'):
+                raise InvalidExpression(expression, 'uses private names')
+            if node.id not in FUNCTIONS:
+                found.append((node.col_offset, node.id))
+
+    # ast.walk is breadth first, so restore the order of the source
+    names = []
+    for _, name in sorted(found):
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def evaluate(expression, columns):
+    """
+    Evaluate an expression of columns as whole column operations.
+
+    Division by zero and invalid operations produce infinities and NaN
+    without warnings, so that, for example, where(a > 0, b / a, 0) is
+    evaluated for every record.
+
+    Args:
+        expression (str): The expression.
+        columns (dict): The array of each column name.
+
+    Returns:
+        (numpy.ndarray or scalar): The value of the expression.
+
+    Raises:
+        UndefinedColumn: Raised if the expression refers to a name which is
+            not a column or function.
+        InvalidExpression: Raised if the expression uses attributes or
+            private names.
+    """
+    for name in expression_columns(expression):
+        if name not in columns:
+            raise UndefinedColumn(name, expression)
+    code = compile(expression, '<expression>', 'eval')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return eval(code, {'__builtins__': {}}, ChainMap(columns, FUNCTIONS))
+
+
+def _recode(codes, recoding):
+    """
+    Replace lists of codes by new values.
+    """
+    values = recoding['values']
+    if 'default' in recoding:
+        recoded = np.full(len(codes), recoding['default'], dtype=object)
+    else:
+        recoded = codes.astype(object)
+    for value, value_codes in values.items():
+        recoded[np.isin(codes, value_codes)] = value
+    return recoded
+
+
+def _as_column(value, number_of_records):
+    """
+    Convert the value of an expression to a column, storing booleans as 0 and
+    1 and broadcasting constants.
+    """
+    value = np.asarray(value)
+    if value.dtype == bool:
+        value = value.astype(np.int64)
+    if value.ndim == 0:
+        value = np.full(number_of_records, value)
+    return value
+
+
+class UndefinedColumn(Exception):
+    """
+    Exception for an expression referring to an unknown column.
+    """
+    def __init__(self, name, expression):
+        super().__init__(
+            'Column "{}" in expression "{}" is not defined'.format(
+                name, expression))
+
+
+class InvalidExpression(Exception):
+    """
+    Exception for an expression which may not be evaluated.
+    """
+    def __init__(self, expression, problem):
+        super().__init__('Expression "{}" {}'.format(expression, problem))
@@ -0,0 +1,393 @@
+"""
+Scoring of new data from persisted estimated models
+
+A Scorer holds only what is needed to evaluate an estimated multinomial logit
+model: the compiled utility kernel, the parameter vector and covariance, the
+availability fields and the definitions of the derived fields the utilities
+use. It is saved as a single compressed NumPy archive, and loaded again
+without the model's YAML file, its estimation data or the back end which
+estimated it. Loading and scoring import only NumPy, so that short lived
+scoring processes start quickly.
+
+    scorer = Scorer.from_interface(interface)
+    scorer.save('grenoble.npz')
+
+    scorer = Scorer.load('grenoble.npz')
+    probabilities = scorer.probabilities(data)
+
+Data to score may be a DataFrame or any mapping of field names to arrays.
+"""
+
+import json
+from .kernel import UtilityKernel
+from .model import (LatentClassLogit, MissingField, MixedLogit, NestedLogit,
+                    _skim_lookup)
+import numpy as np
+
+# Version of the layout of saved scorers
+_FORMAT = 1
+
+
+class Scorer(object):
+    """
+    Lightweight evaluation of an estimated multinomial logit model
+
+    Args:
+        kernel (UtilityKernel): The compiled utilities of the model.
+        parameters (numpy.ndarray): The estimated parameters, in the order of
+            the kernel's parameter_names.
+        availability (list[str]): The availability field of each alternative,
+            in the order of the kernel's alternatives.
+        derived (dict, optional): The definition of each derived field used
+            by the utilities or availability, in order of evaluation, as for
+            ChoiceModel.
+        covariance (numpy.ndarray, optional): The covariance matrix of the
+            parameters.
+        standard_errors (numpy.ndarray, optional): The standard errors of the
+            parameters, if the covariance is not known.
+        title (str, optional): The title of the model.
+        interface (str, optional): The name of the back end which estimated
+            the model.
+
+    Attributes:
+        raw_fields (list[str]): The fields the data to score must contain.
+    """
+
+    def __init__(self, kernel, parameters, availability, derived=None,
+                 covariance=None, standard_errors=None, title=None,
+                 interface=None):
+        self.kernel = kernel
+        self._parameters = np.asarray(parameters, dtype=np.float64)
+        self.availability = list(availability)
+        self.derived = dict(derived or {})
+        self._covariance = covariance
+        if covariance is not None:
+            standard_errors = np.sqrt(np.diag(covariance))
+        self._standard_errors = standard_errors
+        self.title = title
+        self.interface = interface
+        self._skims = {}
+
+        # The fields of the data, in order of first use, which derived fields
+        # are evaluated from or which are used directly
+        raw = {}
+        for definition in self.derived.values():
+            for name in _dependencies(definition):
+                if name not in self.derived:
+                    raw[name] = None
+        for field in self.availability + self.kernel.fields:
+            if field not in self.derived:
+                raw[field] = None
+        self.raw_fields = list(raw)
+
+    @classmethod
+    def from_interface(cls, interface):
+        """
+        Create a scorer from an estimated interface.
+
+        Args:
+            interface (Interface): An estimated interface of a multinomial
+                logit model.
+
+        Returns:
+            (Scorer): The scorer.
+
+        Raises:
+            TypeError: Raised if the model is not a multinomial logit model.
+        """
+        model = interface.model
+        if isinstance(model, (MixedLogit, NestedLogit, LatentClassLogit)):
+            raise TypeError(
+                'Scoring is only available for multinomial logit models,'
+                ' not {}'.format(type(model).__name__))
+
+        kernel = UtilityKernel(model)
+        parameters = kernel.parameter_vector(interface.parameters())
+        covariance = None
+        standard_errors = None
+        if hasattr(interface, 'covariance'):
+            order = [interface.parameter_names.index(name)
+                     for name in kernel.parameter_names]
+            covariance = np.asarray(interface.covariance())[
+                np.ix_(order, order)]
+        else:
+            standard_errors = kernel.parameter_vector(
+                interface.standard_errors())
+
+        # Keep the derived fields which may be evaluated from the fields
+        # needed for scoring, omitting for example a derived choice column
+        availability = model.availability_fields()
+        raw = set(model.raw_fields(availability + kernel.fields))
+        derived = {}
+        for label in model.derived_fields():
+            if set(model.raw_fields([label])) <= raw:
+                derived[label] = _serialisable(model.derived[label])
+
+        return cls(kernel, parameters, availability, derived=derived,
+                   covariance=covariance, standard_errors=standard_errors,
+                   title=model.title, interface=interface.name)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a scorer saved by save.
+
+        Args:
+            path (str or file): The file of the scorer.
+
+        Returns:
+            (Scorer): The scorer.
+
+        Raises:
+            InvalidArtifact: Raised if the file is not a saved scorer, or was
+                saved in an unsupported format.
+        """
+        with np.load(path, allow_pickle=False) as artifact:
+            if 'metadata' not in artifact.files:
+                raise InvalidArtifact(path, 'has no metadata')
+            metadata = json.loads(str(artifact['metadata']))
+            if metadata.get('format') != _FORMAT:
+                raise InvalidArtifact(
+                    path, 'has format {}, expected {}'.format(
+                        metadata.get('format'), _FORMAT))
+            arrays = {name: artifact[name] for name in artifact.files
+                      if name != 'metadata'}
+
+        kernel = UtilityKernel.from_dict(dict(metadata['kernel'], **arrays))
+        return cls(kernel, arrays['parameters'], metadata['availability'],
+                   derived=metadata['derived'],
+                   covariance=arrays.get('covariance'),
+                   standard_errors=arrays.get('standard_errors'),
+                   title=metadata['title'], interface=metadata['interface'])
+
+    def save(self, path):
+        """
+        Save the scorer as a compressed NumPy archive.
+
+        Args:
+            path (str or file): The file to write. As for numpy.savez, the
+                extension .npz is appended to a path without it.
+        """
+        kernel_dict = self.kernel.to_dict()
+        arrays = {name: kernel_dict.pop(name)
+                  for name in UtilityKernel._ARRAYS}
+        arrays['parameters'] = self._parameters
+        if self._covariance is not None:
+            arrays['covariance'] = self._covariance
+        elif self._standard_errors is not None:
+            arrays['standard_errors'] = self._standard_errors
+
+        metadata = {
+            'format': _FORMAT,
+            'title': self.title,
+            'interface': self.interface,
+            'kernel': kernel_dict,
+            'availability': self.availability,
+            'derived': self.derived
+            }
+        np.savez_compressed(path, metadata=np.array(json.dumps(metadata)),
+                            **arrays)
+
+    @property
+    def alternatives(self):
+        return self.kernel.alternatives
+
+    def parameters(self):
+        """
+        Produce the estimated parameters.
+
+        Returns:
+            (dict): The value of each parameter name.
+        """
+        return dict(zip(self.kernel.parameter_names, self._parameters))
+
+    def standard_errors(self):
+        """
+        Produce the standard errors of the estimated parameters.
+
+        Returns:
+            (dict): The standard error of each parameter name, or None if
+                they were not saved.
+        """
+        if self._standard_errors is None:
+            return None
+        return dict(zip(self.kernel.parameter_names, self._standard_errors))
+
+    def t_values(self):
+        """
+        Produce the t values of the estimated parameters.
+
+        Returns:
+            (dict): The t value of each parameter name, or None if the
+                standard errors were not saved.
+        """
+        if self._standard_errors is None:
+            return None
+        return dict(zip(self.kernel.parameter_names,
+                        self._parameters / self._standard_errors))
+
+    def covariance(self):
+        """
+        Produce the covariance matrix of the estimated parameters.
+
+        Returns:
+            (numpy.ndarray): The covariance matrix, with rows and columns in
+                the order of the kernel's parameter_names, or None if the
+                back end did not provide it.
+        """
+        return self._covariance
+
+    def utilities(self, data):
+        """
+        Evaluate the utility of every alternative for every observation.
+
+        Args:
+            data (DataFrame or dict): The data to score, with the fields in
+                raw_fields. A choice column is not needed.
+
+        Returns:
+            (numpy.ndarray): The utilities, of shape (number of observations,
+                number of alternatives) with columns in the order of
+                alternatives. Unavailable alternatives have utility -inf.
+
+        Raises:
+            MissingField: Raised if a field is not in data.
+        """
+        columns = self._columns(data)
+        matrix = np.empty((len(columns[self.availability[0]]),
+                           self.kernel.number_of_fields))
+        for index, field in enumerate(self.kernel.fields):
+            matrix[:, index] = columns[field]
+
+        available = np.stack([columns[field] != 0
+                              for field in self.availability], axis=1)
+        utilities = self.kernel.utilities(
+            self.kernel.mask_unavailable(matrix, available), self._parameters)
+        utilities[~available] = -np.inf
+        return utilities
+
+    def probabilities(self, data):
+        """
+        Predict choice probabilities.
+
+        Args:
+            data (DataFrame or dict): The data to score, as for utilities.
+
+        Returns:
+            (numpy.ndarray): The probability of each alternative (columns)
+                for each observation (rows). Probabilities of observations
+                with no available alternatives are NaN.
+        """
+        utilities = self.utilities(data)
+        with np.errstate(invalid='ignore'):
+            utilities -= _logsums(utilities)[:, np.newaxis]
+        return np.exp(utilities, out=utilities)
+
+    def logsums(self, data):
+        """
+        Calculate the logsum, the expected maximum utility, of each
+        observation.
+
+        Args:
+            data (DataFrame or dict): The data to score, as for utilities.
+
+        Returns:
+            (numpy.ndarray): The logsum of each observation, -inf if no
+                alternative is available.
+        """
+        return _logsums(self.utilities(data))
+
+    def _columns(self, data):
+        """
+        Extract the raw fields from data as arrays and evaluate the derived
+        fields.
+        """
+        from .preprocess import evaluate, _as_column
+
+        columns = {}
+        for field in self.raw_fields:
+            try:
+                columns[field] = np.asarray(data[field])
+            except KeyError:
+                raise MissingField(field, data) from None
+        number_of_observations = (len(columns[self.raw_fields[0]])
+                                  if self.raw_fields else len(data))
+
+        for label, definition in self.derived.items():
+            if isinstance(definition, str):
+                definition = evaluate(definition, columns)
+            elif isinstance(definition, dict):
+                definition = self._skim_values(
+                    label, columns[definition['origin']],
+                    columns[definition['destination']])
+            columns[label] = _as_column(definition, number_of_observations)
+        return columns
+
+    def _skim_values(self, field, origin, destination):
+        """
+        Look up the memory mapped skim matrix of a field at each origin and
+        destination.
+        """
+        definition = self.derived[field]
+        path = definition['skim']
+        if path not in self._skims:
+            self._skims[path] = np.load(path, mmap_mode='r')
+        zones = definition.get('zones')
+        if isinstance(zones, str):
+            if zones not in self._skims:
+                self._skims[zones] = np.load(zones)
+            zones = self._skims[zones]
+        elif zones is not None:
+            zones = np.asarray(zones)
+        return _skim_lookup(self._skims[path], zones, origin, destination,
+                            field)
+
+
+def _dependencies(definition):
+    """
+    Produce the fields a derived field definition is evaluated from.
+    """
+    from .preprocess import expression_columns
+
+    if isinstance(definition, str):
+        return expression_columns(definition)
+    if isinstance(definition, dict):
+        return [definition['origin'], definition['destination']]
+    return []
+
+
+def _serialisable(definition):
+    """
+    Convert a derived field definition to values which may be written as
+    JSON.
+    """
+    if isinstance(definition, dict):
+        definition = dict(definition)
+        if definition.get('zones') is not None and not isinstance(
+                definition['zones'], str):
+            definition['zones'] = np.asarray(definition['zones']).tolist()
+        return definition
+    if isinstance(definition, np.generic):
+        return definition.item()
+    return definition
+
+
+def _logsums(utilities):
+    """
+    Calculate the logsum of each row of utilities, -inf for rows where every
+    utility is -inf.
+    """
+    shift = utilities.max(axis=1)
+    shift[~np.isfinite(shift)] = 0.
+    with np.errstate(divide='ignore'):
+        return shift + np.log(
+            np.exp(utilities - shift[:, np.newaxis]).sum(axis=1))
+
+
+class InvalidArtifact(Exception):
+    """
+    Exception for a file which is not a saved scorer.
+    """
+    def __init__(self, path, problem):
+        super().__init__('Scorer file "{}" {}'.format(
+            getattr(path, 'name', path), problem))
@@ -2,12 +2,10 @@
 Routines for creating synthetic models and corresponding data
 """
 
+from .kernel import UtilityKernel
 from .model import MultinomialLogit
-import itertools
 import numpy as np
 import numpy.random as random
-import pandas as pd
-import scipy.stats as stats
 
 
 def synthetic_model(title, number_of_alternatives, number_of_variables):
@@ -48,21 +46,13 @@ def synthetic_model(title, number_of_alternatives, number_of_variables):
     parameters = ['parameter{}'.format(number)
                   for number in range(1, number_of_variables+1)]
 
-    # Create linear combination terms i.e. parameter1*variable1 +
-    # parameter2*variable2 + ...
-    all_variables = variables.keys()
-    products = ['*'.join(pair) for pair in zip(parameters, all_variables)]
-    linear_combination = ' + '.join(products)
-    # Construct utility function strings. The last alternative does not have an
-    # intercept
-    specification = {}
-    for alternative in alternatives[:-1]:
-        specification[alternative] = (
-            ' + '.join([intercepts[alternative], linear_combination])
-            )
-    specification[alternatives[-1]] = linear_combination
-
-    model = MultinomialLogit(
+    # Each alternative's utility is a linear combination of all variables,
+    # i.e. parameter1*variable1 + parameter2*variable2 + ... Parameter i
+    # multiplies variable i in all alternatives.
+    parameter_index = np.tile(np.arange(number_of_variables),
+                              (number_of_alternatives, 1))
+
+    model = MultinomialLogit.from_parameter_matrix(
         title=title,
         alternatives=alternatives,
         choice_column='choice',
@@ -71,7 +61,7 @@ def synthetic_model(title, number_of_alternatives, number_of_variables):
         alternative_dependent_variables=variables,
         intercepts=intercepts,
         parameters=parameters,
-        specification=specification
+        parameter_index=parameter_index
         )
     return model
 
@@ -92,7 +82,7 @@ def synthetic_data(model, n_observations):
     plus an unkown factor taken from the Gumbel distribution.
 
     Args:
-        model (ChoiceModel): The choice model object to create synthetic
+        model (MultinomialLogit): The choice model object to create synthetic
             observations for.
         n_observations (int): The number of synthetic observations to create.
 
@@ -100,6 +90,9 @@ def synthetic_data(model, n_observations):
         (DataFrame): A pandas dataframe of synthetic data that can be
             loaded into model.
     """
+    import pandas as pd
+    import scipy.stats as stats
+
     n_alternatives = model.number_of_alternatives()
     n_parameters = model.number_of_parameters(include_intercepts=False)
     n_variables = model.number_of_variables()
@@ -118,19 +111,26 @@ def synthetic_data(model, n_observations):
     variables = stats.multivariate_normal.rvs(mean, covariance,
                                               [n_observations, n_alternatives])
 
+    # Create dataframe of the variables. The value of variable i for
+    # alternative j is variables[:, j, i]
+    data = pd.DataFrame({
+        model.alternative_dependent_variables[variable][alternative]: (
+            variables[:, j, i])
+        for i, variable in enumerate(model.alternative_dependent_variables)
+        for j, alternative in enumerate(model.alternatives)
+        })
+
     # Set parameters for each alternative
-    parameters = np.full(fill_value=-1.5, shape=n_parameters)
-    parameters = parameters / n_parameters
-    utility = np.zeros([n_observations, n_alternatives])
+    parameters = {intercept: 0. for intercept in model.intercepts.values()}
+    parameters.update({parameter: -1.5 / n_parameters
+                       for parameter in model.parameters})
 
     # Calculate the 'ideal' utility values for each obsertvation and
     # alternative, a linear combination of the relevant parameters and
-    # variables
-    for observation, alternative in itertools.product(range(n_observations),
-                                                      range(n_alternatives)):
-        utility[observation, alternative] = (
-                np.dot(parameters, variables[observation, alternative, :])
-                )
+    # variables, using the model's utility kernel
+    kernel = UtilityKernel(model)
+    utility = kernel.utilities(kernel.data_matrix(data),
+                               kernel.parameter_vector(parameters))
 
     # Add unknown factor, drawn from the Gumbel distribution, to each utility
     utility += random.gumbel(size=[n_observations, n_alternatives])
@@ -139,25 +139,12 @@ def synthetic_data(model, n_observations):
     # utility
     choices = utility.argmax(axis=1)
 
-    # Create dataframe with the necessary column labels
-    data = pd.DataFrame(
-        columns=(model.all_variable_fields() +
-                 model.availability_fields() +
-                 [model.choice_column])
-        )
-
-    # Enter choices
-    data[model.choice_column] = [model.alternatives[choice]
-                                 for choice in choices]
-    # Set all availabilities to true
-    for availability in model.availability_fields():
-        data[availability] = np.full(shape=n_observations, fill_value=1)
-    # Set value of each (alternative dependent) variable for all observations
-    for i, variable in enumerate(model.alternative_dependent_variables):
-        for j, alternative in enumerate(model.alternatives):
-            data[
-                model.alternative_dependent_variables[variable][alternative]
-                ] = variables[:, j, i]
+    # Set all availabilities to true and enter choices, adding the columns
+    # together to avoid fragmenting the dataframe
+    columns = {availability: np.ones(n_observations, dtype=np.int8)
+               for availability in model.availability_fields()}
+    columns[model.choice_column] = np.array(model.alternatives)[choices]
+    data = pd.concat([data, pd.DataFrame(columns)], axis=1)
 
     return data
 
@@ -179,6 +166,8 @@ def synthetic_data_uniform(model, number_of_records):
         (DataFrame): A pandas dataframe of synthetic data that can be
             loaded into model.
     """
+    import pandas as pd
+
     # Create dataframe with the necessary column labels
     data = pd.DataFrame(
         columns=(model.all_variable_fields() +
@@ -194,7 +183,7 @@ def synthetic_data_uniform(model, number_of_records):
 
     # Set all availability columns to 1 (available)
     for column in model.availability_fields():
-        data[column] = np.full(shape=number_of_records, fill_value=1)
+        data[column] = np.ones(number_of_records, dtype=np.int8)
 
     # Fill all variable columns with uniform random numbers in the range
     # [0,1)
@@ -19,15 +19,20 @@ class Utility(object):
             is an intercept it must be the first term. Parameters
             and variables may occur in any order, but their names must appear
             in the arguments parameters and variables respectively.
-        variables (list[str]): A list of variables names that may appear in
-            the utility string.
+        variables (list[str] or set[str]): A list of variables names that may
+            appear in the utility string.
         intercept (str or None): The intercept variable that will appear
             in the utility string or None if there isn't one.
-        parameters (list[str]): A list of the parameter names that may
-            appear in the utility string.
+        parameters (list[str] or set[str]): A list of the parameter names
+            that may appear in the utility string.
     """
 
     def __init__(self, utility_string, variables, intercept, parameters):
+        # Use sets for constant time membership tests when parsing terms
+        if not isinstance(variables, (set, frozenset)):
+            variables = frozenset(variables)
+        if not isinstance(parameters, (set, frozenset)):
+            parameters = frozenset(parameters)
 
         # Split utility string into terms seperated by '+'
         terms = utility_string.split('+')
@@ -56,6 +61,34 @@ class Utility(object):
         # Ensure all variables and parameters appear at most once
         self._check_duplicates()
 
+        self._index_terms()
+
+    @classmethod
+    def from_terms(cls, terms, intercept=None):
+        """
+        Create a utility directly from its terms, without parsing a utility
+        string. The terms are not validated, so should come from a utility
+        that has already been checked, for example a compiled model.
+
+        Args:
+            terms (list): A list of (variable, parameter) pairs.
+            intercept (str or None): The intercept of the utility or None if
+                there isn't one.
+
+        Returns:
+            (Utility): The utility object.
+        """
+        utility = cls.__new__(cls)
+        utility.intercept = intercept
+        utility.terms = [VariableAndParameter(*term) for term in terms]
+        utility._index_terms()
+        return utility
+
+    def _index_terms(self):
+        """
+        Create lists of the variables and parameters and a dictionary
+        mapping variables to parameters.
+        """
         self.all_variables = [term.variable for term in self.terms]
         self.all_parameters = [term.parameter for term in self.terms]
         self.term_dict = dict(self.terms)
@@ -99,8 +132,8 @@ class Utility(object):
             variable_and_parameter (list[str] or tuple[str]): A list of tuple
                 of length two containing the labels of the variable and
                 parameter.
-            variables (list[str]): A list of all variable labels.
-            parameters (list[str]): A list of all parameter labels.
+            variables (set[str]): A set of all variable labels.
+            parameters (set[str]): A set of all parameter labels.
 
         Returns:
             (VariableAndParameter): A named tuple with components 'variable'
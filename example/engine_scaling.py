@@ -0,0 +1,75 @@
+#! /usr/bin/env python3
+import choice_model
+from choice_model.engine import get_engine, numba_available
+from functools import partial
+import numpy as np
+import time
+
+number_of_alternatives = 10
+number_of_variables = [10, 50, 100, 200, 400]
+n_observations = 5000
+repeats = 5
+
+
+def naive_log_likelihood_and_gradient(features, choices, parameters):
+    """
+    Log likelihood and gradient using a dense (observations, alternatives,
+    parameters) array of features
+    """
+    utilities = np.einsum('njk,k->nj', features, parameters)
+    utilities -= utilities.max(axis=1, keepdims=True)
+    probabilities = np.exp(utilities)
+    probabilities /= probabilities.sum(axis=1, keepdims=True)
+    observations = np.arange(len(choices))
+    log_likelihood = np.log(probabilities[observations, choices]).sum()
+    gradient = (features[observations, choices].sum(axis=0)
+                - np.einsum('nj,njk->k', probabilities, features))
+    return log_likelihood, gradient
+
+
+def naive_features(design):
+    kernel = design.kernel
+    features = np.zeros((design.number_of_observations,
+                         design.number_of_alternatives,
+                         design.number_of_parameters))
+    features[:, kernel.term_alternative, kernel.term_parameter] = (
+        design.data[:, kernel.term_field])
+    features[:, kernel.intercept_alternative, kernel.intercept_parameter] = 1.
+    return features
+
+
+def time_evaluation(function, parameters):
+    function(parameters)
+    start = time.perf_counter()
+    for repeat in range(repeats):
+        function(parameters)
+    return (time.perf_counter() - start) / repeats
+
+
+engines = ['numpy', 'numba'] if numba_available() else ['numpy']
+
+print('{:>10s} {:>12s}'.format('variables', 'naive') + ''.join(
+    '{:>12s}'.format(engine) for engine in engines))
+for n_variables in number_of_variables:
+    model = choice_model.synthetic_model(
+        title='Synthetic',
+        number_of_alternatives=number_of_alternatives,
+        number_of_variables=n_variables
+        )
+    model.load_data(choice_model.synthetic_data(model, n_observations))
+    design = choice_model.Design(model)
+    parameters = np.zeros(design.number_of_parameters)
+
+    features = naive_features(design)
+    times = [time_evaluation(
+        partial(naive_log_likelihood_and_gradient, features, design.choices),
+        parameters)]
+    del features
+
+    for engine in engines:
+        engine = get_engine(engine)(design)
+        times.append(time_evaluation(engine.log_likelihood_and_gradient,
+                                     parameters))
+
+    print('{:10d}'.format(n_variables) + ''.join(
+        '{:12.4f}'.format(seconds) for seconds in times))
@@ -0,0 +1,40 @@
+#! /usr/bin/env python3
+import numpy as np
+import os
+import subprocess
+import sys
+
+project_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Statements to time, each run in a fresh interpreter so that no modules are
+# cached
+statements = {
+    'package': 'import choice_model',
+    'model': 'import choice_model; choice_model.MultinomialLogit',
+    'yaml model': (
+        'import choice_model\n'
+        'with open("data/grenoble.yml") as model_file:\n'
+        '    choice_model.MultinomialLogit.from_yaml(model_file)'
+        ),
+    }
+repeats = 10
+
+timer = '''
+import time
+start = time.perf_counter()
+{}
+print(time.perf_counter() - start)
+'''
+
+
+def import_time(statement):
+    process = subprocess.run([sys.executable, '-c', timer.format(statement)],
+                             cwd=project_dir, check=True,
+                             stdout=subprocess.PIPE)
+    return float(process.stdout.decode('utf-8').split()[-1])
+
+
+for label, statement in statements.items():
+    times = np.array([import_time(statement) for repeat in range(repeats)])
+    print('{:12s} {:8.2f} ms +/- {:.2f} ms'.format(
+        label, times.mean()*1000, times.std()*1000))
@@ -0,0 +1,41 @@
+#! /usr/bin/env python3
+import choice_model
+import numpy as np
+import os
+
+data_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../data'))
+
+
+def estimate(dtype):
+    with open(data_dir+'/grenoble.yml') as model_file,\
+            open(data_dir+'/grenoble.csv') as data_file:
+        model = choice_model.MultinomialLogit.from_yaml(model_file)
+        model.load_data(data_file, dtype=dtype)
+    interface = choice_model.NativeInterface(model)
+    interface.estimate()
+    return interface
+
+
+double = estimate(np.float64)
+single = estimate(np.float32)
+
+names = double.parameter_names
+values = np.array([double.parameters()[name] for name in names])
+errors = np.array([double.standard_errors()[name] for name in names])
+single_values = np.array([single.parameters()[name] for name in names])
+single_errors = np.array([single.standard_errors()[name] for name in names])
+
+print('Engine: {}'.format(double.engine.name))
+print('Final log likelihood')
+print('\tfloat64: {:.9f}'.format(double.final_log_likelihood()))
+print('\tfloat32: {:.9f}'.format(single.final_log_likelihood()))
+print('Largest parameter difference, in standard errors: {:.3g}'.format(
+    np.max(np.abs(single_values - values) / errors)))
+print('Largest relative standard error difference: {:.3g}'.format(
+    np.max(np.abs(single_errors - errors) / errors)))
+print('Largest probability difference: {:.3g}'.format(
+    np.max(np.abs(single.probabilities().to_numpy()
+                  - double.probabilities().to_numpy()))))
+print('Data matrix size')
+print('\tfloat64: {} bytes'.format(double.design.data.nbytes))
+print('\tfloat32: {} bytes'.format(single.design.data.nbytes))
@@ -0,0 +1,68 @@
+#! /usr/bin/env python3
+import choice_model
+from choice_model.engine import get_engine, numba_available
+import numpy as np
+import time
+
+number_of_alternatives = 200
+number_of_variables = 5
+n_observations = 5000
+available_fractions = [1.0, 0.5, 0.2, 0.05]
+repeats = 5
+
+
+def time_evaluation(function, parameters):
+    function(parameters)
+    start = time.perf_counter()
+    for repeat in range(repeats):
+        function(parameters)
+    return (time.perf_counter() - start) / repeats
+
+
+def design_bytes(design):
+    if isinstance(design, choice_model.RaggedDesign):
+        return (sum(data.nbytes for data in design.alternative_data)
+                + sum(pairs.nbytes for pairs in design.alternative_pairs)
+                + design.pair_alternative.nbytes + design.indptr.nbytes)
+    return design.data.nbytes + design.packed_availability.nbytes
+
+
+model = choice_model.synthetic_model(
+    title='Synthetic',
+    number_of_alternatives=number_of_alternatives,
+    number_of_variables=number_of_variables
+    )
+data = choice_model.synthetic_data(model, n_observations)
+
+engines = [('numpy', 'dense'), ('numpy', 'ragged')]
+if numba_available():
+    engines.insert(1, ('numba', 'dense'))
+
+print('{:>10s}'.format('available') + ''.join(
+    '{:>14s}'.format(engine+' '+layout) for engine, layout in engines)
+    + '{:>14s}{:>14s}'.format('dense MB', 'ragged MB'))
+for fraction in available_fractions:
+    # Make each alternative available with probability fraction, always
+    # including the chosen alternative
+    availability = np.random.random(
+        (n_observations, number_of_alternatives)) < fraction
+    choices = np.array([model.alternatives.index(choice)
+                        for choice in data[model.choice_column]])
+    availability[np.arange(n_observations), choices] = True
+    data[model.availability_fields()] = availability.astype(np.int8)
+    model.load_data(data)
+
+    designs = {'dense': choice_model.Design(model),
+               'ragged': choice_model.RaggedDesign(model)}
+    parameters = np.zeros(designs['dense'].number_of_parameters)
+
+    times = []
+    for engine, layout in engines:
+        engine = get_engine(engine, layout)(designs[layout])
+        times.append(time_evaluation(engine.log_likelihood_and_gradient,
+                                     parameters))
+
+    print('{:10.2f}'.format(fraction) + ''.join(
+        '{:14.4f}'.format(seconds) for seconds in times)
+        + ''.join('{:14.2f}'.format(design_bytes(designs[layout])/1.0e6)
+                  for layout in ('dense', 'ragged')))
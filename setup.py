@@ -7,11 +7,15 @@ setup(
     license="MIT",
     author="Jim Madge",
     url="https://github.com/alan-turing-institute/discrete-choice",
+    python_requires=">=3.7",
     install_requires=[
-        "numpy",
+        "numpy>=1.17",
         "pandas",
         "pylogit",
         "pyyaml",
-        "scipy"
-    ]
+        "scipy>=1.7"
+    ],
+    extras_require={
+        "numba": ["numba"]
+    }
 )
@@ -0,0 +1,311 @@
+import choice_model
+from choice_model.analysis import (accessibility, elasticities, logsums,
+                                   marginal_effects, observation_elasticities,
+                                   observation_marginal_effects, Scenarios)
+from choice_model.scoring import Scorer
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope='module')
+def grenoble_estimation(main_data_dir):
+    with open(main_data_dir+'grenoble.yml') as model_file,\
+            open(main_data_dir+'grenoble.csv') as data_file:
+        model = choice_model.MultinomialLogit.from_yaml(model_file)
+        model.load_data(data_file)
+    interface = choice_model.NativeInterface(model)
+    interface.estimate('newton')
+    return interface
+
+
+@pytest.fixture(scope='module')
+def probabilities(grenoble_estimation):
+    return grenoble_estimation.probabilities()
+
+
+class TestObservationEffects():
+    # car_cost is only in the utility of car
+    def test_elasticities(self, grenoble_estimation, probabilities):
+        interface = grenoble_estimation
+        result = observation_elasticities(interface, 'cost', 'car')
+        assert list(result.columns) == interface.model.alternatives
+
+        # Compare with finite differences
+        data = interface.model.data.copy()
+        step = 1.0e-6
+        data['car_cost'] *= 1 + step
+        difference = ((interface.probabilities(data) - probabilities)
+                      / (step * probabilities))
+        assert result.isna().equals(probabilities == 0.)
+        assert result.to_numpy() == pytest.approx(
+            difference.to_numpy(), abs=1.0e-5, nan_ok=True)
+
+    def test_marginal_effects(self, grenoble_estimation, probabilities):
+        interface = grenoble_estimation
+        result = observation_marginal_effects(interface, 'cost', 'car')
+        data = interface.model.data.copy()
+        step = 1.0e-6
+        data['car_cost'] += step
+        difference = (interface.probabilities(data) - probabilities) / step
+        assert result.to_numpy() == pytest.approx(difference.to_numpy(),
+                                                  abs=1.0e-8)
+
+    def test_unknown_attribute(self, grenoble_estimation):
+        with pytest.raises(ValueError):
+            observation_elasticities(grenoble_estimation, 'cost', 'walk')
+
+
+class TestAggregates():
+    def test_index(self, grenoble_estimation):
+        result = elasticities(grenoble_estimation)
+        assert result.index.names == ['variable', 'alternative']
+        assert ('travel_time', 'passenger') in result.index
+        assert ('cost', 'walk') not in result.index
+        assert len(result) == 17
+
+    @pytest.mark.parametrize('weighted', [False, True])
+    def test_elasticities(self, grenoble_estimation, probabilities,
+                          weighted):
+        interface = grenoble_estimation
+        weights = np.random.default_rng(0).uniform(
+            0.5, 2.0, len(probabilities)) if weighted else None
+        result = elasticities(interface, weights=weights)
+        demand = probabilities.mul(
+            1. if weights is None else weights, axis=0)
+
+        # Probability weighted averages of the observation elasticities
+        for variable, alternative in [('cost', 'car'),
+                                      ('travel_time', 'walk')]:
+            expected = (observation_elasticities(
+                interface, variable, alternative).fillna(0.)
+                * demand).sum() / demand.sum()
+            assert result.loc[(variable, alternative)].to_numpy() == (
+                pytest.approx(expected.to_numpy()))
+
+    def test_marginal_effects(self, grenoble_estimation):
+        result = marginal_effects(grenoble_estimation)
+        expected = observation_marginal_effects(
+            grenoble_estimation, 'non_linear', 'cycle').mean()
+        assert result.loc[('non_linear', 'cycle')].to_numpy() == (
+            pytest.approx(expected.to_numpy()))
+        # Probabilities sum to one, so the effects on them sum to zero
+        assert result.sum(axis=1).to_numpy() == pytest.approx(0., abs=1e-12)
+
+    @pytest.mark.parametrize('function', [elasticities, marginal_effects])
+    def test_chunks(self, grenoble_estimation, function):
+        assert function(grenoble_estimation, chunk_size=7).to_numpy() == (
+            pytest.approx(function(grenoble_estimation).to_numpy()))
+
+    def test_weight_column(self, grenoble_estimation):
+        data = grenoble_estimation.model.data.assign(weight=3.)
+        assert elasticities(grenoble_estimation, data,
+                            weights='weight').to_numpy() == pytest.approx(
+            elasticities(grenoble_estimation).to_numpy())
+        with pytest.raises(ValueError):
+            elasticities(grenoble_estimation, weights=np.ones(3))
+
+
+def test_unsupported_model(main_data_dir):
+    with open(main_data_dir+'grenoble_nested.yml') as model_file,\
+            open(main_data_dir+'grenoble.csv') as data_file:
+        model = choice_model.NestedLogit.from_yaml(model_file)
+        model.load_data(data_file)
+    interface = choice_model.NativeInterface(model)
+    with pytest.raises(TypeError):
+        elasticities(interface)
+
+
+@pytest.fixture(scope='module')
+def scenarios(grenoble_estimation):
+    return Scenarios(grenoble_estimation)
+
+
+class TestScenarios():
+    def test_baseline(self, scenarios, grenoble_estimation, probabilities):
+        assert scenarios.baseline.probabilities.to_numpy() == pytest.approx(
+            probabilities.to_numpy())
+        assert scenarios.baseline.shares.to_numpy() == pytest.approx(
+            probabilities.mean().to_numpy())
+        assert scenarios.simulate({}).shares.equals(scenarios.baseline.shares)
+
+    def test_simulate(self, scenarios, grenoble_estimation):
+        result = scenarios.simulate(
+            {'car_cost': 'car_cost * 1.1',
+             'public_transport_time': 'where(central_zone == 1,'
+                                      ' public_transport_time - 300,'
+                                      ' public_transport_time)'},
+            probabilities=True)
+        data = grenoble_estimation.model.data.copy()
+        data['car_cost'] *= 1.1
+        data.loc[data['central_zone'] == 1, 'public_transport_time'] -= 300
+        expected = grenoble_estimation.probabilities(data)
+        assert result.probabilities.to_numpy() == pytest.approx(
+            expected.to_numpy())
+        assert result.shares.to_numpy() == pytest.approx(
+            expected.mean().to_numpy())
+        assert result.shares['car'] < scenarios.baseline.shares['car']
+
+    def test_values(self, scenarios, grenoble_estimation):
+        # Numbers and arrays of values
+        data = grenoble_estimation.model.data
+        number = scenarios.simulate({'car_cost': 100.})
+        array = scenarios.simulate(
+            {'car_cost': np.full(len(data), 100.)})
+        assert number.shares.to_numpy() == pytest.approx(
+            array.shares.to_numpy())
+        assert number.probabilities is None
+        with pytest.raises(ValueError):
+            scenarios.simulate({'car_cost': np.ones(3)})
+
+    def test_unknown_field(self, scenarios):
+        with pytest.raises(ValueError):
+            scenarios.simulate({'dist': 'dist * 2'})
+
+    def test_availability(self, scenarios):
+        with pytest.raises(ValueError):
+            scenarios.simulate({'avail_car': 0})
+
+    def test_missing_unavailable(self, grenoble_estimation, scenarios):
+        # Missing values of unavailable alternatives
+        data = grenoble_estimation.model.data.copy()
+        data.loc[data['avail_car'] == 0, 'car_cost'] = np.nan
+        changes = {'car_cost': 'car_cost * 1.1'}
+        result = Scenarios(grenoble_estimation, data).simulate(
+            changes, probabilities=True)
+        expected = scenarios.simulate(changes, probabilities=True)
+        assert result.probabilities.to_numpy() == pytest.approx(
+            expected.probabilities.to_numpy())
+        assert result.shares.to_numpy() == pytest.approx(
+            expected.shares.to_numpy())
+
+    def test_weights(self, grenoble_estimation):
+        data = grenoble_estimation.model.data
+        weights = np.random.default_rng(0).uniform(0.5, 2.0, len(data))
+        scenarios = Scenarios(grenoble_estimation, weights=weights)
+        result = scenarios.simulate({'car_cost': 'car_cost * 2'},
+                                    probabilities=True)
+        assert result.shares.to_numpy() == pytest.approx(
+            weights @ result.probabilities.to_numpy() / weights.sum())
+
+
+@pytest.fixture(scope='module')
+def derived_estimation(main_data_dir):
+    # Cycle time is derived from a field of minutes, and the non-linear cycle
+    # time from cycle time
+    with open(main_data_dir+'grenoble_derived.yml') as model_file,\
+            open(main_data_dir+'grenoble.csv') as data_file:
+        model = choice_model.MultinomialLogit.from_yaml(model_file)
+        model.load_data(data_file)
+    model_dict = model.to_dict()
+    model_dict['derived'] = dict(cycle_time='cycle_minutes * 60',
+                                 **model_dict['derived'])
+    data = model.data.assign(cycle_minutes=model.data['cycle_time'] / 60)
+    model = choice_model.MultinomialLogit.from_dict(model_dict)
+    model.load_data(data.drop(columns=['cycle_time', 'cycle_non_linear']))
+    interface = choice_model.NativeInterface(model)
+    interface.estimate('newton')
+    return interface
+
+
+class TestDerivedScenarios():
+    @pytest.mark.parametrize('changes,minutes', [
+        ({'cycle_minutes': 'cycle_minutes * 1.5'}, 1.5),
+        ({'cycle_time': 'cycle_time * 1.5'}, 1.5),
+        ({'cycle_minutes': 20.}, None)
+        ])
+    def test_simulate(self, derived_estimation, changes, minutes):
+        # Derived fields evaluated from the changed fields are re-evaluated
+        interface = derived_estimation
+        result = Scenarios(interface).simulate(changes, probabilities=True)
+        data = interface.model.data.copy()
+        if minutes is None:
+            data['cycle_minutes'] = 20.
+        else:
+            data['cycle_minutes'] *= minutes
+        expected = interface.probabilities(data)
+        assert result.probabilities.to_numpy() == pytest.approx(
+            expected.to_numpy())
+        assert result.shares['cycle'] == pytest.approx(
+            expected['cycle'].mean())
+
+    def test_derived_field(self, derived_estimation):
+        # A changed derived field keeps its new values
+        interface = derived_estimation
+        model = interface.model
+        result = Scenarios(interface).simulate({'cycle_non_linear': 0.},
+                                               probabilities=True)
+
+        # Score the data with the derived field read from the data instead
+        kernel = choice_model.UtilityKernel(model)
+        scorer = Scorer(
+            kernel, kernel.parameter_vector(interface.parameters()),
+            model.availability_fields(), derived={'cycle_time':
+                                                  'cycle_minutes * 60'})
+        data = model.materialise().assign(cycle_non_linear=0.)
+        assert result.probabilities.to_numpy() == pytest.approx(
+            scorer.probabilities(data))
+
+    def test_unused_field(self, derived_estimation):
+        scenarios = Scenarios(derived_estimation,
+                              derived_estimation.model.data.assign(other=1.))
+        with pytest.raises(ValueError):
+            scenarios.simulate({'other': 2.})
+
+
+class TestLogsums():
+    def test_logsums(self, grenoble_estimation, probabilities):
+        interface = grenoble_estimation
+        result = logsums(interface)
+        assert result.index.equals(interface.model.data.index)
+
+        # The derivative of the logsum with respect to a variable is the
+        # coefficient times the probability
+        data = interface.model.data.copy()
+        step = 1.0e-6
+        data['car_cost'] += step
+        derivative = (logsums(interface, data) - result) / step
+        assert derivative.to_numpy() == pytest.approx(
+            interface.parameters()['pcost'] * probabilities['car'].to_numpy(),
+            abs=1.0e-8)
+
+    def test_no_choices(self, grenoble_estimation):
+        data = grenoble_estimation.model.data
+        assert logsums(grenoble_estimation, data.drop(columns='mode')).equals(
+            logsums(grenoble_estimation))
+
+    def test_missing_unavailable(self, grenoble_estimation):
+        # Missing values of unavailable alternatives
+        interface = grenoble_estimation
+        data = interface.model.data.copy()
+        data.loc[data['avail_car'] == 0, 'car_cost'] = np.nan
+        assert np.all(logsums(interface, data) == logsums(interface))
+        assert elasticities(interface, data).equals(
+            elasticities(interface))
+
+    def test_accessibility(self, grenoble_estimation):
+        interface = grenoble_estimation
+        data = interface.model.data
+        segments = ['central_zone', 'has_car']
+        result = accessibility(interface, segments, cost_parameter='pcost')
+        expected = logsums(interface).groupby(
+            [data[segment] for segment in segments])
+        assert result.index.names == segments
+        assert result['logsum'].to_numpy() == pytest.approx(
+            expected.mean().to_numpy())
+        assert result['weight'].to_numpy() == pytest.approx(
+            expected.size().to_numpy())
+        assert result['consumer_surplus'].to_numpy() == pytest.approx(
+            -result['logsum'].to_numpy() / interface.parameters()['pcost'])
+
+    def test_stream(self, grenoble_estimation):
+        # Dataframes streamed in pieces, with weights from a column
+        interface = grenoble_estimation
+        data = interface.model.data.assign(people=np.arange(
+            len(interface.model.data)) % 3 + 1.)
+        pieces = (data.iloc[start:start+300]
+                  for start in range(0, len(data), 300))
+        result = accessibility(interface, ['central_zone'], pieces,
+                               weights='people', chunk_size=64)
+        expected = accessibility(interface, ['central_zone'], data,
+                                 weights=data['people'].to_numpy())
+        assert result.to_numpy() == pytest.approx(expected.to_numpy())
@@ -0,0 +1,325 @@
+import choice_model
+import numpy as np
+import pandas as pd
+import pytest
+
+
+class TestDesign():
+    def test_arrays(self, simple_multinomial_model_with_data):
+        design = choice_model.Design(simple_multinomial_model_with_data)
+        assert design.number_of_observations == 2
+        assert design.dtype == np.float64
+        assert design.all_available
+        assert design.availability().all()
+        assert list(design.choices) == [0, 1]
+        assert design.choices.dtype == np.uint8
+
+    def test_no_choices(self, simple_multinomial_model_with_data):
+        model = simple_multinomial_model_with_data
+        data = model.data.drop(columns=model.choice_column)
+        assert choice_model.Design(model, data).choices is None
+
+    def test_unknown_alternative(self, simple_multinomial_model_with_data):
+        model = simple_multinomial_model_with_data
+        data = model.data.copy()
+        data[model.choice_column] = ['choice1', 'choice3']
+        with pytest.raises(choice_model.design.UnknownAlternative):
+            choice_model.Design(model, data)
+
+    def test_choice_not_available(self, simple_multinomial_model_with_data):
+        model = simple_multinomial_model_with_data
+        data = model.data.copy()
+        data[model.availability['choice2']] = 0
+        with pytest.raises(choice_model.design.ChoiceNotAvailable):
+            choice_model.Design(model, data)
+
+
+class TestAvailability():
+    @pytest.fixture
+    def design(self, main_data_dir):
+        with open(main_data_dir+'grenoble.yml') as model_file,\
+                open(main_data_dir+'grenoble.csv') as data_file:
+            model = choice_model.MultinomialLogit.from_yaml(model_file)
+            model.load_data(data_file)
+        return model, choice_model.Design(model)
+
+    def test_unpacked(self, design):
+        model, design = design
+        expected = model.data[
+            [model.availability[alternative]
+             for alternative in model.alternatives]
+            ].to_numpy(dtype=bool)
+        assert not design.all_available
+        assert np.array_equal(design.availability(), expected)
+        assert np.array_equal(design.availability(slice(10, 20)),
+                              expected[10:20])
+
+    def test_packed(self, design):
+        model, design = design
+        assert design.packed_availability.dtype == np.uint8
+        assert design.packed_availability.shape == (
+            design.number_of_observations, 1)
+
+    def test_many_alternatives(self):
+        model = choice_model.synthetic_model(
+            title='Synthetic', number_of_alternatives=20,
+            number_of_variables=2)
+        data = choice_model.synthetic_data(model, 50)
+        data[model.availability['alternative20']] = 0
+        data[model.choice_column] = 'alternative1'
+        design = choice_model.Design(model, data)
+        assert design.packed_availability.shape == (50, 3)
+        assert design.availability()[:, :19].all()
+        assert not design.availability()[:, 19].any()
+
+
+class TestRaggedDesign():
+    @pytest.fixture
+    def designs(self, main_data_dir):
+        with open(main_data_dir+'grenoble.yml') as model_file,\
+                open(main_data_dir+'grenoble.csv') as data_file:
+            model = choice_model.MultinomialLogit.from_yaml(model_file)
+            model.load_data(data_file)
+        return (model, choice_model.Design(model),
+                choice_model.RaggedDesign(model))
+
+    def test_pairs(self, designs):
+        model, dense, ragged = designs
+        assert ragged.number_of_observations == dense.number_of_observations
+        assert ragged.number_of_pairs == dense.availability().sum()
+        assert np.array_equal(ragged.availability(), dense.availability())
+
+    def test_chosen_pairs(self, designs):
+        model, dense, ragged = designs
+        assert np.array_equal(ragged.pair_alternative[ragged.chosen_pairs],
+                              dense.choices)
+        assert np.array_equal(
+            ragged.pair_observation()[ragged.chosen_pairs],
+            np.arange(ragged.number_of_observations))
+
+    def test_alternative_data(self, designs):
+        model, dense, ragged = designs
+        kernel = ragged.kernel
+        pair_observation = ragged.pair_observation()
+        for j, (pairs, data) in enumerate(zip(ragged.alternative_pairs,
+                                              ragged.alternative_data)):
+            fields = kernel.term_field[kernel.term_pointer[j]:
+                                       kernel.term_pointer[j+1]]
+            assert np.all(ragged.pair_alternative[pairs] == j)
+            assert np.array_equal(
+                data, dense.data[pair_observation[pairs]][:, fields])
+
+    def test_shared_field(self, designs):
+        # car_time is the travel time of both car and passenger, and is
+        # held once
+        model, dense, ragged = designs
+        kernel = dense.kernel
+        assert kernel.fields.count('car_time') == 1
+        field = kernel.fields.index('car_time')
+        pair_observation = ragged.pair_observation()
+        for alternative in ('car', 'passenger'):
+            j = model.alternatives.index(alternative)
+            fields = list(kernel.term_field[kernel.term_pointer[j]:
+                                            kernel.term_pointer[j+1]])
+            assert field in fields
+
+            # Both alternatives' term values are gathered from the same
+            # column
+            pairs = ragged.alternative_pairs[j]
+            assert np.array_equal(
+                ragged.alternative_data[j][:, fields.index(field)],
+                dense.data[pair_observation[pairs], field])
+
+    def test_no_available_alternatives(self,
+                                       simple_multinomial_model_with_data):
+        model = simple_multinomial_model_with_data
+        data = model.data.drop(columns=model.choice_column)
+        for availability in model.availability.values():
+            data[availability] = 0
+        with pytest.raises(choice_model.design.NoAvailableAlternatives):
+            choice_model.RaggedDesign(model, data)
+
+
+class TestSubset():
+    @pytest.fixture
+    def model(self, main_data_dir):
+        with open(main_data_dir+'grenoble.yml') as model_file,\
+                open(main_data_dir+'grenoble.csv') as data_file:
+            model = choice_model.MultinomialLogit.from_yaml(model_file)
+            model.load_data(data_file)
+        return model
+
+    @pytest.fixture(params=['array', 'slice'])
+    def rows(self, model, request):
+        if request.param == 'slice':
+            return slice(100, 500, 2)
+        rng = np.random.default_rng(0)
+        return np.sort(rng.choice(len(model.data), 200, replace=False))
+
+    def test_dense(self, model, rows):
+        subset = choice_model.Design(model).subset(rows)
+        expected = choice_model.Design(model, model.data.iloc[rows])
+        assert subset.kernel is not None
+        assert np.array_equal(subset.data, expected.data)
+        assert np.array_equal(subset.choices, expected.choices)
+        assert np.array_equal(subset.availability(), expected.availability())
+
+    def test_ragged(self, model, rows):
+        subset = choice_model.RaggedDesign(model).subset(rows)
+        expected = choice_model.RaggedDesign(model, model.data.iloc[rows])
+        assert np.array_equal(subset.indptr, expected.indptr)
+        assert np.array_equal(subset.pair_alternative,
+                              expected.pair_alternative)
+        assert np.array_equal(subset.chosen_pairs, expected.chosen_pairs)
+        for pairs, expected_pairs in zip(subset.alternative_pairs,
+                                         expected.alternative_pairs):
+            assert np.array_equal(pairs, expected_pairs)
+        for data, expected_data in zip(subset.alternative_data,
+                                       expected.alternative_data):
+            assert np.array_equal(data, expected_data)
+
+    def test_no_choices(self, model, rows):
+        data = model.data.drop(columns=model.choice_column)
+        for design in (choice_model.Design, choice_model.RaggedDesign):
+            assert design(model, data).subset(rows).choices is None
+
+
+class TestAppend():
+    @pytest.fixture
+    def model(self, main_data_dir):
+        with open(main_data_dir+'grenoble.yml') as model_file,\
+                open(main_data_dir+'grenoble.csv') as data_file:
+            model = choice_model.MultinomialLogit.from_yaml(model_file)
+            model.load_data(data_file)
+        return model
+
+    def test_dense(self, model):
+        design = choice_model.Design(model, model.data.iloc[:500])
+        design.append(model, model.data.iloc[500:])
+        expected = choice_model.Design(model)
+        assert np.array_equal(design.data, expected.data)
+        assert np.array_equal(design.choices, expected.choices)
+        assert np.array_equal(design.packed_availability,
+                              expected.packed_availability)
+        assert design.all_available == expected.all_available
+
+    def test_ragged(self, model):
+        design = choice_model.RaggedDesign(model, model.data.iloc[:500])
+        design.subset(np.arange(10))
+        design.append(model, model.data.iloc[500:])
+        expected = choice_model.RaggedDesign(model)
+        assert np.array_equal(design.indptr, expected.indptr)
+        assert np.array_equal(design.chosen_pairs, expected.chosen_pairs)
+        for pairs, expected_pairs in zip(design.alternative_pairs,
+                                         expected.alternative_pairs):
+            assert np.array_equal(pairs, expected_pairs)
+        for data, expected_data in zip(design.alternative_data,
+                                       expected.alternative_data):
+            assert np.array_equal(data, expected_data)
+        # The pair positions are recomputed after appending
+        rows = np.arange(490, 510)
+        assert np.array_equal(design.subset(rows).alternative_data[0],
+                              expected.subset(rows).alternative_data[0])
+
+    def test_sampled(self, model):
+        design = choice_model.SampledDesign(model, 2,
+                                            model.data.iloc[:500])
+        design.append(model, model.data.iloc[500:])
+        assert design.number_of_observations == len(model.data)
+        assert np.array_equal(design.pair_alternative[design.chosen_pairs],
+                              choice_model.Design(model).choices)
+        assert len(design.pair_offset) == design.number_of_pairs
+        assert len(design.sample_counts) == design.number_of_pairs
+
+    def test_choices(self, model):
+        design = choice_model.Design(model, model.data.iloc[:500])
+        with pytest.raises(ValueError):
+            design.append(model, model.data.iloc[500:].drop(
+                columns=model.choice_column))
+
+
+class TestSampledDesign():
+    @pytest.fixture
+    def model(self, main_data_dir):
+        with open(main_data_dir+'grenoble.yml') as model_file,\
+                open(main_data_dir+'grenoble.csv') as data_file:
+            model = choice_model.MultinomialLogit.from_yaml(model_file)
+            model.load_data(data_file)
+        return model
+
+    def test_choice_sets(self, model):
+        full = choice_model.RaggedDesign(model)
+        sampled = choice_model.SampledDesign(model, 2)
+        availability = sampled.availability()
+        assert not (availability & ~full.availability()).any()
+        assert (availability.sum(axis=1) <= 3).all()
+        assert np.array_equal(sampled.pair_alternative[sampled.chosen_pairs],
+                              full.choices)
+        # Every observation has its draws and the chosen alternative
+        assert np.array_equal(
+            np.add.reduceat(sampled.sample_counts, sampled.indptr[:-1]),
+            np.full(sampled.number_of_observations, 3))
+
+    def test_uniform_offset(self, model):
+        sampled = choice_model.SampledDesign(model, 2)
+        available = choice_model.Design(model).availability().sum(axis=1)
+        expected = (np.log(sampled.sample_counts)
+                    + np.log(available[sampled.pair_observation()]))
+        assert sampled.pair_offset == pytest.approx(expected)
+
+    def test_importance(self, model):
+        # Only the chosen alternative may be drawn
+        importance = np.full((len(model.data), len(model.alternatives)),
+                             1.0e-12)
+        design = choice_model.Design(model)
+        importance[np.arange(len(model.data)), design.choices] = 1.
+        sampled = choice_model.SampledDesign(model, 5, importance=importance)
+        assert np.array_equal(sampled.indptr,
+                              np.arange(sampled.number_of_observations + 1))
+        assert (sampled.sample_counts == 6).all()
+
+        importance[0, design.choices[0]] = 0.
+        with pytest.raises(ValueError):
+            choice_model.SampledDesign(model, 5, importance=importance)
+
+    def test_seed(self, model):
+        first = choice_model.SampledDesign(model, 2, seed=1)
+        second = choice_model.SampledDesign(model, 2, seed=1)
+        assert np.array_equal(first.pair_offset, second.pair_offset)
+        assert np.array_equal(first.pair_alternative,
+                              second.pair_alternative)
+
+    def test_no_choices(self, model):
+        data = model.data.drop(columns=model.choice_column)
+        with pytest.raises(ValueError):
+            choice_model.SampledDesign(model, 2, data)
+
+
+class TestPrecision():
+    def test_single(self, simple_multinomial_model_with_data):
+        design = choice_model.Design(simple_multinomial_model_with_data,
+                                     dtype=np.float32)
+        assert design.dtype == np.float32
+        assert design.data.dtype == np.float32
+
+    def test_inferred(self, simple_multinomial_model_with_data):
+        model = simple_multinomial_model_with_data
+        data = model.data.astype(
+            {field: np.float32 for field in model.all_variable_fields()})
+        assert choice_model.Design(model, data).dtype == np.float32
+
+    def test_invalid(self, simple_multinomial_model_with_data):
+        with pytest.raises(ValueError):
+            choice_model.Design(simple_multinomial_model_with_data,
+                                dtype=np.int64)
+
+    def test_load_data(self, data_dir):
+        with open(data_dir+'simple_model.yml', 'r') as yaml_file:
+            model = choice_model.MultinomialLogit.from_yaml(yaml_file)
+        with open(data_dir+'simple.csv', 'r') as data_file:
+            model.load_data(data_file, dtype=np.float32)
+        for field in model.all_variable_fields():
+            assert model.data[field].dtype == np.float32
+        assert not pd.api.types.is_float_dtype(
+            model.data[model.choice_column])
+        assert choice_model.Design(model).dtype == np.float32
@@ -0,0 +1,31 @@
+from choice_model.draws import standard_normal_draws
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize('method', ['halton', 'sobol'])
+class TestDraws():
+    def test_shape(self, method):
+        draws = standard_normal_draws(method, 50, 3, 0, 10)
+        assert draws.shape == (10, 50, 3)
+
+    def test_chunks(self, method):
+        # The draws of an observation do not depend on the chunk
+        draws = standard_normal_draws(method, 50, 3, 0, 10)
+        assert np.array_equal(standard_normal_draws(method, 50, 3, 4, 3),
+                              draws[4:7])
+
+    def test_distribution(self, method):
+        draws = standard_normal_draws(method, 100, 2, 0, 100)
+        assert draws.mean(axis=(0, 1)) == pytest.approx(0., abs=1.0e-2)
+        assert draws.std(axis=(0, 1)) == pytest.approx(1., abs=1.0e-2)
+
+    def test_seed(self, method):
+        assert not np.array_equal(
+            standard_normal_draws(method, 10, 2, 0, 10, seed=0),
+            standard_normal_draws(method, 10, 2, 0, 10, seed=1))
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        standard_normal_draws('random', 10, 2, 0, 10)
@@ -0,0 +1,36 @@
+import importlib
+import subprocess
+import sys
+import pytest
+
+
+@pytest.mark.parametrize('module', [
+    'pandas',
+    'pylogit',
+    'scipy',
+    'yaml',
+    ])
+def test_lazy_import(module):
+    # Importing the package should not import back ends or heavy dependencies
+    statement = 'import sys, choice_model; print({!r} in sys.modules)'.format(
+        module)
+    process = subprocess.run([sys.executable, '-c', statement],
+                             stdout=subprocess.PIPE, check=True)
+    assert process.stdout.decode('utf-8').strip() == 'False'
+
+
+def test_lazy_attribute():
+    import choice_model
+    assert choice_model.Utility is choice_model.utility.Utility
+
+
+def test_missing_attribute():
+    import choice_model
+    with pytest.raises(AttributeError):
+        choice_model.not_an_attribute
+
+
+@pytest.mark.parametrize('package', ['choice_model', 'choice_model.interface'])
+def test_dir(package):
+    package = importlib.import_module(package)
+    assert set(package.__all__) <= set(dir(package))
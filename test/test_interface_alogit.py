@@ -61,6 +61,22 @@ class TestAbbreviation():
         assert interface.elongate(short) == full
 
 
+def test_shared_field_abbreviation(main_data_dir):
+    # A field shared by several alternatives has a single abbreviation and
+    # the choice dependent fields are numbered consecutively
+    with open(main_data_dir+'grenoble.yml') as model_file,\
+            open(main_data_dir+'grenoble.csv') as data_file:
+        model = choice_model.MultinomialLogit.from_yaml(model_file)
+        model.load_data(data_file)
+    interface = choice_model.AlogitInterface(model, alogit_path='./dummy')
+    fields = model.alternative_dependent_variable_fields()
+    abbreviations = [interface.abbreviate(field) for field in fields]
+    assert abbreviations == ['cv{}'.format(number)
+                             for number in range(1, len(fields)+1)]
+    assert [interface.elongate(abbreviation)
+            for abbreviation in abbreviations] == fields
+
+
 class TestAloFile():
     @pytest.mark.parametrize('choice,string', [
         ('choice1', 'c1 + prm1*v1 + prm3*v3(ch1)'),
@@ -126,6 +142,21 @@ class TestAloFile():
             )
         assert file_text[-(len(end_string)):] == end_string
 
+    def test_nest_records(self, main_data_dir):
+        with open(main_data_dir+'grenoble_nested.yml') as model_file,\
+                open(main_data_dir+'grenoble.csv') as data_file:
+            model = choice_model.NestedLogit.from_yaml(model_file)
+            model.load_data(data_file)
+        interface = choice_model.AlogitInterface(model, alogit_path='./dummy')
+        assert interface._nest_records() == [
+            '$nest root() ch1 nst1 nst2',
+            '$nest nst1(lam1) ch2 ch5',
+            '$nest nst2(lam2) ch3 ch4'
+            ]
+        nest_line = interface.alo.index('$nest root() ch1 nst1 nst2')
+        coefficients = ' '.join(interface.alo[2:nest_line]).split()
+        assert coefficients[-2:] == ['lam1', 'lam2']
+
 
 class TestDataFile():
     def test_data_file(self, simple_multinomial_model_with_data, tmp_path):
@@ -0,0 +1,806 @@
+import choice_model
+from choice_model.engine import get_engine, numba_available
+import numpy as np
+import pytest
+
+engines = [
+    'numpy',
+    pytest.param('numba', marks=pytest.mark.skipif(
+        not numba_available(), reason='numba is not installed'))
+    ]
+
+# Engine and layout combinations
+configurations = [
+    ('numpy', 'dense'),
+    pytest.param(('numba', 'dense'), marks=pytest.mark.skipif(
+        not numba_available(), reason='numba is not installed')),
+    ('numpy', 'ragged')
+    ]
+
+
+def make_engine(model, configuration, weights=None):
+    engine, layout = configuration
+    if layout == 'ragged':
+        design = choice_model.RaggedDesign(model)
+    else:
+        design = choice_model.Design(model)
+    return get_engine(engine, layout)(design, weights)
+
+
+def observation_weights(model):
+    return np.random.default_rng(0).uniform(0.5, 2.0, len(model.data))
+
+
+@pytest.fixture(scope='module')
+def grenoble_model(main_data_dir):
+    with open(main_data_dir+'grenoble.yml') as model_file,\
+            open(main_data_dir+'grenoble.csv') as data_file:
+        model = choice_model.MultinomialLogit.from_yaml(model_file)
+        model.load_data(data_file)
+    return model
+
+
+@pytest.fixture(scope='module')
+def grenoble_missing_model(main_data_dir):
+    # Car cost is missing where car is unavailable
+    with open(main_data_dir+'grenoble.yml') as model_file,\
+            open(main_data_dir+'grenoble.csv') as data_file:
+        model = choice_model.MultinomialLogit.from_yaml(model_file)
+        model.load_data(data_file)
+    model.data.loc[model.data['avail_car'] == 0, 'car_cost'] = np.nan
+    return model
+
+
+class TestNativeInterface():
+    def test_multinomial_logit(self, simple_multinomial_model_with_data):
+        interface = choice_model.NativeInterface(
+            simple_multinomial_model_with_data)
+        assert interface.model == simple_multinomial_model_with_data
+
+    def test_simple_model(self, simple_model):
+        with pytest.raises(TypeError):
+            choice_model.NativeInterface(simple_model)
+
+    def test_no_data(self, simple_multinomial_model):
+        with pytest.raises(choice_model.interface.interface.NoDataLoaded):
+            choice_model.NativeInterface(simple_multinomial_model)
+
+    def test_unknown_engine(self, simple_multinomial_model_with_data):
+        with pytest.raises(ValueError):
+            choice_model.NativeInterface(simple_multinomial_model_with_data,
+                                         engine='fortran')
+
+
+@pytest.mark.parametrize('configuration', configurations)
+class TestEngine():
+    # Intercepts followed by parameters
+    parameters = np.array([0.5, 0.2, 1.0, -1.0, -0.001, -0.002, -0.005, 0.3,
+                           -0.002, 1.0, 0.1, -0.4, 0.2, 0.6, -0.3])
+
+    def test_gradient(self, grenoble_model, configuration):
+        # Compare the analytic gradient to central finite differences
+        engine = make_engine(grenoble_model, configuration)
+        _, gradient = engine.log_likelihood_and_gradient(self.parameters)
+        step = 1.0e-6
+        numerical = np.array([
+            (engine.log_likelihood(self.parameters + step*unit)
+             - engine.log_likelihood(self.parameters - step*unit)) / (2*step)
+            for unit in np.eye(len(self.parameters))
+            ])
+        assert gradient == pytest.approx(numerical, rel=1.0e-4, abs=1.0e-3)
+
+    def test_hessian(self, grenoble_model, configuration):
+        engine = make_engine(grenoble_model, configuration)
+        hessian = engine.hessian(self.parameters)
+        step = 1.0e-6
+        numerical = np.array([
+            (engine.log_likelihood_and_gradient(self.parameters + step*unit)[1]
+             - engine.log_likelihood_and_gradient(self.parameters
+                                                  - step*unit)[1]) / (2*step)
+            for unit in np.eye(len(self.parameters))
+            ])
+        assert hessian.ravel() == pytest.approx(numerical.ravel(), rel=1.0e-4,
+                                                abs=1.0e-2)
+
+    def test_probabilities(self, grenoble_model, configuration):
+        engine = make_engine(grenoble_model, configuration)
+        probabilities = engine.probabilities(self.parameters)
+        assert probabilities.sum(axis=1) == pytest.approx(1.0)
+        assert np.all(probabilities[~engine.design.availability()] == 0.)
+
+    def test_layouts_agree(self, grenoble_model, configuration):
+        engine = make_engine(grenoble_model, configuration)
+        reference = make_engine(grenoble_model, ('numpy', 'dense'))
+        log_likelihood, gradient = engine.log_likelihood_and_gradient(
+            self.parameters)
+        expected = reference.log_likelihood_and_gradient(self.parameters)
+        assert log_likelihood == pytest.approx(expected[0], rel=1.0e-10)
+        assert gradient == pytest.approx(expected[1], rel=1.0e-8)
+
+    def test_observation_gradients(self, grenoble_model, configuration):
+        weights = observation_weights(grenoble_model)
+        engine = make_engine(grenoble_model, configuration, weights)
+        gradients = engine.observation_gradients(self.parameters)
+        assert gradients.shape == (len(grenoble_model.data),
+                                   len(self.parameters))
+        _, gradient = engine.log_likelihood_and_gradient(self.parameters)
+        assert np.dot(weights, gradients) == pytest.approx(gradient,
+                                                           rel=1.0e-8)
+        assert engine.score_outer_product(
+            self.parameters) == pytest.approx(
+                np.matmul(gradients.T * weights, gradients))
+
+    def test_observation_log_likelihoods(self, grenoble_model,
+                                         configuration):
+        engine = make_engine(grenoble_model, configuration)
+        log_likelihoods = engine.observation_log_likelihoods(self.parameters)
+        assert log_likelihoods.shape == (len(grenoble_model.data),)
+        assert log_likelihoods.sum() == pytest.approx(
+            engine.log_likelihood(self.parameters), rel=1.0e-10)
+
+    def test_weights(self, grenoble_model, configuration):
+        weights = observation_weights(grenoble_model)
+        engine = make_engine(grenoble_model, configuration, weights)
+        log_likelihood, gradient = engine.log_likelihood_and_gradient(
+            self.parameters)
+        assert log_likelihood == pytest.approx(np.dot(
+            weights, engine.observation_log_likelihoods(self.parameters)),
+            rel=1.0e-10)
+
+        step = 1.0e-6
+        numerical = np.array([
+            (engine.log_likelihood_and_gradient(self.parameters + step*unit)[1]
+             - engine.log_likelihood_and_gradient(self.parameters
+                                                  - step*unit)[1]) / (2*step)
+            for unit in np.eye(len(self.parameters))
+            ])
+        assert engine.hessian(self.parameters).ravel() == pytest.approx(
+            numerical.ravel(), rel=1.0e-4, abs=1.0e-2)
+
+        # Integer weights are equivalent to repeating observations
+        doubled = make_engine(grenoble_model, configuration,
+                              np.full(len(weights), 2.))
+        unweighted = make_engine(grenoble_model, configuration)
+        expected = unweighted.log_likelihood_and_gradient(self.parameters)
+        log_likelihood, gradient = doubled.log_likelihood_and_gradient(
+            self.parameters)
+        assert log_likelihood == pytest.approx(2*expected[0], rel=1.0e-10)
+        assert gradient == pytest.approx(2*expected[1], rel=1.0e-8)
+
+    def test_missing_unavailable(self, grenoble_model, grenoble_missing_model,
+                                 configuration):
+        # Missing values of unavailable alternatives should not reach the
+        # utilities of available alternatives
+        engine = make_engine(grenoble_missing_model, configuration)
+        reference = make_engine(grenoble_model, configuration)
+        log_likelihood, gradient = engine.log_likelihood_and_gradient(
+            self.parameters)
+        expected = reference.log_likelihood_and_gradient(self.parameters)
+        assert log_likelihood == pytest.approx(expected[0], rel=1.0e-12)
+        assert gradient == pytest.approx(expected[1], rel=1.0e-12)
+        assert np.all(engine.probabilities(self.parameters)
+                      == reference.probabilities(self.parameters))
+        assert engine.observation_gradients(self.parameters).ravel() == (
+            pytest.approx(reference.observation_gradients(
+                self.parameters).ravel(), rel=1.0e-12))
+        assert engine.hessian(self.parameters).ravel() == pytest.approx(
+            reference.hessian(self.parameters).ravel(), rel=1.0e-12)
+
+
+def test_weights_shape(grenoble_model):
+    with pytest.raises(ValueError):
+        make_engine(grenoble_model, ('numpy', 'dense'), np.ones(3))
+
+
+@pytest.mark.parametrize('engine', engines)
+def test_missing_unavailable_estimation(grenoble_model, grenoble_missing_model,
+                                        engine):
+    interface = choice_model.NativeInterface(grenoble_missing_model,
+                                             engine=engine)
+    interface.estimate('newton')
+    reference = choice_model.NativeInterface(grenoble_model, engine=engine)
+    reference.estimate('newton')
+    assert interface.parameters() == pytest.approx(reference.parameters(),
+                                                   rel=1.0e-8)
+
+
+def test_ragged_numba():
+    with pytest.raises(ValueError):
+        get_engine('numba', 'ragged')
+
+
+def test_unknown_layout():
+    with pytest.raises(ValueError):
+        get_engine('numpy', 'sparse')
+
+
+@pytest.fixture(scope='module', params=configurations)
+def grenoble_estimation(grenoble_model, request):
+    engine, layout = request.param
+    interface = choice_model.NativeInterface(grenoble_model, engine=engine,
+                                             layout=layout)
+    interface.estimate()
+    return interface
+
+
+class TestNativeGrenobleEstimation():
+    # Reference values are the pylogit estimates
+    def test_null_log_likelihood(self, grenoble_estimation):
+        interface = grenoble_estimation
+        assert interface.null_log_likelihood() == pytest.approx(
+            -1452.5185654443776, 1.0e-8)
+
+    def test_final_log_likelihood(self, grenoble_estimation):
+        interface = grenoble_estimation
+        assert interface.final_log_likelihood() == pytest.approx(
+            -828.503745607559, 1.0e-8)
+
+    @pytest.mark.parametrize('parameter,value,error', [
+        ('cpt', 1.098191, 0.390846),
+        ('ccycle', 0.597608, 0.323384),
+        ('cwalk', 2.099543, 0.314923),
+        ('cpass', -2.730642, 0.571899),
+        ('phead_of_household', -0.830965, 0.236262),
+        ('porigin_walk', -0.001890, 0.001276),
+        ('pcar_competition', 2.654556, 0.350013),
+        ('phas_car', 1.122745, 0.468693),
+        ('pfemale_passenger', 0.848129, 0.333083),
+        ('pfemale_cycle', -0.919043, 0.231491),
+        ('pcentral_zone', -1.481088, 0.461484),
+        ('pmanual_worker', 0.755348, 0.219562),
+        ('ptime', -0.000384, 0.000111),
+        ('pcost', -0.001127, 0.000402),
+        ('pnon_linear', -0.003240, 0.000313)
+        ])
+    def test_parameters(self, grenoble_estimation, parameter, value, error):
+        interface = grenoble_estimation
+        assert interface.parameters()[parameter] == pytest.approx(
+            value, rel=1.0e-3)
+        assert interface.standard_errors()[parameter] == pytest.approx(
+            error, rel=2.0e-3)
+        assert interface.t_values()[parameter] == pytest.approx(
+            value/error, rel=5.0e-3)
+
+    def test_probabilities(self, grenoble_estimation, grenoble_model):
+        probabilities = grenoble_estimation.probabilities()
+        assert list(probabilities.columns) == grenoble_model.alternatives
+        assert probabilities.sum(axis=1).to_numpy() == pytest.approx(1.0)
+
+    def test_estimation_time(self, grenoble_estimation):
+        assert grenoble_estimation.estimation_time() > 0.0
+
+
+@pytest.mark.parametrize('engine', engines)
+def test_single_precision(grenoble_model, grenoble_estimation, engine):
+    interface = choice_model.NativeInterface(grenoble_model, engine=engine,
+                                             dtype=np.float32)
+    interface.estimate()
+    assert interface.design.data.dtype == np.float32
+    assert interface.final_log_likelihood() == pytest.approx(
+        grenoble_estimation.final_log_likelihood(), rel=1.0e-6)
+    errors = grenoble_estimation.standard_errors()
+    for parameter, value in grenoble_estimation.parameters().items():
+        assert interface.parameters()[parameter] == pytest.approx(
+            value, abs=1.0e-2*errors[parameter])
+
+    probabilities = interface.probabilities()
+    assert probabilities.to_numpy().dtype == np.float32
+    assert probabilities.to_numpy() == pytest.approx(
+        grenoble_estimation.probabilities().to_numpy(), abs=1.0e-4)
+
+
+def test_pylogit_parity(grenoble_model, main_data_dir):
+    pytest.importorskip('pylogit')
+    with open(main_data_dir+'grenoble.yml') as model_file,\
+            open(main_data_dir+'grenoble.csv') as data_file:
+        model = choice_model.MultinomialLogit.from_yaml(model_file)
+        model.load_data(data_file)
+    reference = choice_model.PylogitInterface(model)
+    reference.estimate()
+    native = choice_model.NativeInterface(grenoble_model)
+    native.estimate()
+
+    assert native.final_log_likelihood() == pytest.approx(
+        reference.final_log_likelihood(), rel=1.0e-6)
+    for parameter, value in reference.parameters().items():
+        assert native.parameters()[parameter] == pytest.approx(value,
+                                                               rel=1.0e-3)
+
+
+class TestNativeRequiresEstimation():
+    @pytest.mark.parametrize('method', [
+        'display_results',
+        'null_log_likelihood',
+        'final_log_likelihood',
+        'parameters',
+        'standard_errors',
+        't_values',
+        'estimation_time',
+        'probabilities'
+        ])
+    def test_requires_estimation(self, simple_multinomial_model_with_data,
+                                 method):
+        interface = choice_model.NativeInterface(
+            simple_multinomial_model_with_data)
+        with pytest.raises(choice_model.interface.interface.NotEstimated):
+            getattr(interface, method)()
+
+
+@pytest.fixture(scope='module')
+def mixed_model(main_data_dir):
+    with open(main_data_dir+'grenoble_mixed.yml') as model_file,\
+            open(main_data_dir+'grenoble.csv') as data_file:
+        model = choice_model.MixedLogit.from_yaml(model_file)
+        model.load_data(data_file)
+    return model
+
+
+@pytest.fixture(scope='module')
+def mixed_estimation(mixed_model):
+    interface = choice_model.NativeInterface(mixed_model, number_of_draws=100)
+    interface.estimate()
+    return interface
+
+
+class TestMixedLogit():
+    parameters = np.append(TestEngine.parameters, [0.5, -1.0])
+
+    def engine(self, model, **kwargs):
+        return choice_model.engine.MixedLogitEngine(
+            choice_model.Design(model), model.random_parameters, **kwargs)
+
+    def test_parameter_names(self, mixed_model):
+        engine = self.engine(mixed_model)
+        assert engine.parameter_names[-2:] == ['sigma_car_competition',
+                                               'sigma_cycle']
+
+    def test_gradient(self, mixed_model):
+        engine = self.engine(mixed_model, number_of_draws=50)
+        _, gradient = engine.log_likelihood_and_gradient(self.parameters)
+        step = 1.0e-6
+        numerical = np.array([
+            (engine.log_likelihood(self.parameters + step*unit)
+             - engine.log_likelihood(self.parameters - step*unit)) / (2*step)
+            for unit in np.eye(len(self.parameters))
+            ])
+        assert gradient == pytest.approx(numerical, rel=1.0e-4, abs=1.0e-3)
+
+    def test_no_variation(self, mixed_model, grenoble_model):
+        # With zero standard deviations the model is multinomial logit
+        engine = self.engine(mixed_model, number_of_draws=10)
+        multinomial = get_engine('numpy')(choice_model.Design(grenoble_model))
+        parameters = np.append(TestEngine.parameters, [0., 0.])
+        assert engine.log_likelihood(parameters) == pytest.approx(
+            multinomial.log_likelihood(TestEngine.parameters), rel=1.0e-10)
+
+    def test_threads(self, mixed_model, monkeypatch):
+        # Results do not depend on the division of the work
+        serial = self.engine(mixed_model, number_of_draws=50, threads=1)
+        expected = serial.log_likelihood_and_gradient(self.parameters)
+        monkeypatch.setattr(choice_model.engine, '_CHUNK_ELEMENTS', 5000)
+        parallel = self.engine(mixed_model, number_of_draws=50, threads=2)
+        log_likelihood, gradient = parallel.log_likelihood_and_gradient(
+            self.parameters)
+        assert log_likelihood == pytest.approx(expected[0], rel=1.0e-12)
+        assert gradient == pytest.approx(expected[1], rel=1.0e-10)
+
+    def test_weights(self, mixed_model):
+        weights = observation_weights(mixed_model)
+        engine = self.engine(mixed_model, number_of_draws=20)
+        weighted = self.engine(mixed_model, number_of_draws=20,
+                               weights=weights)
+        doubled = self.engine(mixed_model, number_of_draws=20,
+                              weights=np.full(len(weights), 2.))
+        expected = engine.log_likelihood_and_gradient(self.parameters)
+        log_likelihood, gradient = doubled.log_likelihood_and_gradient(
+            self.parameters)
+        assert log_likelihood == pytest.approx(2*expected[0], rel=1.0e-10)
+        assert gradient == pytest.approx(2*expected[1], rel=1.0e-8)
+
+        _, gradient = weighted.log_likelihood_and_gradient(self.parameters)
+        step = 1.0e-6
+        numerical = np.array([
+            (weighted.log_likelihood(self.parameters + step*unit)
+             - weighted.log_likelihood(self.parameters - step*unit))
+            / (2*step) for unit in np.eye(len(self.parameters))
+            ])
+        assert gradient == pytest.approx(numerical, rel=1.0e-4, abs=1.0e-3)
+
+    def test_sobol(self, mixed_model):
+        halton = self.engine(mixed_model, number_of_draws=200)
+        sobol = self.engine(mixed_model, number_of_draws=200, draws='sobol')
+        assert sobol.log_likelihood(self.parameters) == pytest.approx(
+            halton.log_likelihood(self.parameters), rel=1.0e-2)
+
+    def test_estimation(self, mixed_estimation, grenoble_estimation):
+        estimation = mixed_estimation
+        assert (estimation.final_log_likelihood()
+                > grenoble_estimation.final_log_likelihood())
+        assert estimation.null_log_likelihood() == pytest.approx(
+            grenoble_estimation.null_log_likelihood())
+        assert set(estimation.standard_errors()) == set(
+            estimation.parameter_names)
+
+    def test_probabilities(self, mixed_estimation, mixed_model):
+        probabilities = mixed_estimation.probabilities(
+            mixed_model.data.iloc[:20])
+        assert probabilities.shape == (20, 5)
+        assert probabilities.sum(axis=1).to_numpy() == pytest.approx(1.0)
+
+    @pytest.mark.parametrize('options', [
+        {'engine': 'numba'},
+        {'layout': 'ragged'}
+        ])
+    def test_unsupported(self, mixed_model, options):
+        with pytest.raises(ValueError):
+            choice_model.NativeInterface(mixed_model, **options)
+
+    def test_default_engine(self, mixed_model):
+        interface = choice_model.NativeInterface(mixed_model, engine=None,
+                                                 number_of_draws=10)
+        assert isinstance(interface.engine,
+                          choice_model.engine.MixedLogitEngine)
+
+
+@pytest.fixture(scope='module')
+def nested_model(main_data_dir):
+    with open(main_data_dir+'grenoble_nested.yml') as model_file,\
+            open(main_data_dir+'grenoble.csv') as data_file:
+        model = choice_model.NestedLogit.from_yaml(model_file)
+        model.load_data(data_file)
+    return model
+
+
+@pytest.fixture(scope='module')
+def nested_estimation(nested_model):
+    interface = choice_model.NativeInterface(nested_model)
+    interface.estimate()
+    return interface
+
+
+class TestNestedLogit():
+    parameters = np.append(TestEngine.parameters, [0.7, 0.5])
+
+    def engine(self, model, weights=None):
+        return choice_model.engine.NestedLogitEngine(
+            choice_model.Design(model), model.nests, weights)
+
+    def test_parameter_names(self, nested_model):
+        engine = self.engine(nested_model)
+        assert engine.parameter_names[-2:] == ['lambda_motorised',
+                                               'lambda_active']
+
+    def test_gradient(self, nested_model):
+        engine = self.engine(nested_model)
+        _, gradient = engine.log_likelihood_and_gradient(self.parameters)
+        step = 1.0e-6
+        numerical = np.array([
+            (engine.log_likelihood(self.parameters + step*unit)
+             - engine.log_likelihood(self.parameters - step*unit)) / (2*step)
+            for unit in np.eye(len(self.parameters))
+            ])
+        assert gradient == pytest.approx(numerical, rel=1.0e-4, abs=1.0e-3)
+
+    def test_weights(self, nested_model):
+        weights = observation_weights(nested_model)
+        engine = self.engine(nested_model)
+        weighted = self.engine(nested_model, weights)
+        doubled = self.engine(nested_model, np.full(len(weights), 2.))
+        expected = engine.log_likelihood_and_gradient(self.parameters)
+        log_likelihood, gradient = doubled.log_likelihood_and_gradient(
+            self.parameters)
+        assert log_likelihood == pytest.approx(2*expected[0], rel=1.0e-10)
+        assert gradient == pytest.approx(2*expected[1], rel=1.0e-8)
+
+        _, gradient = weighted.log_likelihood_and_gradient(self.parameters)
+        step = 1.0e-6
+        numerical = np.array([
+            (weighted.log_likelihood(self.parameters + step*unit)
+             - weighted.log_likelihood(self.parameters - step*unit))
+            / (2*step) for unit in np.eye(len(self.parameters))
+            ])
+        assert gradient == pytest.approx(numerical, rel=1.0e-4, abs=1.0e-3)
+
+    def test_unit_logsum_parameters(self, nested_model, grenoble_model):
+        # With logsum parameters of one the model is multinomial logit
+        engine = self.engine(nested_model)
+        multinomial = get_engine('numpy')(choice_model.Design(grenoble_model))
+        parameters = np.append(TestEngine.parameters, [1., 1.])
+        assert engine.log_likelihood(parameters) == pytest.approx(
+            multinomial.log_likelihood(TestEngine.parameters), rel=1.0e-10)
+        assert engine.probabilities(parameters) == pytest.approx(
+            multinomial.probabilities(TestEngine.parameters))
+
+    def test_probabilities(self, nested_model):
+        engine = self.engine(nested_model)
+        probabilities = engine.probabilities(self.parameters)
+        assert probabilities.sum(axis=1) == pytest.approx(1.0)
+        design = engine.design
+        chosen = probabilities[np.arange(len(design.choices)),
+                               design.choices]
+        assert engine.log_likelihood(self.parameters) == pytest.approx(
+            np.log(chosen).sum())
+
+    def test_estimation(self, nested_estimation, grenoble_estimation):
+        estimation = nested_estimation
+        assert (estimation.final_log_likelihood()
+                > grenoble_estimation.final_log_likelihood())
+        assert set(estimation.standard_errors()) == set(
+            estimation.parameter_names)
+
+    @pytest.mark.parametrize('options', [
+        {'engine': 'numba'},
+        {'layout': 'ragged'}
+        ])
+    def test_unsupported(self, nested_model, options):
+        with pytest.raises(ValueError):
+            choice_model.NativeInterface(nested_model, **options)
+
+    def test_default_engine(self, nested_model):
+        interface = choice_model.NativeInterface(nested_model, engine=None)
+        assert isinstance(interface.engine,
+                          choice_model.engine.NestedLogitEngine)
+
+
+@pytest.fixture(scope='module')
+def latent_class_model(main_data_dir):
+    with open(main_data_dir+'grenoble_latent.yml') as model_file,\
+            open(main_data_dir+'grenoble.csv') as data_file:
+        model = choice_model.LatentClassLogit.from_yaml(model_file)
+        model.load_data(data_file)
+    return model
+
+
+@pytest.fixture(scope='module')
+def latent_class_estimation(latent_class_model):
+    interface = choice_model.NativeInterface(latent_class_model, restarts=2)
+    interface.estimate()
+    return interface
+
+
+class TestLatentClassLogit():
+    # Parameters of each class followed by the membership parameters
+    parameters = np.concatenate([TestEngine.parameters,
+                                 0.8*TestEngine.parameters, [0.3, -0.5]])
+
+    def engine(self, model, configuration=('numpy', 'dense'), weights=None):
+        interface = choice_model.NativeInterface(
+            model, engine=configuration[0], layout=configuration[1],
+            weights=weights)
+        return interface.engine
+
+    def test_parameter_names(self, latent_class_model):
+        engine = self.engine(latent_class_model)
+        assert engine.parameter_names[:2] == ['cpt_habitual',
+                                              'ccycle_habitual']
+        assert engine.parameter_names[15] == 'cpt_flexible'
+        assert engine.parameter_names[-2:] == ['share_flexible',
+                                               'share_flexible_female']
+
+    @pytest.mark.parametrize('configuration', configurations)
+    def test_gradient(self, latent_class_model, configuration):
+        engine = self.engine(latent_class_model, configuration,
+                             observation_weights(latent_class_model))
+        _, gradient = engine.log_likelihood_and_gradient(self.parameters)
+        step = 1.0e-6
+        numerical = np.array([
+            (engine.log_likelihood(self.parameters + step*unit)
+             - engine.log_likelihood(self.parameters - step*unit)) / (2*step)
+            for unit in np.eye(len(self.parameters))
+            ])
+        assert gradient == pytest.approx(numerical, rel=1.0e-4, abs=1.0e-3)
+
+    def test_identical_classes(self, latent_class_model, grenoble_model):
+        # With the same parameters in every class the model is multinomial
+        # logit, whatever the class shares
+        engine = self.engine(latent_class_model)
+        multinomial = get_engine('numpy')(choice_model.Design(grenoble_model))
+        parameters = np.concatenate([TestEngine.parameters,
+                                     TestEngine.parameters, [0.3, -0.5]])
+        assert engine.log_likelihood(parameters) == pytest.approx(
+            multinomial.log_likelihood(TestEngine.parameters), rel=1.0e-10)
+        assert engine.probabilities(parameters) == pytest.approx(
+            multinomial.probabilities(TestEngine.parameters))
+
+    def test_probabilities(self, latent_class_model):
+        engine = self.engine(latent_class_model)
+        assert engine.probabilities(self.parameters).sum(
+            axis=1) == pytest.approx(1.0)
+        posteriors = engine.posteriors(self.parameters)
+        assert posteriors.shape == (len(latent_class_model.data), 2)
+        assert posteriors.sum(axis=1) == pytest.approx(1.0)
+
+    def test_expectation_maximisation(self, latent_class_model):
+        # Each iteration increases the log likelihood
+        engine = self.engine(latent_class_model)
+        initial = engine.initial_parameters(seed=1)
+        parameters, log_likelihood = engine.expectation_maximisation(
+            initial, maximum_iterations=5)
+        assert log_likelihood == pytest.approx(
+            engine.log_likelihood(parameters))
+        assert log_likelihood > engine.log_likelihood(initial)
+
+    def test_estimation(self, latent_class_estimation, grenoble_estimation):
+        estimation = latent_class_estimation
+        assert (estimation.final_log_likelihood()
+                > grenoble_estimation.final_log_likelihood())
+        assert estimation.null_log_likelihood() == pytest.approx(
+            grenoble_estimation.null_log_likelihood())
+        assert estimation.final_log_likelihood() == pytest.approx(
+            max(estimation.restart_log_likelihoods))
+        assert len(estimation.restart_log_likelihoods) == 2
+        assert set(estimation.standard_errors()) == set(
+            estimation.parameter_names)
+
+    def test_class_probabilities(self, latent_class_estimation,
+                                 latent_class_model):
+        data = latent_class_model.data.iloc[:20]
+        for posterior in (True, False):
+            probabilities = latent_class_estimation.class_probabilities(
+                data, posterior=posterior)
+            assert list(probabilities.columns) == ['habitual', 'flexible']
+            assert probabilities.sum(axis=1).to_numpy() == pytest.approx(1.0)
+
+    def test_class_probabilities_model(self, grenoble_estimation):
+        with pytest.raises(TypeError):
+            grenoble_estimation.class_probabilities()
+
+
+def test_weight_column(grenoble_model):
+    data = grenoble_model.data
+    data['weight'] = 2.
+    try:
+        interface = choice_model.NativeInterface(grenoble_model,
+                                                 weights='weight')
+    finally:
+        del data['weight']
+    assert interface.engine.weights == pytest.approx(2.)
+
+
+@pytest.fixture(scope='module')
+def synthetic_estimation():
+    model = choice_model.synthetic_model(
+        title='Synthetic', number_of_alternatives=40, number_of_variables=2)
+    model.data = choice_model.synthetic_data(model, 5000)
+    interface = choice_model.NativeInterface(model, engine='numpy',
+                                             layout='ragged')
+    interface.estimate('newton')
+    return interface
+
+
+class TestSampling():
+    def sampled_model(self, model, sampling):
+        sampled = choice_model.MultinomialLogit.from_dict(
+            dict(model.to_dict(), sampling=sampling))
+        sampled.data = model.data
+        return sampled
+
+    def test_estimates(self, synthetic_estimation):
+        model = self.sampled_model(synthetic_estimation.model,
+                                   {'alternatives': 10})
+        interface = choice_model.NativeInterface(model)
+        interface.estimate('newton')
+        assert isinstance(interface.design, choice_model.SampledDesign)
+        assert interface.design.number_of_pairs < (
+            synthetic_estimation.design.number_of_pairs / 3)
+
+        # Coefficients agree within a few standard errors of the full model
+        errors = synthetic_estimation.standard_errors()
+        for parameter in model.parameters:
+            assert abs(interface.parameters()[parameter]
+                       - synthetic_estimation.parameters()[parameter]) < (
+                           4 * errors[parameter])
+
+        # The null log likelihood is that of the full model
+        assert interface.null_log_likelihood() == pytest.approx(
+            synthetic_estimation.null_log_likelihood(), rel=1.0e-12)
+        assert interface.null_log_likelihood() == pytest.approx(
+            -np.log(np.diff(synthetic_estimation.design.indptr)).sum())
+
+    def test_importance(self, synthetic_estimation):
+        model = synthetic_estimation.model
+        # Weighting by availability gives uniform draws
+        sampled = self.sampled_model(
+            model, {'alternatives': 10, 'importance': model.availability})
+        interface = choice_model.NativeInterface(sampled, seed=3)
+        assert interface.design.sample_probabilities == pytest.approx(
+            1 / np.repeat(np.diff(synthetic_estimation.design.indptr),
+                          np.diff(interface.design.indptr)))
+
+    def test_probabilities(self, grenoble_model, main_data_dir):
+        with open(main_data_dir+'grenoble_sampled.yml') as model_file:
+            model = choice_model.MultinomialLogit.from_yaml(model_file)
+        model.data = grenoble_model.data
+        interface = choice_model.NativeInterface(model)
+        interface.estimate('newton')
+        # Predictions are over all available alternatives
+        probabilities = interface.probabilities()
+        expected = choice_model.RaggedDesign(grenoble_model).availability()
+        assert np.array_equal(probabilities.to_numpy() > 0, expected)
+        assert probabilities.sum(axis=1).to_numpy() == pytest.approx(1.)
+
+    def test_dense_layout(self, grenoble_model, main_data_dir):
+        with open(main_data_dir+'grenoble_sampled.yml') as model_file:
+            model = choice_model.MultinomialLogit.from_yaml(model_file)
+        model.data = grenoble_model.data
+        with pytest.raises(ValueError):
+            choice_model.NativeInterface(model, layout='dense')
+        with pytest.raises(TypeError):
+            choice_model.AlogitInterface(model)
+
+
+class TestAppendData():
+    def model(self, grenoble_model):
+        model = choice_model.MultinomialLogit.from_dict(
+            grenoble_model.to_dict())
+        model.load_data(grenoble_model.data.iloc[:500])
+        return model
+
+    def test_estimate(self, grenoble_model, grenoble_estimation):
+        engine = grenoble_estimation.engine
+        interface = choice_model.NativeInterface(
+            self.model(grenoble_model), engine=engine.name,
+            layout=engine.layout)
+        interface.estimate('newton')
+        cold_iterations = interface.optimization_result.nit
+
+        appended = interface.append_data(grenoble_model.data.iloc[500:])
+        assert len(appended) == len(grenoble_model.data) - 500
+        assert interface.design.number_of_observations == len(
+            grenoble_model.data)
+        with pytest.raises(choice_model.interface.interface.NotEstimated):
+            interface.parameters()
+
+        # The warm start takes fewer iterations to the same optimum
+        interface.estimate('newton')
+        assert interface.optimization_result.nit < cold_iterations
+        assert interface.final_log_likelihood() == pytest.approx(
+            grenoble_estimation.final_log_likelihood(), rel=1.0e-8)
+
+    def test_weight_column(self, grenoble_model):
+        model = self.model(grenoble_model)
+        model.data = model.data.assign(weight=2.)
+        interface = choice_model.NativeInterface(model, weights='weight')
+        interface.append_data(grenoble_model.data.iloc[500:].assign(
+            weight=3.))
+        assert interface.engine.weights[:500] == pytest.approx(2.)
+        assert interface.engine.weights[500:] == pytest.approx(3.)
+
+    def test_weight_array(self, grenoble_model):
+        interface = choice_model.NativeInterface(
+            self.model(grenoble_model), weights=np.full(500, 2.))
+        with pytest.raises(ValueError):
+            interface.append_data(grenoble_model.data.iloc[500:])
+        data = grenoble_model.data.iloc[500:]
+        interface.append_data(data, weights=np.ones(len(data)))
+        assert interface.engine.weights.sum() == pytest.approx(
+            1000 + len(data))
+
+    def test_latent_class(self, latent_class_model):
+        model = choice_model.LatentClassLogit.from_dict(
+            latent_class_model.to_dict())
+        model.load_data(latent_class_model.data.iloc[:500])
+        interface = choice_model.NativeInterface(model, restarts=1)
+        interface.estimate()
+        interface.append_data(latent_class_model.data.iloc[500:])
+        interface.estimate()
+        assert interface.restart_log_likelihoods == []
+        assert interface.engine.design.number_of_observations == len(
+            latent_class_model.data)
+
+
+def test_derived_fields(grenoble_model, grenoble_estimation, main_data_dir):
+    # Estimation with fields derived rather than read from the data
+    derived = ['cycle_non_linear', 'walk_non_linear', 'public_transport_cost']
+    with open(main_data_dir+'grenoble_derived.yml') as model_file:
+        model = choice_model.MultinomialLogit.from_yaml(model_file)
+    model.load_data(grenoble_model.data.drop(columns=derived))
+    engine = grenoble_estimation.engine
+    interface = choice_model.NativeInterface(model, engine=engine.name,
+                                             layout=engine.layout)
+    interface.estimate()
+    assert interface.final_log_likelihood() == pytest.approx(
+        grenoble_estimation.final_log_likelihood(), rel=1.0e-8)
+    assert interface.probabilities(
+        grenoble_model.data.drop(columns=derived)).to_numpy() == (
+        pytest.approx(grenoble_estimation.probabilities().to_numpy()))
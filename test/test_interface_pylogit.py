@@ -62,6 +62,19 @@ class TestPylogitLongData():
             assert 0
 
 
+class TestPylogitAppendData():
+    def test_long_data(self, simple_multinomial_model_with_data):
+        model = choice_model.MultinomialLogit.from_dict(
+            simple_multinomial_model_with_data.to_dict())
+        model.load_data(simple_multinomial_model_with_data.data.copy())
+        interface = choice_model.PylogitInterface(model)
+        interface.append_data(simple_multinomial_model_with_data.data)
+        long_data = interface.long_data
+        assert len(long_data) == 8
+        assert list(long_data['observation_id']) == [1, 1, 2, 2, 3, 3, 4, 4]
+        assert list(long_data['var1'][4:]) == [1, 1, 5, 5]
+
+
 class TestPylogitSpecification():
     def test_intercepts(self, simple_multinomial_pylogit_interface):
         interface = simple_multinomial_pylogit_interface
@@ -249,3 +262,23 @@ class TestPylogitRequiresEstimation():
         interface = simple_multinomial_pylogit_interface
         with pytest.raises(choice_model.interface.interface.NotEstimated):
             getattr(interface, method)()
+
+
+class TestPylogitGrenobleAppendData():
+    def test_estimation(self, grenoble_estimation):
+        # Estimating after appending observations matches estimating on all
+        # of the data
+        data = grenoble_estimation.model.data
+        model = choice_model.MultinomialLogit.from_dict(
+            grenoble_estimation.model.to_dict())
+        model.load_data(data.iloc[:500].copy())
+        interface = choice_model.PylogitInterface(model)
+        interface.estimate()
+        interface.append_data(data.iloc[500:].copy())
+        interface.estimate()
+
+        assert interface.final_log_likelihood() == pytest.approx(
+            grenoble_estimation.final_log_likelihood(), rel=1.0e-6)
+        expected = grenoble_estimation.parameters()
+        for parameter, value in interface.parameters().items():
+            assert value == pytest.approx(expected[parameter], rel=1.0e-3)
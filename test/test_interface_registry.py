@@ -0,0 +1,141 @@
+import choice_model
+from choice_model.interface import registry
+from choice_model.interface.interface import Capabilities
+import importlib.metadata
+import pytest
+
+
+class FastInterface(choice_model.Interface):
+    capabilities = Capabilities(models=[choice_model.MultinomialLogit],
+                                weights=True, parallel=True, prediction=True)
+    name = 'fast'
+    priority = 100
+
+
+class SelectableEntryPoints(object):
+    """
+    Entry points as returned by importlib.metadata.entry_points from Python
+    3.10
+    """
+    def __init__(self, entry_points):
+        self.entry_points = entry_points
+
+    def select(self, group):
+        return [entry_point for entry_point in self.entry_points
+                if entry_point.group == group]
+
+
+class TestRegistry():
+    @pytest.mark.parametrize('name', ['pylogit', 'alogit'])
+    def test_builtin_interfaces(self, name):
+        assert name in choice_model.available_interfaces()
+
+    def test_get_interface(self):
+        assert (choice_model.get_interface('alogit')
+                is choice_model.AlogitInterface)
+
+    def test_unknown_interface(self):
+        with pytest.raises(registry.UnknownInterface):
+            choice_model.get_interface('not_an_interface')
+
+    def test_unavailable_interface(self, monkeypatch):
+        monkeypatch.setitem(registry._registry, 'missing',
+                            'not_a_module:Interface')
+        with pytest.raises(registry.InterfaceUnavailable):
+            choice_model.get_interface('missing')
+
+    def test_register_lazily(self, monkeypatch):
+        monkeypatch.setitem(registry._registry, 'lazy',
+                            'test_interface_registry:FastInterface')
+        assert choice_model.get_interface('lazy').name == 'fast'
+
+    def test_best_interface(self, monkeypatch, simple_multinomial_model):
+        monkeypatch.setitem(registry._registry, 'fast', FastInterface)
+        assert (choice_model.best_interface(simple_multinomial_model)
+                is FastInterface)
+
+    def test_best_interface_requirements(self, monkeypatch,
+                                         simple_multinomial_model):
+        assert choice_model.best_interface(
+            simple_multinomial_model, weights=True) is (
+                choice_model.NativeInterface)
+        monkeypatch.delitem(registry._registry, 'native')
+        with pytest.raises(registry.NoSuitableInterface):
+            choice_model.best_interface(simple_multinomial_model,
+                                        weights=True)
+
+    def test_unknown_requirement(self, simple_multinomial_model):
+        with pytest.raises(ValueError, match='prediction'):
+            choice_model.best_interface(simple_multinomial_model,
+                                        weigths=True)
+
+    @pytest.mark.parametrize('selectable', [True, False])
+    def test_entry_points(self, monkeypatch, selectable):
+        group = registry.ENTRY_POINT_GROUP
+        declared = [
+            importlib.metadata.EntryPoint(
+                'fast', 'test_interface_registry:FastInterface', group),
+            importlib.metadata.EntryPoint(
+                'native', 'test_interface_registry:FastInterface', group),
+            importlib.metadata.EntryPoint(
+                'other', 'test_interface_registry:FastInterface', 'other')
+            ]
+
+        def entry_points():
+            if selectable:
+                return SelectableEntryPoints(declared)
+            # Python < 3.10 returns a dictionary of groups
+            return {group: [entry_point for entry_point in declared
+                            if entry_point.group == group]}
+
+        monkeypatch.setattr(importlib.metadata, 'entry_points', entry_points)
+        monkeypatch.setattr(registry, '_registry', dict(registry._registry))
+        monkeypatch.setattr(registry, '_entry_points_loaded', False)
+        names = choice_model.available_interfaces()
+        assert 'fast' in names
+        assert 'other' not in names
+        assert choice_model.get_interface('fast') is FastInterface
+        # Entry points do not replace registered interfaces
+        assert (choice_model.get_interface('native')
+                is choice_model.NativeInterface)
+
+    def test_no_suitable_interface(self, simple_model):
+        with pytest.raises(registry.NoSuitableInterface):
+            choice_model.best_interface(simple_model)
+
+
+class TestCapabilities():
+    def test_supports(self, simple_multinomial_model):
+        assert choice_model.AlogitInterface.supports(simple_multinomial_model)
+
+    def test_does_not_support(self, simple_model):
+        assert not choice_model.AlogitInterface.supports(simple_model)
+
+    def test_mixed_logit(self, main_data_dir):
+        with open(main_data_dir+'grenoble_mixed.yml') as model_file:
+            model = choice_model.MixedLogit.from_yaml(model_file)
+        assert not choice_model.AlogitInterface.supports(model)
+        assert choice_model.best_interface(model) is (
+            choice_model.NativeInterface)
+
+    def test_nested_logit(self, main_data_dir):
+        with open(main_data_dir+'grenoble_nested.yml') as model_file:
+            model = choice_model.NestedLogit.from_yaml(model_file)
+        assert choice_model.AlogitInterface.supports(model)
+        assert choice_model.best_interface(model) is (
+            choice_model.NativeInterface)
+
+    def test_latent_class_logit(self, main_data_dir):
+        with open(main_data_dir+'grenoble_latent.yml') as model_file:
+            model = choice_model.LatentClassLogit.from_yaml(model_file)
+        assert not choice_model.AlogitInterface.supports(model)
+        assert choice_model.best_interface(model) is (
+            choice_model.NativeInterface)
+
+    def test_sampling(self, main_data_dir):
+        with open(main_data_dir+'grenoble_sampled.yml') as model_file:
+            model = choice_model.MultinomialLogit.from_yaml(model_file)
+        assert not choice_model.AlogitInterface.supports(model)
+        assert choice_model.NativeInterface.supports(model)
+        assert choice_model.best_interface(model) is (
+            choice_model.NativeInterface)
@@ -0,0 +1,100 @@
+import choice_model
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope='module')
+def simple_kernel(simple_multinomial_model):
+    return choice_model.UtilityKernel(simple_multinomial_model)
+
+
+@pytest.fixture(scope='module')
+def simple_parameters():
+    return {'cchoice1': 0.5, 'p1': 1.0, 'p2': -2.0, 'p3': 3.0}
+
+
+class TestUtilityKernel():
+    def test_parameter_names(self, simple_kernel):
+        assert simple_kernel.parameter_names == ['cchoice1', 'p1', 'p2', 'p3']
+
+    def test_fields(self, simple_kernel):
+        assert simple_kernel.fields == ['var1', 'choice1_var3', 'var2',
+                                        'choice2_var3']
+
+    def test_coefficients(self, simple_kernel, simple_parameters):
+        parameters = simple_kernel.parameter_vector(simple_parameters)
+        assert np.all(simple_kernel.coefficients(parameters) == np.array(
+            [[1.0, 0.0],
+             [3.0, 0.0],
+             [0.0, -2.0],
+             [0.0, 3.0]]
+            ))
+
+    def test_utilities(self, simple_kernel, simple_parameters,
+                       simple_multinomial_model_with_data):
+        data = simple_kernel.data_matrix(
+            simple_multinomial_model_with_data.data)
+        parameters = simple_kernel.parameter_vector(simple_parameters)
+        # choice1: 0.5 + var1 + 3*choice1_var3
+        # choice2: -2*var2 + 3*choice2_var3
+        assert np.all(simple_kernel.utilities(data, parameters) == np.array(
+            [[0.5 + 1 + 9, -4 + 12],
+             [0.5 + 5 + 21, -12 + 24]]
+            ))
+
+    def test_gradient(self, simple_kernel, simple_parameters,
+                      simple_multinomial_model_with_data):
+        # The gradient of the sum of weighted utilities is the weighted sum
+        # of each parameter's variable
+        data = simple_kernel.data_matrix(
+            simple_multinomial_model_with_data.data)
+        weights = np.array([[1.0, 2.0], [3.0, 4.0]])
+        gradient = simple_kernel.gradient(data, weights)
+        assert np.all(gradient == np.array(
+            [1 + 3,
+             1*1 + 5*3,
+             2*2 + 6*4,
+             3*1 + 4*2 + 7*3 + 8*4]
+            ))
+
+    def test_shared_field(self):
+        # Terms with the same field share a column of the data matrix
+        model = choice_model.MultinomialLogit.from_terms(
+            title='Shared', alternatives=['a', 'b'], choice_column='choice',
+            availability={'a': 'avail_a', 'b': 'avail_b'},
+            alternative_independent_variables=[],
+            alternative_dependent_variables={'time': {'a': 'time',
+                                                      'b': 'time'}},
+            intercepts={'a': 'ca'}, parameters=['ptime'],
+            terms={'a': [('time', 'ptime')], 'b': [('time', 'ptime')]}
+            )
+        kernel = choice_model.UtilityKernel(model)
+        assert kernel.fields == ['time']
+
+    def test_mask_unavailable(self, simple_kernel):
+        # Only missing values of fields used by no available alternative are
+        # masked
+        data = np.array([[np.nan, np.inf, 1.0, 2.0],
+                         [1.0, 2.0, np.nan, 4.0]])
+        availability = np.array([[False, True],
+                                 [True, True]])
+        masked = simple_kernel.mask_unavailable(data, availability)
+        assert np.array_equal(masked, np.array([[0.0, 0.0, 1.0, 2.0],
+                                                [1.0, 2.0, np.nan, 4.0]]),
+                              equal_nan=True)
+        assert np.isnan(data[0, 0])
+
+        finite = np.ones((2, 4))
+        assert simple_kernel.mask_unavailable(finite, availability) is finite
+
+    def test_to_dict(self, simple_kernel, simple_parameters,
+                     simple_multinomial_model_with_data):
+        kernel = choice_model.UtilityKernel.from_dict(simple_kernel.to_dict())
+        assert kernel.parameter_names == simple_kernel.parameter_names
+        assert kernel.fields == simple_kernel.fields
+        assert np.all(kernel.term_pointer == simple_kernel.term_pointer)
+
+        data = kernel.data_matrix(simple_multinomial_model_with_data.data)
+        parameters = kernel.parameter_vector(simple_parameters)
+        assert np.all(kernel.utilities(data, parameters)
+                      == simple_kernel.utilities(data, parameters))
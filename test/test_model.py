@@ -1,4 +1,5 @@
 import choice_model
+import numpy as np
 import pandas as pd
 import pytest
 
@@ -77,6 +78,16 @@ def test_missing_field(data_dir):
             model.load_data(data_file)
 
 
+def test_shared_fields(main_data_dir):
+    # car and passenger share the car_time field
+    with open(main_data_dir+'grenoble.yml') as model_file:
+        model = choice_model.MultinomialLogit.from_yaml(model_file)
+    fields = model.alternative_dependent_variable_fields()
+    assert fields.count('car_time') == 1
+    assert len(model.all_variable_fields()) == len(
+        set(model.all_variable_fields()))
+
+
 class TestData():
     def test_type_error(self, simple_model):
         with pytest.raises(TypeError):
@@ -92,6 +103,46 @@ class TestData():
         simple_model.load_data(data)
 
 
+class TestAppendData():
+    @pytest.fixture
+    def model(self, data_dir):
+        with open(data_dir+'simple_model.yml', 'r') as yaml_file,\
+                open(data_dir+'simple.csv', 'r') as data_file:
+            model = choice_model.MultinomialLogit.from_yaml(yaml_file)
+            model.load_data(data_file)
+        return model
+
+    def test_csv_file(self, model, data_dir):
+        with open(data_dir+'simple.csv', 'r') as data_file:
+            appended = model.append_data(data_file)
+        assert list(appended.index) == [2, 3]
+        assert len(model.data) == 4
+        assert list(model.data['var1']) == [1, 5, 1, 5]
+        assert list(model.data.index) == [0, 1, 2, 3]
+
+    def test_dataframe(self, model):
+        data = model.data.copy()
+        model.append_data(data)
+        assert list(model.data.index) == [0, 1, 2, 3]
+        assert list(data.index) == [0, 1]
+
+    def test_no_data(self, simple_multinomial_model_with_data):
+        model = choice_model.MultinomialLogit.from_dict(
+            simple_multinomial_model_with_data.to_dict())
+        model.append_data(simple_multinomial_model_with_data.data)
+        assert model.data.equals(simple_multinomial_model_with_data.data)
+
+    def test_missing_field(self, model):
+        data = model.data.drop(columns='var1')
+        with pytest.raises(choice_model.model.MissingField):
+            model.append_data(data)
+        assert len(model.data) == 2
+
+    def test_type_error(self, model):
+        with pytest.raises(TypeError):
+            model.append_data(5)
+
+
 class TestMultinomialLogit():
     utility_string1 = 'cchoice1 + p1* var1 + p3*var3'
     utility_string2 = 'p2* var2 + p3*var3'
@@ -110,3 +161,434 @@ class TestMultinomialLogit():
                            alternative, utility):
         model = simple_multinomial_model
         assert model.specification[alternative] == utility
+
+
+@pytest.fixture(scope='module')
+def compiled_model(simple_multinomial_model, tmp_path_factory):
+    path = tmp_path_factory.mktemp('compiled') / 'simple_model.json'
+    with open(path, 'w') as json_file:
+        simple_multinomial_model.to_json(json_file)
+    with open(path, 'r') as json_file:
+        return choice_model.MultinomialLogit.from_json(json_file)
+
+
+class TestCompiledModel():
+    @pytest.mark.parametrize('alternative', ['choice1', 'choice2'])
+    def test_specification(self, simple_multinomial_model, compiled_model,
+                           alternative):
+        assert (compiled_model.specification[alternative]
+                == simple_multinomial_model.specification[alternative])
+
+    def test_definition(self, simple_multinomial_model, compiled_model):
+        assert compiled_model.to_dict() == simple_multinomial_model.to_dict()
+
+    def test_choice_model(self, simple_model):
+        model = choice_model.ChoiceModel.from_dict(simple_model.to_dict())
+        assert model.to_dict() == simple_model.to_dict()
+
+    def test_cache(self, data_dir, tmp_path):
+        cache_path = str(tmp_path / 'simple_model.json')
+        model = choice_model.MultinomialLogit.from_yaml_file(
+            data_dir+'simple_model.yml', cache_path)
+        assert (tmp_path / 'simple_model.json').exists()
+        cached_model = choice_model.MultinomialLogit.from_yaml_file(
+            data_dir+'simple_model.yml', cache_path)
+        assert cached_model.to_dict() == model.to_dict()
+
+
+class TestBuilder():
+    definition = dict(
+        title='Simple model',
+        alternatives=['choice1', 'choice2'],
+        choice_column='alternative',
+        availability={'choice1': 'avail_choice1', 'choice2': 'avail_choice2'},
+        alternative_independent_variables=['var1', 'var2'],
+        alternative_dependent_variables={
+            'var3': {'choice1': 'choice1_var3', 'choice2': 'choice2_var3'}},
+        intercepts={'choice1': 'cchoice1'},
+        parameters=['p1', 'p2', 'p3']
+        )
+
+    def test_from_terms(self, simple_multinomial_model):
+        model = choice_model.MultinomialLogit.from_terms(
+            **self.definition,
+            terms={'choice1': [('var1', 'p1'), ('var3', 'p3')],
+                   'choice2': [('var2', 'p2'), ('var3', 'p3')]}
+            )
+        assert model.to_dict() == simple_multinomial_model.to_dict()
+
+    @pytest.mark.parametrize('terms,exception', [
+        ([('var1', 'p1'), ('var4', 'p3')],
+         choice_model.utility.InvalidTermContents),
+        ([('var1', 'p1'), ('var1', 'p3')],
+         choice_model.utility.DuplicateVariables),
+        ([('var1', 'p1'), ('var3', 'p1')],
+         choice_model.utility.DuplicateParameters)
+        ])
+    def test_from_terms_invalid(self, terms, exception):
+        with pytest.raises(exception):
+            choice_model.MultinomialLogit.from_terms(
+                **self.definition,
+                terms={'choice1': terms, 'choice2': []}
+                )
+
+    def test_from_parameter_matrix(self, simple_multinomial_model):
+        model = choice_model.MultinomialLogit.from_parameter_matrix(
+            **self.definition,
+            parameter_index=[[0, -1, 2],
+                             [-1, 1, 2]]
+            )
+        assert model.to_dict() == simple_multinomial_model.to_dict()
+
+    @pytest.mark.parametrize('parameter_index,exception', [
+        ([[0, -1, 2]], ValueError),
+        ([[0, -1, 3], [-1, 1, 2]], ValueError),
+        ([[0, -1, 0], [-1, 1, 2]], choice_model.utility.DuplicateParameters)
+        ])
+    def test_from_parameter_matrix_invalid(self, parameter_index, exception):
+        with pytest.raises(exception):
+            choice_model.MultinomialLogit.from_parameter_matrix(
+                **self.definition,
+                parameter_index=parameter_index
+                )
+
+
+@pytest.fixture(scope='module')
+def mixed_model(main_data_dir):
+    with open(main_data_dir+'grenoble_mixed.yml') as model_file:
+        return choice_model.MixedLogit.from_yaml(model_file)
+
+
+class TestMixedLogit():
+    def test_random_parameters(self, mixed_model):
+        assert mixed_model.random_parameters == {
+            'pcar_competition': 'sigma_car_competition',
+            'ccycle': 'sigma_cycle'}
+        assert mixed_model.standard_deviations() == [
+            'sigma_car_competition', 'sigma_cycle']
+
+    def test_number_of_parameters(self, mixed_model):
+        assert mixed_model.number_of_parameters() == 17
+        assert mixed_model.number_of_parameters(
+            include_intercepts=False) == 13
+
+    def test_compiled(self, mixed_model):
+        model = choice_model.MixedLogit.from_dict(mixed_model.to_dict())
+        assert model.to_dict() == mixed_model.to_dict()
+
+    @pytest.mark.parametrize('random_parameters,exception', [
+        ({'pmissing': 'sigma'}, choice_model.model.UndefinedRandomParameter),
+        ({'ptime': 'pcost'}, choice_model.utility.DuplicateParameters),
+        ({'ptime': 'sigma', 'pcost': 'sigma'},
+         choice_model.utility.DuplicateParameters)
+        ])
+    def test_invalid(self, mixed_model, random_parameters, exception):
+        model_dict = mixed_model.to_dict()
+        model_dict['random_parameters'] = random_parameters
+        with pytest.raises(exception):
+            choice_model.MixedLogit.from_dict(model_dict)
+
+
+@pytest.fixture(scope='module')
+def nested_model(main_data_dir):
+    with open(main_data_dir+'grenoble_nested.yml') as model_file:
+        return choice_model.NestedLogit.from_yaml(model_file)
+
+
+class TestNestedLogit():
+    def test_nests(self, nested_model):
+        assert nested_model.nests == {
+            'motorised': {'alternatives': ['car', 'passenger'],
+                          'parameter': 'lambda_motorised'},
+            'active': {'alternatives': ['cycle', 'walk'],
+                       'parameter': 'lambda_active'}
+            }
+        assert nested_model.nest_parameters() == [
+            'lambda_motorised', 'lambda_active']
+        assert nested_model.unnested_alternatives() == ['public_transport']
+
+    def test_number_of_parameters(self, nested_model):
+        assert nested_model.number_of_parameters() == 17
+        assert nested_model.number_of_parameters(
+            include_intercepts=False) == 13
+
+    def test_compiled(self, nested_model):
+        model = choice_model.NestedLogit.from_dict(nested_model.to_dict())
+        assert model.to_dict() == nested_model.to_dict()
+
+    @pytest.mark.parametrize('nest,definition,exception', [
+        ('extra', {'alternatives': ['missing'], 'parameter': 'lambda_extra'},
+         choice_model.model.InvalidNest),
+        ('extra', {'alternatives': ['car'], 'parameter': 'lambda_extra'},
+         choice_model.model.InvalidNest),
+        ('extra', {'alternatives': [], 'parameter': 'lambda_extra'},
+         choice_model.model.InvalidNest),
+        ('car', {'alternatives': ['public_transport'],
+                 'parameter': 'lambda_extra'},
+         choice_model.model.InvalidNest),
+        ('extra', {'alternatives': ['public_transport'],
+                   'parameter': 'ptime'},
+         choice_model.utility.DuplicateParameters),
+        ('extra', {'alternatives': ['public_transport'],
+                   'parameter': 'lambda_active'},
+         choice_model.utility.DuplicateParameters),
+        ('extra', {'alternatives': ['public_transport']},
+         choice_model.model.MissingYamlKey)
+        ])
+    def test_invalid(self, nested_model, nest, definition, exception):
+        model_dict = nested_model.to_dict()
+        model_dict['nests'] = dict(model_dict['nests'], **{nest: definition})
+        with pytest.raises(exception):
+            choice_model.NestedLogit.from_dict(model_dict)
+
+
+@pytest.fixture(scope='module')
+def latent_class_model(main_data_dir):
+    with open(main_data_dir+'grenoble_latent.yml') as model_file:
+        return choice_model.LatentClassLogit.from_yaml(model_file)
+
+
+class TestLatentClassLogit():
+    def test_classes(self, latent_class_model):
+        assert latent_class_model.classes == ['habitual', 'flexible']
+        assert latent_class_model.class_membership_variables == ['female']
+        assert latent_class_model.membership_parameters() == [
+            'share_flexible', 'share_flexible_female']
+        assert latent_class_model.class_parameter(
+            'ptime', 'habitual') == 'ptime_habitual'
+
+    def test_number_of_parameters(self, latent_class_model):
+        assert latent_class_model.number_of_parameters() == 32
+        assert latent_class_model.number_of_parameters(
+            include_intercepts=False) == 24
+
+    def test_compiled(self, latent_class_model):
+        model = choice_model.LatentClassLogit.from_dict(
+            latent_class_model.to_dict())
+        assert model.to_dict() == latent_class_model.to_dict()
+
+    def test_no_membership_variables(self, latent_class_model):
+        model_dict = latent_class_model.to_dict()
+        del model_dict['class_membership_variables']
+        model = choice_model.LatentClassLogit.from_dict(model_dict)
+        assert model.membership_parameters() == ['share_flexible']
+
+    @pytest.mark.parametrize('key,value,exception', [
+        ('classes', ['single'], choice_model.model.InvalidLatentClasses),
+        ('classes', ['a', 'b', 'a'], choice_model.model.InvalidLatentClasses),
+        ('class_membership_variables', ['travel_time'],
+         choice_model.model.InvalidLatentClasses),
+        ('classes', ['a', 'flexible', 'flexible_female'],
+         choice_model.utility.DuplicateParameters)
+        ])
+    def test_invalid(self, latent_class_model, key, value, exception):
+        model_dict = latent_class_model.to_dict()
+        model_dict[key] = value
+        with pytest.raises(exception):
+            choice_model.LatentClassLogit.from_dict(model_dict)
+
+
+@pytest.fixture(scope='module')
+def sampled_model(main_data_dir):
+    with open(main_data_dir+'grenoble_sampled.yml') as model_file:
+        return choice_model.MultinomialLogit.from_yaml(model_file)
+
+
+class TestSampling():
+    def test_sampling(self, sampled_model, simple_multinomial_model):
+        assert sampled_model.sampling == {'alternatives': 3}
+        assert sampled_model.sampling_fields() == []
+        assert simple_multinomial_model.sampling is None
+        assert 'sampling' not in simple_multinomial_model.to_dict()
+
+    def test_compiled(self, sampled_model):
+        model = choice_model.MultinomialLogit.from_dict(
+            sampled_model.to_dict())
+        assert model.to_dict() == sampled_model.to_dict()
+
+    def test_importance_fields(self, sampled_model, main_data_dir):
+        model_dict = sampled_model.to_dict()
+        importance = {alternative: 'size_' + alternative
+                      for alternative in sampled_model.alternatives}
+        model_dict['sampling'] = {'alternatives': 3,
+                                  'importance': importance}
+        model = choice_model.MultinomialLogit.from_dict(model_dict)
+        assert model.sampling_fields() == [
+            'size_' + alternative for alternative in model.alternatives]
+        with open(main_data_dir+'grenoble.csv') as data_file:
+            with pytest.raises(choice_model.model.MissingField):
+                model.load_data(data_file)
+
+    @pytest.mark.parametrize('sampling', [
+        {'alternatives': 0},
+        {'alternatives': 2.5},
+        {'importance': {}},
+        {'alternatives': 3, 'importance': {'car': 'size_car'}}
+        ])
+    def test_invalid(self, sampled_model, sampling):
+        model_dict = sampled_model.to_dict()
+        model_dict['sampling'] = sampling
+        with pytest.raises(choice_model.model.InvalidSampling):
+            choice_model.MultinomialLogit.from_dict(model_dict)
+
+
+@pytest.fixture(scope='module')
+def derived_model(main_data_dir):
+    with open(main_data_dir+'grenoble_derived.yml') as model_file:
+        return choice_model.MultinomialLogit.from_yaml(model_file)
+
+
+@pytest.fixture(scope='module')
+def grenoble_data(main_data_dir):
+    return pd.read_csv(main_data_dir+'grenoble.csv')
+
+
+class TestDerived():
+    derived = ['cycle_non_linear', 'walk_non_linear', 'public_transport_cost']
+
+    def test_fields(self, derived_model):
+        raw_fields = derived_model.raw_fields()
+        assert 'cycle_time' in raw_fields
+        assert not set(self.derived) & set(raw_fields)
+        assert sorted(derived_model.derived_fields()) == sorted(self.derived)
+
+    def test_compiled(self, derived_model):
+        model = choice_model.MultinomialLogit.from_dict(
+            derived_model.to_dict())
+        assert model.derived == derived_model.derived
+
+    def test_materialise(self, derived_model, grenoble_data):
+        model = choice_model.MultinomialLogit.from_dict(
+            derived_model.to_dict())
+        model.load_data(grenoble_data.drop(columns=self.derived))
+        data = model.materialise()
+        pd.testing.assert_frame_equal(
+            data[grenoble_data.columns], grenoble_data, check_dtype=False)
+
+    def test_cache(self, derived_model, grenoble_data, monkeypatch):
+        model = choice_model.MultinomialLogit.from_dict(
+            derived_model.to_dict())
+        model.load_data(grenoble_data.drop(columns=self.derived))
+        model.materialise()
+
+        # Evaluated columns of the loaded data are reused
+        def evaluate(expression, columns):
+            raise AssertionError('{} evaluated again'.format(expression))
+        monkeypatch.setattr(choice_model.preprocess, 'evaluate', evaluate)
+        model.materialise()
+        with pytest.raises(AssertionError):
+            model.materialise(cache=False)
+
+    def test_append_data(self, derived_model, grenoble_data):
+        model = choice_model.MultinomialLogit.from_dict(
+            derived_model.to_dict())
+        data = grenoble_data.drop(columns=self.derived)
+        model.load_data(data.iloc[:500])
+        assert len(model.materialise()) == 500
+        model.append_data(data.iloc[500:])
+        assert model.materialise()['walk_non_linear'].to_list() == (
+            grenoble_data['walk_non_linear'].to_list())
+
+    def test_replaces_field(self, derived_model, grenoble_data):
+        model = choice_model.MultinomialLogit.from_dict(
+            derived_model.to_dict())
+        model.load_data(grenoble_data)
+        data = model.materialise()
+        assert list(data.columns).count('walk_non_linear') == 1
+
+    def test_unused(self, derived_model, grenoble_data):
+        # Unused derived fields are neither required nor evaluated
+        model_dict = derived_model.to_dict()
+        model_dict['derived'] = dict(model_dict['derived'],
+                                     unused='not_a_field * 2')
+        model = choice_model.MultinomialLogit.from_dict(model_dict)
+        model.load_data(grenoble_data)
+        assert 'unused' not in model.materialise().columns
+
+    def test_missing_field(self, derived_model, grenoble_data):
+        # Fields derived fields are evaluated from are required
+        model = choice_model.MultinomialLogit.from_dict(
+            derived_model.to_dict())
+        with pytest.raises(choice_model.model.MissingField,
+                           match='walk_time'):
+            model.load_data(grenoble_data.drop(columns='walk_time'))
+
+    @pytest.mark.parametrize('derived,exception', [
+        ({'cycle_time': 'cycle_time * 2'},
+         choice_model.model.InvalidDerivedField),
+        ({'walk_time': 'cycle_time * 3', 'cycle_time': 'walk_time / 3'},
+         choice_model.model.InvalidDerivedField),
+        ({'walk_time': 'dist.sum()'},
+         choice_model.preprocess.InvalidExpression)
+        ])
+    def test_invalid(self, derived_model, derived, exception):
+        model_dict = derived_model.to_dict()
+        model_dict['derived'] = derived
+        with pytest.raises(exception):
+            choice_model.MultinomialLogit.from_dict(model_dict)
+
+
+class TestSkims():
+    @pytest.fixture
+    def skim_model(self, derived_model, tmp_path):
+        # Travel times from a matrix of three zones numbered 11, 12 and 13
+        matrix = np.arange(9, dtype=float).reshape(3, 3)
+        np.save(tmp_path / 'car_time.npy', matrix)
+        model_dict = derived_model.to_dict()
+        model_dict['derived'] = dict(
+            model_dict['derived'],
+            car_time={'skim': str(tmp_path / 'car_time.npy'),
+                      'origin': 'origin_zone',
+                      'destination': 'destination_zone',
+                      'zones': [11, 12, 13]})
+        return choice_model.MultinomialLogit.from_dict(model_dict)
+
+    @pytest.fixture
+    def zoned_data(self, grenoble_data):
+        data = grenoble_data.drop(columns='car_time').iloc[:6]
+        return data.assign(origin_zone=[11, 12, 13, 13, 12, 11],
+                           destination_zone=[11, 13, 12, 13, 11, 12])
+
+    def test_fields(self, skim_model):
+        raw_fields = skim_model.raw_fields()
+        assert 'car_time' not in raw_fields
+        assert 'origin_zone' in raw_fields
+        assert 'destination_zone' in raw_fields
+
+    def test_lookup(self, skim_model, zoned_data):
+        skim_model.load_data(zoned_data)
+        assert skim_model.materialise()['car_time'].to_list() == [
+            0., 5., 7., 8., 3., 1.]
+        assert isinstance(skim_model.skim_matrix('car_time'), np.memmap)
+
+    def test_indices(self, skim_model, zoned_data):
+        # Without zones the zones are the matrix indices
+        model_dict = skim_model.to_dict()
+        del model_dict['derived']['car_time']['zones']
+        model = choice_model.MultinomialLogit.from_dict(model_dict)
+        data = zoned_data.assign(origin_zone=zoned_data['origin_zone'] - 11,
+                                 destination_zone=(
+                                     zoned_data['destination_zone'] - 11))
+        model.load_data(data)
+        assert model.materialise()['car_time'].to_list() == [
+            0., 5., 7., 8., 3., 1.]
+
+    @pytest.mark.parametrize('zone', [14, 11.5])
+    def test_unknown_zone(self, skim_model, zoned_data, zone):
+        data = zoned_data.copy()
+        data.loc[data.index[2], 'destination_zone'] = zone
+        with pytest.raises(choice_model.model.UnknownZone):
+            skim_model.materialise(data)
+
+    def test_invalid(self, skim_model):
+        model_dict = skim_model.to_dict()
+        del model_dict['derived']['car_time']['origin']
+        with pytest.raises(choice_model.model.InvalidDerivedField):
+            choice_model.MultinomialLogit.from_dict(model_dict)
+
+    def test_zones_shape(self, skim_model, zoned_data):
+        model_dict = skim_model.to_dict()
+        model_dict['derived']['car_time']['zones'] = [11, 12]
+        model = choice_model.MultinomialLogit.from_dict(model_dict)
+        with pytest.raises(choice_model.model.InvalidDerivedField):
+            model.materialise(zoned_data)
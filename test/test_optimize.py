@@ -0,0 +1,170 @@
+import choice_model
+from choice_model.optimize import maximise, stochastic_maximise
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope='module')
+def grenoble_model(main_data_dir):
+    with open(main_data_dir+'grenoble.yml') as model_file,\
+            open(main_data_dir+'grenoble.csv') as data_file:
+        model = choice_model.MultinomialLogit.from_yaml(model_file)
+        model.load_data(data_file)
+    return model
+
+
+@pytest.fixture(scope='module')
+def reference_estimation(grenoble_model):
+    interface = choice_model.NativeInterface(grenoble_model, engine='numpy')
+    interface.estimate('newton')
+    return interface
+
+
+# A concave quadratic log likelihood with its maximum at (1, -2)
+quadratic_hessian = -np.array([[2., 0.5], [0.5, 1.]])
+quadratic_maximum = np.array([1., -2.])
+
+
+def quadratic(parameters):
+    difference = parameters - quadratic_maximum
+    return (0.5 * difference @ quadratic_hessian @ difference,
+            quadratic_hessian @ difference)
+
+
+class TestMaximise():
+    @pytest.mark.parametrize('method', [
+        'newton', 'trust-exact', 'trust-ncg', 'BFGS', 'l-bfgs'])
+    def test_quadratic(self, method):
+        result = maximise(quadratic, np.zeros(2), method,
+                          hessian=lambda parameters: quadratic_hessian)
+        assert result.x == pytest.approx(quadratic_maximum, abs=1.0e-5)
+        assert result.log_likelihood == pytest.approx(0., abs=1.0e-9)
+
+    def test_newton_iterations(self):
+        result = maximise(quadratic, np.zeros(2), 'newton',
+                          hessian=lambda parameters: quadratic_hessian)
+        assert result.success
+        assert result.nit == 1
+        assert result.hess == pytest.approx(quadratic_hessian)
+
+    def test_maximum_iterations(self):
+        result = maximise(quadratic, np.zeros(2), 'bhhh',
+                          score_outer_product=lambda parameters: np.eye(2),
+                          maximum_iterations=1)
+        assert not result.success
+        assert result.nit == 1
+        assert result.hess is None
+
+    @pytest.mark.parametrize('method', ['newton', 'trust-exact', 'bhhh'])
+    def test_missing_function(self, method):
+        with pytest.raises(ValueError):
+            maximise(quadratic, np.zeros(2), method)
+
+
+class TestStochasticMaximise():
+    @pytest.mark.parametrize('engine,layout', [
+        ('numpy', 'dense'), ('numba', 'dense'), ('numpy', 'ragged')])
+    def test_subset(self, grenoble_model, engine, layout):
+        if engine == 'numba':
+            pytest.importorskip('numba')
+        interface = choice_model.NativeInterface(
+            grenoble_model, engine=engine, layout=layout)
+        rows = np.arange(0, len(grenoble_model.data), 3)
+        expected = choice_model.NativeInterface(
+            grenoble_model, engine=engine, layout=layout).engine
+        expected = type(expected)(type(expected.design)(
+            grenoble_model, grenoble_model.data.iloc[rows]))
+        parameters = np.linspace(-0.5, 0.5, len(interface.parameter_names))
+        subset = interface.engine.subset(rows)
+        assert subset.log_likelihood(parameters) == pytest.approx(
+            expected.log_likelihood(parameters), rel=1.0e-12)
+
+    def test_final_log_likelihood(self, grenoble_model,
+                                  reference_estimation):
+        engine = reference_estimation.engine
+        result = stochastic_maximise(engine, engine.initial_parameters(),
+                                     batch_size=100, epochs=5)
+        assert result.success
+        assert result.stochastic_iterations == 5 * 10
+        assert result.log_likelihood == pytest.approx(
+            reference_estimation.final_log_likelihood(), rel=1.0e-10)
+        assert result.hess is not None
+
+    def test_stochastic_phase(self):
+        # Without Newton iterations the parameters approach the maximum of a
+        # well scaled model. The synthetic data is drawn from NumPy's global
+        # generator, so fix it to make the test independent of other tests
+        np.random.seed(0)
+        model = choice_model.synthetic_model(
+            title='Synthetic', number_of_alternatives=5,
+            number_of_variables=3)
+        model.data = choice_model.synthetic_data(model, 5000)
+        engine = choice_model.NativeInterface(model, engine='numpy').engine
+        initial_parameters = engine.initial_parameters()
+        maximum = maximise(engine.log_likelihood_and_gradient,
+                           initial_parameters, 'newton',
+                           hessian=engine.hessian)
+        result = stochastic_maximise(engine, initial_parameters,
+                                     batch_size=500, epochs=10,
+                                     maximum_iterations=0)
+        assert result.stochastic_iterations == 100
+        assert result.nit == 0
+        # Most of the distance to the maximum is covered
+        assert (maximum.log_likelihood - result.log_likelihood < 0.02 * (
+            maximum.log_likelihood
+            - engine.log_likelihood(initial_parameters)))
+
+    def test_unsupported(self, main_data_dir):
+        with open(main_data_dir+'grenoble_nested.yml') as model_file,\
+                open(main_data_dir+'grenoble.csv') as data_file:
+            model = choice_model.NestedLogit.from_yaml(model_file)
+            model.load_data(data_file)
+        interface = choice_model.NativeInterface(model)
+        with pytest.raises(ValueError):
+            stochastic_maximise(interface.engine,
+                                interface.engine.initial_parameters())
+        with pytest.raises(ValueError):
+            interface.estimate('adam')
+
+
+class TestNativeMethods():
+    @pytest.mark.parametrize('method,tolerance', [
+        ('BFGS', 1.0e-8),
+        ('trust-exact', 1.0e-10),
+        ('trust-ncg', 1.0e-8),
+        ('bhhh', 1.0e-8),
+        ('adam', 1.0e-10),
+        ('l-bfgs', 1.0e-2)
+        ])
+    def test_final_log_likelihood(self, grenoble_model, reference_estimation,
+                                  method, tolerance):
+        interface = choice_model.NativeInterface(grenoble_model)
+        interface.estimate(method)
+        assert interface.final_log_likelihood() == pytest.approx(
+            reference_estimation.final_log_likelihood(), rel=tolerance)
+
+    def test_newton(self, reference_estimation):
+        result = reference_estimation.optimization_result
+        assert result.success
+        assert result.nit < 10
+        # The Hessian evaluated at the optimum gives the covariance
+        engine = reference_estimation.engine
+        assert reference_estimation.covariance() == pytest.approx(
+            np.linalg.inv(-engine.hessian(result.x)))
+
+    def test_tolerances(self, grenoble_model, reference_estimation):
+        interface = choice_model.NativeInterface(grenoble_model)
+        interface.estimate('newton', gradient_tolerance=1.0e-10,
+                           loss_tolerance=0.)
+        assert np.max(np.abs(interface.optimization_result.jac)) <= 1.0e-10
+        assert interface.final_log_likelihood() == pytest.approx(
+            reference_estimation.final_log_likelihood(), rel=1.0e-12)
+
+    def test_bhhh_unsupported(self, main_data_dir):
+        with open(main_data_dir+'grenoble_nested.yml') as model_file,\
+                open(main_data_dir+'grenoble.csv') as data_file:
+            model = choice_model.NestedLogit.from_yaml(model_file)
+            model.load_data(data_file)
+        interface = choice_model.NativeInterface(model)
+        with pytest.raises(ValueError):
+            interface.estimate('bhhh')
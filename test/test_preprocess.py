@@ -0,0 +1,106 @@
+import choice_model
+from choice_model.preprocess import (evaluate, expression_columns,
+                                     InvalidExpression, Preprocessor,
+                                     UndefinedColumn)
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture(scope='module')
+def records():
+    return pd.DataFrame({
+        'mode': [1, 5, 9, 5],
+        'cars': [0, 2, 1, np.nan],
+        'licences': [0, 1, 2, 1],
+        'dist': [500., 8000., 3000., 100.]
+        })
+
+
+class TestExpressions():
+    def test_columns(self):
+        assert expression_columns(
+            'where(a > 0, minimum(b / a, 1), c) + a') == ['a', 'b', 'c']
+
+    def test_evaluate(self):
+        columns = {'a': np.array([0., 2.]), 'b': np.array([1., 1.])}
+        assert evaluate('where(a > 0, b / a, -1)', columns) == (
+            pytest.approx([-1., 0.5]))
+
+    @pytest.mark.parametrize('expression', [
+        'a.sum()', '__import__("os")', 'a +'])
+    def test_invalid(self, expression):
+        with pytest.raises(InvalidExpression):
+            evaluate(expression, {'a': np.ones(2)})
+
+    def test_undefined(self):
+        with pytest.raises(UndefinedColumn):
+            evaluate('a + b', {'a': np.ones(2)})
+
+
+@pytest.fixture(scope='module')
+def preprocessor():
+    return Preprocessor(
+        fill_missing=0, dtype=float,
+        recode={'mode': {'values': {'walk': [1], 'car': [5]},
+                         'default': 'other'}},
+        derived={'avail_car': 'cars > 0',
+                 'avail_walk': 'dist <= 6000',
+                 'competition': 'where(licences > 0,'
+                                ' minimum(cars / licences, 1), 0.)',
+                 'cost': 75.9},
+        filters=["mode != 'other'"],
+        choice_availability={
+            'choice_column': 'mode',
+            'availability': {'walk': 'avail_walk', 'car': 'avail_car'}},
+        drop=['licences'])
+
+
+class TestPreprocessor():
+    def test_apply(self, preprocessor, records):
+        data = preprocessor.apply(records)
+        assert list(data.columns) == ['mode', 'cars', 'dist', 'avail_car',
+                                      'avail_walk', 'competition', 'cost']
+        # The third record has another mode and the fourth chooses an
+        # unavailable car
+        assert list(data.index) == [0, 1]
+        assert list(data['mode']) == ['walk', 'car']
+        assert list(data['avail_car']) == [0, 1]
+        assert data['avail_car'].dtype == np.int64
+        assert list(data['competition']) == [0., 1.]
+        assert list(data['cost']) == [75.9, 75.9]
+
+    def test_dropped(self, preprocessor, records):
+        preprocessor.apply(records)
+        assert preprocessor.dropped == {"mode != 'other'": 1,
+                                        'walk not available': 0,
+                                        'car not available': 1}
+
+    def test_keep_codes(self, records):
+        preprocessor = Preprocessor(recode={'mode': {'values': {'car': [5]}}})
+        assert list(preprocessor.apply(records)['mode']) == [
+            1, 'car', 9, 'car']
+
+    def test_compiled(self, preprocessor):
+        assert Preprocessor.from_dict(
+            preprocessor.to_dict()).to_dict() == preprocessor.to_dict()
+
+
+def test_grenoble(main_data_dir):
+    # The declared preparation reproduces the Grenoble data
+    field_widths = ([4, 2]+[1]*12+[2]+[1]*2+[2]+[1]*2+[2]*2+[1]*2+[4]*2
+                    + [2]*2+[4, 2]+[4]*2+[5]+[4]*4)
+    field_names = (
+        ['d1', 'd2', 'd3', 'worklic', 'd5', 'nwlic', 'd7', 'd8', 'd9',
+         'cars', 'd11', 'd12', 'd13', 'sex', 'd15', 'household_position',
+         'driving_licences', 'occupation', 'd19', 'd20', 'd21', 'mode',
+         'd23', 'd24', 'pt_owalk_h', 'pt_dwalk_h', 'origin_zone',
+         'destination_zone', 'pt_tot', 'pt_lines', 'pt_owalk', 'pt_dwalk',
+         'dist', 'car_time', 'park_orig', 'park_dest', 'pt_wait'])
+    records = pd.read_fwf(main_data_dir+'grenoble.dat', widths=field_widths,
+                          header=None, names=field_names)
+    with open(main_data_dir+'grenoble_preprocess.yml') as definition:
+        preprocessor = choice_model.Preprocessor.from_yaml(definition)
+    data = preprocessor.apply(records).reset_index(drop=True)
+    expected = pd.read_csv(main_data_dir+'grenoble.csv')
+    pd.testing.assert_frame_equal(data, expected, check_dtype=False)
@@ -0,0 +1,127 @@
+import choice_model
+from choice_model.analysis import logsums
+from choice_model.scoring import InvalidArtifact, Scorer
+import numpy as np
+import pytest
+import subprocess
+import sys
+
+
+@pytest.fixture(scope='module')
+def grenoble_estimation(main_data_dir):
+    with open(main_data_dir+'grenoble_derived.yml') as model_file,\
+            open(main_data_dir+'grenoble.csv') as data_file:
+        model = choice_model.MultinomialLogit.from_yaml(model_file)
+        model.load_data(data_file)
+    interface = choice_model.NativeInterface(model)
+    interface.estimate('newton')
+    return interface
+
+
+@pytest.fixture(scope='module')
+def scorer(grenoble_estimation, tmp_path_factory):
+    path = tmp_path_factory.mktemp('scorer') / 'grenoble.npz'
+    Scorer.from_interface(grenoble_estimation).save(path)
+    return Scorer.load(path)
+
+
+@pytest.fixture(scope='module')
+def score_data(grenoble_estimation, scorer):
+    # Only the raw fields, without the choice column or derived fields
+    data = grenoble_estimation.model.data
+    return {field: data[field].to_numpy() for field in scorer.raw_fields}
+
+
+class TestScorer():
+    def test_fields(self, scorer):
+        assert scorer.alternatives == ['public_transport', 'car', 'cycle',
+                                       'walk', 'passenger']
+        assert 'mode' not in scorer.raw_fields
+        assert 'public_transport_cost' not in scorer.raw_fields
+
+    def test_parameters(self, grenoble_estimation, scorer):
+        assert scorer.parameters() == grenoble_estimation.parameters()
+        assert scorer.standard_errors() == pytest.approx(
+            grenoble_estimation.standard_errors())
+        assert scorer.t_values() == pytest.approx(
+            grenoble_estimation.t_values())
+        assert np.all(scorer.covariance()
+                      == grenoble_estimation.covariance())
+        assert scorer.title == grenoble_estimation.model.title
+        assert scorer.interface == 'native'
+
+    def test_probabilities(self, grenoble_estimation, scorer, score_data):
+        assert scorer.probabilities(score_data) == pytest.approx(
+            grenoble_estimation.probabilities().to_numpy(), abs=1.0e-12)
+
+    def test_dataframe(self, grenoble_estimation, scorer, score_data):
+        assert np.all(
+            scorer.probabilities(grenoble_estimation.model.data)
+            == scorer.probabilities(score_data))
+
+    def test_logsums(self, grenoble_estimation, scorer, score_data):
+        assert scorer.logsums(score_data) == pytest.approx(
+            logsums(grenoble_estimation).to_numpy(), abs=1.0e-12)
+
+    def test_unavailable(self, scorer, score_data):
+        data = dict(score_data)
+        for field in scorer.availability:
+            data[field] = np.zeros_like(data[field])
+        assert np.all(scorer.logsums(data) == -np.inf)
+        assert np.all(np.isnan(scorer.probabilities(data)))
+
+    def test_missing_unavailable(self, scorer, score_data):
+        data = dict(score_data)
+        data['car_cost'] = np.where(data['avail_car'] == 0, np.nan,
+                                    data['car_cost'])
+        assert np.all(scorer.probabilities(data)
+                      == scorer.probabilities(score_data))
+
+    def test_missing_field(self, scorer, score_data):
+        data = dict(score_data)
+        del data['car_time']
+        with pytest.raises(choice_model.model.MissingField):
+            scorer.probabilities(data)
+
+    def test_skim(self, grenoble_estimation, scorer, score_data, tmp_path):
+        # Look up car time in a matrix with a row for each observation
+        np.save(tmp_path / 'car_time.npy', score_data['car_time'][:, None])
+        derived = {'car_time': {'skim': str(tmp_path / 'car_time.npy'),
+                                'origin': 'origin_zone',
+                                'destination': 'destination_zone'}}
+        derived.update(scorer.derived)
+        skim_scorer = Scorer(
+            scorer.kernel, list(scorer.parameters().values()),
+            scorer.availability, derived=derived)
+        skim_scorer.save(tmp_path / 'skim.npz')
+        skim_scorer = Scorer.load(tmp_path / 'skim.npz')
+        assert 'car_time' not in skim_scorer.raw_fields
+
+        data = dict(score_data)
+        number_of_observations = len(data.pop('car_time'))
+        data['origin_zone'] = np.arange(number_of_observations)
+        data['destination_zone'] = np.zeros(number_of_observations)
+        assert np.all(skim_scorer.probabilities(data)
+                      == scorer.probabilities(score_data))
+
+    def test_invalid(self, tmp_path):
+        np.savez(tmp_path / 'other.npz', parameters=np.zeros(3))
+        with pytest.raises(InvalidArtifact):
+            Scorer.load(tmp_path / 'other.npz')
+
+    def test_lightweight(self, scorer, score_data, tmp_path):
+        # Loading and scoring should not import the back ends, pandas or
+        # yaml
+        scorer.save(tmp_path / 'grenoble.npz')
+        np.savez(tmp_path / 'data.npz', **score_data)
+        statement = (
+            'import sys; from choice_model.scoring import Scorer;'
+            ' import numpy as np;'
+            ' scorer = Scorer.load({!r});'
+            ' scorer.probabilities(np.load({!r}));'
+            ' print([module for module in ("pandas", "pylogit", "scipy",'
+            ' "yaml") if module in sys.modules])').format(
+                str(tmp_path / 'grenoble.npz'), str(tmp_path / 'data.npz'))
+        process = subprocess.run([sys.executable, '-c', statement],
+                                 stdout=subprocess.PIPE, check=True)
+        assert process.stdout.decode('utf-8').strip() == '[]'
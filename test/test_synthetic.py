@@ -118,3 +118,10 @@ class TestSyntheticDataUniform():
     def test_alternatives(self, synthetic_data_uniform, synthetic_model):
         assert all(synthetic_data_uniform['choice'].apply(
             lambda x: x in synthetic_model.alternatives))
+
+
+def test_large_model():
+    model = choice_model.synthetic_model(
+        title='Large', number_of_alternatives=20, number_of_variables=2000)
+    assert all(len(model.specification[alternative].terms) == 2000
+               for alternative in model.alternatives)
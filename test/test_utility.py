@@ -82,3 +82,17 @@ class TestIntercept():
                 intercept='c',
                 parameters=['param1', 'param2']
                 )
+
+
+def test_from_terms(simple_utility):
+    utility = choice_model.Utility.from_terms(
+        [('var1', 'param1'), ('var2', 'param2')], 'c')
+    assert utility == simple_utility
+    assert utility.term_dict == simple_utility.term_dict
+
+
+def test_set_arguments(simple_utility):
+    utility = choice_model.Utility('c + var1*param1 + param2*var2',
+                                   {'var1', 'var2'}, 'c',
+                                   frozenset(['param1', 'param2']))
+    assert utility == simple_utility